@@ -0,0 +1,106 @@
+# amortization.py
+"""
+Пакетный расчёт графиков платежей для всего портфеля (отчёты, напоминания).
+
+Результат совпадает с utils.generate_schedule для каждого договора:
+- платёж i — в месяце (месяц договора + i), день = min(payday, дней в месяце);
+- ежемесячный платёж — остаток / срок с округлением вверх до рубля,
+  последний платёж — то, что осталось.
+
+Вместо relativedelta на каждый платёж — арифметика NumPy по всем платежам сразу
+и таблица длин месяцев, посчитанная один раз на весь диапазон дат.
+"""
+from typing import List, NamedTuple, Sequence
+
+import numpy as np
+
+
+class PortfolioSchedule(NamedTuple):
+    """
+    Графики всех договоров в плоских массивах: платежи договора i —
+    срез offsets[i]:offsets[i + 1] массивов dates/amounts/balances.
+    """
+    offsets: np.ndarray   # int64, длина n + 1
+    dates: np.ndarray     # datetime64[D]
+    amounts: np.ndarray   # int64
+    balances: np.ndarray  # int64
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def schedule(self, i: int) -> List[dict]:
+        """
+        График договора i в формате generate_schedule.
+        """
+        a, b = int(self.offsets[i]), int(self.offsets[i + 1])
+        return [
+            {"date": d.strftime("%d.%m.%Y"), "amount": int(amount), "balance": int(balance)}
+            for d, amount, balance in zip(self.dates[a:b].astype(object), self.amounts[a:b], self.balances[a:b])
+        ]
+
+
+def _int_array(values, name: str) -> np.ndarray:
+    arr = np.asarray(values)
+    if arr.ndim != 1:
+        raise ValueError(f"{name}: one-dimensional array expected")
+    if arr.size and not np.issubdtype(arr.dtype, np.integer):
+        as_int = arr.astype(np.int64)
+        if not np.array_equal(as_int, arr):
+            raise ValueError(f"{name}: whole rubles expected")
+        arr = as_int
+    return arr.astype(np.int64)
+
+
+def portfolio_schedules(
+    start_dates: Sequence,
+    terms: Sequence[int],
+    paydays: Sequence[int],
+    costs: Sequence[int],
+    advances: Sequence[int],
+) -> PortfolioSchedule:
+    """
+    Графики платежей для n договоров: i-й элемент каждого массива — параметры
+    generate_schedule(start_dates[i], terms[i], paydays[i], costs[i], advances[i]).
+    Даты — datetime/date или datetime64; суммы — целые рубли.
+    """
+    start = np.asarray(start_dates, dtype="datetime64[D]")
+    terms = _int_array(terms, "terms")
+    paydays = _int_array(paydays, "paydays")
+    costs = _int_array(costs, "costs")
+    advances = _int_array(advances, "advances")
+
+    n = len(start)
+    if not len(terms) == len(paydays) == len(costs) == len(advances) == n:
+        raise ValueError("all arrays must have the same length")
+    if n and terms.min() < 1:
+        raise ValueError("terms: positive integers expected")
+    if n and paydays.min() < 1:
+        raise ValueError("paydays: positive integers expected")
+
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(terms, out=offsets[1:])
+    total = int(offsets[-1])
+    if total == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return PortfolioSchedule(offsets, np.zeros(0, dtype="datetime64[D]"), empty, empty.copy())
+
+    # Номер договора и номер платежа (1..term) для каждой строки плоских массивов
+    contract = np.repeat(np.arange(n), terms)
+    k = np.arange(total, dtype=np.int64) - offsets[contract] + 1
+
+    # Месяц платежа — в месяцах от 1970-01; длины месяцев — одной таблицей на весь диапазон
+    month = start.astype("datetime64[M]").astype(np.int64)[contract] + k
+    lo = int(month.min())
+    first_days = np.arange(lo, int(month.max()) + 2).astype("datetime64[M]").astype("datetime64[D]")
+    month_len = np.diff(first_days).astype(np.int64)
+    idx = month - lo
+    dates = first_days[idx] + (np.minimum(paydays[contract], month_len[idx]) - 1)
+
+    # Платёж = ceil(остаток / срок); остаток после i-го платежа не уходит ниже нуля
+    balance = np.maximum(costs - advances, 0)
+    base = -(-balance // terms)
+    balance, base = balance[contract], base[contract]
+    balances = np.maximum(balance - k * base, 0)
+    amounts = np.maximum(balance - (k - 1) * base, 0) - balances
+
+    return PortfolioSchedule(offsets, dates, amounts, balances)
@@ -0,0 +1,295 @@
+# batch.py
+"""
+Пакетная генерация договоров из CSV/JSONL.
+
+Строка файла — те же поля, что собирает диалог (user_data), плюс contract_type:
+    contract_type=murabaha: data_dogovora, fio_prodavca, fio_pokupatelya, tel_pokupatelya,
+        fio_poruchitelya1, tel_poruchit1, pokupaemy_tov, kolichestvo_tov, sebestoimost_tovara,
+        nacenka_tov, pervi_vznos, srok_dogov, data_opl, zalog
+    contract_type=istisna: data_dogovora, buyer_fio, buyer_address, buyer_passport_series_number,
+        buyer_passport_issued_by, supplier_fio, supplier_address, manufacturing_days,
+        supplier_phone, buyer_phone, item_name, item_price, item_qty, [total_cost_final]
+        вместо item_name/item_price/item_qty можно items: строки «наименование; цена; количество»
+        (в JSONL — и список объектов {"name", "price", "qty"})
+
+    python batch.py rows.csv -o contracts.zip [--workers 4]
+
+Результат — один zip: документы всех строк + report.csv (статус и ошибка по каждой строке).
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import math
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import BinaryIO, Iterable, List, NamedTuple, Optional
+
+from contract_data import ItemLineError, generation_job, items_total, make_item, parse_items_block
+from contract_number import generate_contract_number, release_contract_number
+from docx_generator import preload_templates
+from utils import round_up_amount
+
+_MURABAHA_TEXT_FIELDS = (
+    "fio_prodavca", "fio_pokupatelya", "tel_pokupatelya",
+    "fio_poruchitelya1", "tel_poruchit1", "pokupaemy_tov",
+)
+_ISTISNA_TEXT_FIELDS = (
+    "buyer_fio", "buyer_address", "buyer_passport_series_number", "buyer_passport_issued_by",
+    "supplier_fio", "supplier_address", "supplier_phone", "buyer_phone",
+)
+
+
+class BatchRowError(ValueError):
+    """
+    Строка пакета не прошла проверку.
+    """
+
+
+class BatchRow(NamedTuple):
+    number: int
+    data: dict
+    error: Optional[str] = None
+
+
+class BatchResult(NamedTuple):
+    number: int
+    status: str
+    contract_number: str = ""
+    files: str = ""
+    error: str = ""
+
+
+def read_rows(data: bytes, filename: str = "") -> List[BatchRow]:
+    """
+    Читает строки CSV (разделитель , ; или таб) или JSONL (по расширению или первому символу).
+    Битые строки JSONL попадают в результат с ошибкой, а не валят весь пакет.
+    """
+    text = data.decode("utf-8-sig")
+    name = filename.lower()
+    if name.endswith((".jsonl", ".json", ".ndjson")) or text.lstrip().startswith("{"):
+        rows = []
+        for n, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                rows.append(BatchRow(n, {}, f"invalid JSON: {e}"))
+                continue
+            if not isinstance(item, dict):
+                rows.append(BatchRow(n, {}, "row must be a JSON object"))
+                continue
+            rows.append(BatchRow(n, item))
+        return rows
+
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(io.StringIO(text), dialect=dialect)
+    # номер строки файла: заголовок — строка 1
+    return [BatchRow(n, row) for n, row in enumerate(reader, start=2)]
+
+
+def _text(row: dict, key: str) -> str:
+    value = str(row.get(key) or "").strip()
+    if not value:
+        raise BatchRowError(f"{key}: required")
+    return value
+
+
+def _positive_int(row: dict, key: str) -> int:
+    s = str(row.get(key) or "").strip()
+    if not s.isdigit() or int(s) <= 0:
+        raise BatchRowError(f"{key}: positive integer expected, got {s!r}")
+    return int(s)
+
+
+def _int_range(row: dict, key: str, lo: int, hi: int) -> int:
+    s = str(row.get(key) or "").strip()
+    if not s.isdigit() or not lo <= int(s) <= hi:
+        raise BatchRowError(f"{key}: integer {lo}–{hi} expected, got {s!r}")
+    return int(s)
+
+
+def _money(row: dict, key: str) -> int:
+    s = str(row.get(key) if row.get(key) is not None else "").strip()
+    try:
+        value = float(s.replace(",", "."))
+    except ValueError:
+        raise BatchRowError(f"{key}: number expected, got {s!r}") from None
+    # inf/nan float() принимает, но суммой договора они быть не могут
+    if not math.isfinite(value):
+        raise BatchRowError(f"{key}: finite number expected, got {s!r}")
+    return round_up_amount(value)
+
+
+def _items(row: dict) -> list:
+    raw = row.get("items")
+    try:
+        if isinstance(raw, list):
+            items = []
+            for n, item in enumerate(raw, start=1):
+                if not isinstance(item, dict):
+                    raise ItemLineError(f"строка {n}: ожидается объект")
+                try:
+                    items.append(make_item(item.get("name"), item.get("price", ""), item.get("qty", 1)))
+                except ItemLineError as e:
+                    raise ItemLineError(f"строка {n}: {e}") from None
+            if not items:
+                raise ItemLineError("список товаров пуст")
+            return items
+        return parse_items_block(str(raw))
+    except ItemLineError as e:
+        raise BatchRowError(f"items: {e}") from None
+
+
+def normalize_row(row: dict) -> dict:
+    """
+    Приводит строку пакета к виду user_data (с теми же проверками, что в диалоге).
+    """
+    kind = str(row.get("contract_type") or "").strip().lower()
+    if "мурабах" in kind or kind == "murabaha":
+        contract_type = "murabaha"
+    elif "истисн" in kind or kind == "istisna":
+        contract_type = "istisna"
+    else:
+        raise BatchRowError(f"contract_type: murabaha or istisna expected, got {kind!r}")
+
+    try:
+        dt = datetime.strptime(_text(row, "data_dogovora"), "%d.%m.%Y")
+    except ValueError:
+        raise BatchRowError("data_dogovora: DD.MM.YYYY expected") from None
+
+    ud = {
+        "contract_type": contract_type,
+        "data_dogovora_dt": dt,
+        "data_dogovora": dt.strftime("%d.%m.%Y"),
+    }
+
+    if contract_type == "murabaha":
+        for key in _MURABAHA_TEXT_FIELDS:
+            ud[key] = _text(row, key)
+        ud["kolichestvo_tov"] = _positive_int(row, "kolichestvo_tov")
+        ud["sebestoimost_tovara"] = _money(row, "sebestoimost_tovara")
+        ud["nacenka_tov"] = _money(row, "nacenka_tov")
+        ud["pervi_vznos"] = _money(row, "pervi_vznos")
+        ud["srok_dogov"] = _positive_int(row, "srok_dogov")
+        ud["data_opl"] = _int_range(row, "data_opl", 1, 31)
+        zalog = _text(row, "zalog").capitalize()
+        if zalog not in ("Да", "Нет"):
+            raise BatchRowError(f"zalog: Да or Нет expected, got {zalog!r}")
+        ud["zalog"] = zalog
+    else:
+        for key in _ISTISNA_TEXT_FIELDS:
+            ud[key] = _text(row, key)
+        ud["manufacturing_days"] = _int_range(row, "manufacturing_days", 0, 360)
+        if row.get("items"):
+            ud["items"] = _items(row)
+        else:
+            ud["items"] = [{
+                "name": _text(row, "item_name"),
+                "price": _money(row, "item_price"),
+                "qty": _positive_int(row, "item_qty"),
+            }]
+        ud["total_cost_auto"] = items_total(ud["items"])
+        if str(row.get("total_cost_final") or "").strip():
+            ud["total_cost_final"] = _money(row, "total_cost_final")
+        else:
+            ud["total_cost_final"] = ud["total_cost_auto"]
+
+    return ud
+
+
+def generate_batch(rows: Iterable[BatchRow], out: BinaryIO, workers: Optional[int] = None) -> List[BatchResult]:
+    """
+    Проверяет строки, выдаёт номера через generate_contract_number (по порядку строк),
+    рендерит документы в пуле процессов и пишет их в zip out по мере готовности.
+    Номер строки, которая не отрендерилась, возвращается в выдачу — нумерация без пропусков.
+    В конце в архив добавляется report.csv. Возвращает результаты по строкам.
+    """
+    results = {}
+    jobs = []
+    for row in rows:
+        if row.error:
+            results[row.number] = BatchResult(row.number, "error", error=row.error)
+            continue
+        try:
+            ud = normalize_row(row.data)
+        except BatchRowError as e:
+            results[row.number] = BatchResult(row.number, "error", error=str(e))
+            continue
+        ud["contract_number"] = generate_contract_number(ud["data_dogovora_dt"])
+        generator, repl = generation_job(ud)
+        jobs.append((row.number, ud, generator, repl))
+
+    with zipfile.ZipFile(out, "w") as zf:
+        if jobs:
+            with ProcessPoolExecutor(max_workers=workers, initializer=preload_templates) as pool:
+                futures = {
+                    pool.submit(generator, repl): (number, ud)
+                    for number, ud, generator, repl in jobs
+                }
+                for future in as_completed(futures):
+                    number, ud = futures[future]
+                    contract_number = ud["contract_number"]
+                    try:
+                        docs = future.result()
+                    except Exception as e:
+                        logging.exception("Batch row %d failed", number)
+                        release_contract_number(ud["data_dogovora_dt"], contract_number)
+                        results[number] = BatchResult(number, "error", error=str(e) or type(e).__name__)
+                        continue
+                    # DOCX уже сжат — кладём без повторного сжатия
+                    for doc in docs:
+                        zf.writestr(doc.filename, doc.content)
+                    results[number] = BatchResult(
+                        number, "ok", contract_number, files=" ".join(d.filename for d in docs),
+                    )
+
+        report = io.StringIO()
+        writer = csv.writer(report)
+        writer.writerow(BatchResult._fields)
+        ordered = [results[n] for n in sorted(results)]
+        writer.writerows(ordered)
+        zf.writestr("report.csv", report.getvalue().encode("utf-8-sig"))
+
+    return ordered
+
+
+def run_batch(data: bytes, filename: str = "", workers: Optional[int] = None):
+    """
+    Пакет целиком в памяти: (байты zip, результаты по строкам).
+    """
+    buf = io.BytesIO()
+    results = generate_batch(read_rows(data, filename), buf, workers=workers)
+    return buf.getvalue(), results
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Пакетная генерация договоров из CSV/JSONL.")
+    parser.add_argument("input", help="CSV или JSONL со строками договоров")
+    parser.add_argument("-o", "--output", required=True, help="куда записать zip")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="процессов для рендеринга")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+    with open(args.input, "rb") as f:
+        rows = read_rows(f.read(), args.input)
+    with open(args.output, "wb") as out:
+        results = generate_batch(rows, out, workers=args.workers)
+
+    failed = [r for r in results if r.status != "ok"]
+    for r in failed:
+        logging.error("row %d: %s", r.number, r.error)
+    logging.info("Done: %d ok, %d failed → %s", len(results) - len(failed), len(failed), args.output)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
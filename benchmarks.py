@@ -0,0 +1,261 @@
+# benchmarks.py
+"""
+Бенчмарки горячих путей генерации.
+
+    python benchmarks.py -o bench.json                  # прогон, результаты в JSON
+    python benchmarks.py -o new.json --compare old.json # сравнить с прошлым прогоном
+    python benchmarks.py --filter istisna --quick       # часть кейсов, меньше повторов
+
+Всё локально: шаблоны из templates/, счётчик номеров — во временном каталоге
+(data/ не трогается).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from docx import Document
+
+import contract_number
+import docx_generator
+from amortization import portfolio_schedules
+from docx_generator import fill_placeholders, generate_istisna_documents, get_compiled_template
+from paths import ISTISNA_TEMPLATE, PROJECT_ROOT, TEMPLATE_CONTRACT, TEMPLATE_SCHEDULE
+from utils import generate_schedule
+
+
+def _murabaha_data() -> dict:
+    schedule = generate_schedule(datetime(2025, 1, 31), 12, 31, 120001, 1000)
+    data = {
+        "{{nomer_dogovora}}": "1-25/01/31",
+        "{{data_dogovora}}": "31.01.2025",
+        "{{fio_prodavca}}": "Иванов Иван Иванович",
+        "{{fio_pokupatelya}}": "Петров Пётр Петрович",
+        "{{tel_pokupatelya}}": "+7 900 000-00-00",
+        "{{fio_poruchitelya1}}": "Сидоров Сидор Сидорович",
+        "{{tel_poruchit1}}": "+7 900 000-00-01",
+        "{{pokupaemy_tov}}": "Смартфон",
+        "{{kolichestvo_tov}}": 2,
+        "{{polnaya_stoimost_tov}}": 120001,
+        "{{sebestoimost_tovara}}": 100000,
+        "{{nacenka_tov}}": 20001,
+        "{{pervi_vznos}}": 1000,
+        "{{srok_dogov}}": 12,
+        "{{ejemes_oplata}}": schedule[0]["amount"],
+        "{{data_opl}}": 31,
+        "{{zalog}}": "Да",
+        "{{ostatok_dolga}}": 119001,
+        "schedule": schedule,
+        "contract_number": "1-25/01/31",
+    }
+    return data
+
+
+def _istisna_data(qty: int) -> dict:
+    return {
+        "{{nomer_dogovora}}": "2-25/01/31",
+        "{{data_dogovora}}": "31.01.2025",
+        "{{buyer_fio}}": "Петров Пётр Петрович",
+        "{{buyer_address}}": "г. Москва, ул. Ленина, д. 1",
+        "{{buyer_passport_series_number}}": "1234 567890",
+        "{{buyer_passport_issued_by}}": "ОВД района",
+        "{{supplier_fio}}": "Иванов Иван Иванович",
+        "{{supplier_address}}": "г. Казань",
+        "{{manufacturing_days}}": 30,
+        "{{supplier_phone}}": "+7 900 000-00-02",
+        "{{buyer_phone}}": "+7 900 000-00-03",
+        "{{item_name}}": "Диван угловой",
+        "{{item_price}}": 1000,
+        "{{item_qty}}": qty,
+        "{{total_cost_final}}": 1000 * qty,
+        "contract_number": "2-25/01/31",
+    }
+
+
+def _split_template(path: Path, runs_per_placeholder: int, placeholders: int = 40) -> dict:
+    """
+    Синтетический шаблон: каждый плейсхолдер разбит на runs_per_placeholder runs
+    (как после правки шаблона в Word). Возвращает mapping для него.
+    """
+    doc = Document()
+    mapping = {}
+    for i in range(placeholders):
+        key = f"{{{{field{i}}}}}"
+        mapping[key] = f"значение {i}"
+        para = doc.add_paragraph("Поле: ")
+        size = max(1, -(-len(key) // runs_per_placeholder))
+        for j in range(0, len(key), size):
+            para.add_run(key[j:j + size])
+        para.add_run(" — конец абзаца.")
+    doc.save(str(path))
+    return mapping
+
+
+def _allocate(args):
+    counter_db, count = args
+    contract_number.COUNTER_FILE = Path(counter_db).with_suffix(".json")
+    contract_number.configure_numbering(contract_number.SqliteBackend(counter_db), lease_size=1)
+    dt = datetime(2025, 1, 31)
+    started = time.perf_counter()
+    for _ in range(count):
+        contract_number.generate_contract_number(dt)
+    return time.perf_counter() - started
+
+
+def _timed(func: Callable, repeat: int, warmup: int = 1) -> List[float]:
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def build_cases(tmp: Path, quick: bool) -> Dict[str, Callable[[], None]]:
+    cases = {}
+    murabaha = _murabaha_data()
+
+    for name, template, data, font in (
+        ("contract", TEMPLATE_CONTRACT, murabaha, None),
+        ("schedule", TEMPLATE_SCHEDULE, murabaha, None),
+        ("istisna", ISTISNA_TEMPLATE, _istisna_data(1), ("Aptos", 11)),
+    ):
+        out = tmp / f"{name}.docx"
+        cases[f"fill_placeholders/{name}"] = (
+            lambda t=template, o=out, d=data, f=font: fill_placeholders(t, o, d, preferred_font=f)
+        )
+        cases[f"template_compile/{name}"] = (
+            lambda t=template: docx_generator.CompiledTemplate(Path(t).resolve())
+        )
+
+    for qty in ((1, 10, 100) if quick else (1, 10, 100, 1000)):
+        data = _istisna_data(qty)
+        cases[f"istisna_items/{qty}"] = lambda d=data: generate_istisna_documents(d)
+
+    for lines in ((10, 100) if quick else (10, 100, 1000)):
+        data = dict(_istisna_data(1), items=[(f"Товар {i}", 1000 + i, 1 + i % 3) for i in range(lines)])
+        cases[f"istisna_lines/{lines}"] = lambda d=data: generate_istisna_documents(d)
+
+    for n_runs in (1, 4, 16):
+        path = tmp / f"split_{n_runs}.docx"
+        mapping = _split_template(path, n_runs)
+        get_compiled_template(path)
+        cases[f"split_runs/{n_runs}"] = lambda p=path, m=mapping: fill_placeholders(p, tmp / "split_out.docx", m)
+
+    for term in (12, 60, 360):
+        cases[f"generate_schedule/{term}"] = (
+            lambda t=term: generate_schedule(datetime(2025, 1, 31), t, 31, 10_000_000, 100_000)
+        )
+
+    for n in ((100, 1000) if quick else (100, 1000, 10000)):
+        portfolio = (
+            [datetime(2024, 1, 1 + i % 28) for i in range(n)],
+            [12 + i % 49 for i in range(n)],
+            [1 + i % 31 for i in range(n)],
+            [100_000 + i for i in range(n)],
+            [i % 5000 for i in range(n)],
+        )
+        cases[f"portfolio_schedules/{n}"] = lambda p=portfolio: portfolio_schedules(*p)
+
+    for procs in ((1, 4) if quick else (1, 4, 8)):
+        per_proc = 50 if quick else 200
+
+        def contention(p=procs, n=per_proc):
+            counter_db = tmp / f"counter_{p}_{time.perf_counter_ns()}.sqlite3"
+            with multiprocessing.Pool(p) as pool:
+                pool.map(_allocate, [(str(counter_db), n)] * p)
+        cases[f"contract_number/{procs}x{per_proc}"] = contention
+
+    return cases
+
+
+def _summary(samples: List[float]) -> dict:
+    return {
+        "n": len(samples),
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PROJECT_ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> List[str]:
+    """
+    Кейсы, у которых медиана выросла больше чем в threshold раз.
+    """
+    regressions = []
+    for name, res in sorted(current["results"].items()):
+        old = baseline.get("results", {}).get(name)
+        if not old:
+            print(f"{name:40s} {res['median'] * 1000:10.2f} ms   (new)")
+            continue
+        ratio = res["median"] / old["median"] if old["median"] else float("inf")
+        mark = "  REGRESSION" if ratio > threshold else ""
+        print(f"{name:40s} {res['median'] * 1000:10.2f} ms   x{ratio:5.2f} vs {old['median'] * 1000:.2f} ms{mark}")
+        if mark:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарки генерации документов.")
+    parser.add_argument("-o", "--output", help="записать результаты в JSON")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=1.2, help="во сколько раз медиана может вырасти")
+    parser.add_argument("--filter", default="", help="подстрока имени кейса")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="меньше размеров и повторов")
+    args = parser.parse_args(argv)
+
+    repeat = 2 if args.quick else args.repeat
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="dogovorshik-bench-") as tmp:
+        for name, func in build_cases(Path(tmp), args.quick).items():
+            if args.filter not in name:
+                continue
+            results[name] = _summary(_timed(func, repeat))
+            print(f"{name:40s} {results[name]['median'] * 1000:10.2f} ms", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        if compare(report, baseline, args.threshold):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
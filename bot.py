@@ -8,13 +8,22 @@ from telegram.ext import Application, Defaults
 
 from paths import (
     TEMPLATES_DIR,
-    OUTPUT_DIR,
     DATA_DIR,
-    COUNTER_FILE,
     ISTISNA_TEMPLATE,
+    STATE_DB,
 )
 
-from handlers import conv_handler
+from handlers import conv_handler, batch_handlers
+from docx_generator import preload_templates
+from generation_pool import start_generation_pool, shutdown_generation_pool
+from generation_queue import start_generation_queue
+from pdf_pool import pdf_enabled, start_pdf_pool, shutdown_pdf_pool
+from contract_number import configure_numbering, release_unused_numbers
+from persistence import SqlitePersistence
+from webhook import run_webhook, shutdown_service_server, start_service_server
+from update_processor import ChatOrderedUpdateProcessor
+from rate_limiter import rate_limiter_from_env
+from telegram_http import requests_from_env
 
 
 def ensure_project_layout() -> None:
@@ -22,12 +31,8 @@ def ensure_project_layout() -> None:
     Создаёт нужные директории/файлы, если их нет.
     Предупреждает, если нет шаблонов.
     """
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
     DATA_DIR.mkdir(parents=True, exist_ok=True)
-
-    # Инициализируем counter.json, если пусто/нет
-    if not COUNTER_FILE.exists() or COUNTER_FILE.stat().st_size == 0:
-        COUNTER_FILE.write_text("{}", encoding="utf-8")
+    # База счётчиков номеров (data/counters.sqlite3) создаётся при первой выдаче номера
 
     # Проверяем наличие шаблонов
     missing = []
@@ -55,11 +60,28 @@ def setup_logging() -> None:
     logging.getLogger("telegram.vendor.ptb_urllib3.urllib3").setLevel(logging.WARNING)
 
 
-async def on_startup(_: Application) -> None:
-    logging.info("✅ dogovorshikbot started (polling)")
+def bot_mode() -> str:
+    """
+    BOT_MODE: polling (по умолчанию) или webhook.
+    """
+    mode = os.getenv("BOT_MODE", "polling").strip().lower()
+    if mode not in ("polling", "webhook"):
+        raise RuntimeError(f"Unknown BOT_MODE: {mode!r} (expected 'polling' or 'webhook')")
+    return mode
+
+
+async def on_startup(app: Application) -> None:
+    # Метрики Prometheus и health-check на локальном порту (METRICS_LISTEN, METRICS_PATH, HEALTH_PATH)
+    await start_service_server(app)
+    logging.info("✅ dogovorshikbot started (%s)", bot_mode())
 
 
 async def on_shutdown(_: Application) -> None:
+    await shutdown_service_server()
+    shutdown_generation_pool()
+    shutdown_pdf_pool()
+    # Невыданный остаток пачки номеров — обратно в общее хранилище
+    release_unused_numbers()
     logging.info("🛑 dogovorshikbot stopped")
 
 
@@ -67,18 +89,57 @@ def main() -> None:
     load_dotenv()
     setup_logging()
     ensure_project_layout()
+    # Шаблоны разбираются один раз, дальше каждый договор клонирует готовое дерево
+    preload_templates()
+    # Пул генерации DOCX (GENERATION_EXECUTOR / GENERATION_WORKERS / GENERATION_TIMEOUT)
+    start_generation_pool()
+    # Очередь заданий перед пулом (GENERATION_CONCURRENCY / GENERATION_QUEUE_SIZE)
+    start_generation_queue()
+    # PDF: пул прогретых конвертеров LibreOffice (PDF_OUTPUT=1, PDF_WORKERS, PDF_TIMEOUT, PDF_CONVERTER)
+    if pdf_enabled():
+        start_pdf_pool()
+    # Хранилище номеров договоров (NUMBER_BACKEND, NUMBER_LEASE)
+    configure_numbering()
 
     token = os.getenv("BOT_TOKEN")
     if not token:
         raise RuntimeError("BOT_TOKEN is not set. Put it into .env or env vars.")
+    mode = bot_mode()
 
     # Парсим HTML по умолчанию (для жирного текста и т.п.)
     defaults = Defaults(parse_mode=ParseMode.HTML)
 
-    app = Application.builder().token(token).defaults(defaults).build()
+    # Незавершённые диалоги — в SQLite, запись пачкой раз в STATE_FLUSH_INTERVAL сек
+    persistence = SqlitePersistence(
+        os.getenv("STATE_DB") or STATE_DB,
+        update_interval=float(os.getenv("STATE_FLUSH_INTERVAL", "5")),
+    )
+
+    # Обновления разных чатов — параллельно (до UPDATE_WORKERS), одного чата — по порядку
+    update_processor = ChatOrderedUpdateProcessor(
+        int(os.getenv("UPDATE_WORKERS", "16")),
+        log_interval=float(os.getenv("UPDATE_STATS_INTERVAL", "60")),
+    )
+
+    # Клиенты Bot API: отдельные для отправки и getUpdates (TG_POOL_SIZE, TG_*_TIMEOUT, TG_PROXY, TG_HTTP2)
+    request, updates_request = requests_from_env()
+
+    app = (
+        Application.builder()
+        .token(token)
+        .request(request)
+        .get_updates_request(updates_request)
+        .defaults(defaults)
+        .persistence(persistence)
+        .concurrent_updates(update_processor)
+        .rate_limiter(rate_limiter_from_env())
+        .build()
+    )
 
     # Хэндлер диалога (подключается один объект conv_handler)
     app.add_handler(conv_handler)
+    # Пакетная генерация из CSV/JSONL (/batch)
+    app.add_handlers(batch_handlers)
 
     # Хэндлер на ошибки — чтобы не падать молча
     async def error_handler(_, context):
@@ -90,8 +151,11 @@ def main() -> None:
     app.post_init = on_startup
     app.post_stop = on_shutdown
 
-    # Запуск
-    app.run_polling(close_loop=False)
+    # Запуск: long polling или webhook (Application.run_webhook, WEBHOOK_* в env)
+    if mode == "webhook":
+        run_webhook(app)
+    else:
+        app.run_polling(close_loop=False)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,183 @@
+# contract_data.py
+import re
+from decimal import Decimal, InvalidOperation
+from typing import Callable, List, Tuple
+
+from docx_generator import (
+    DocumentJob,
+    generate_contract_and_schedule,
+    generate_istisna_documents,
+    istisna_document_jobs,
+    murabaha_document_jobs,
+)
+from utils import generate_schedule, round_up_amount
+
+# Строка списка товаров Истисна: «наименование; цена; количество» (количество можно опустить)
+_ITEM_SEPARATOR_RE = re.compile(r"\s*[;\t|]\s*")
+
+
+class ItemLineError(ValueError):
+    """
+    Строка списка товаров не разобрана.
+    """
+
+
+def make_item(name, price, qty=1) -> dict:
+    """
+    Проверенная строка спецификации {"name", "price", "qty"}.
+    Цена округляется вверх до рубля, как и при пошаговом вводе.
+    """
+    name = str(name or "").strip()
+    if not name:
+        raise ItemLineError("пустое наименование")
+    try:
+        price = Decimal(str(price).replace(" ", "").replace(",", "."))
+    except InvalidOperation:
+        raise ItemLineError(f"цена — не число: {price!r}") from None
+    if not price.is_finite() or price < 0:
+        raise ItemLineError("цена должна быть неотрицательным числом")
+    qty = str(qty).strip()
+    if not qty.isdigit() or int(qty) <= 0:
+        raise ItemLineError(f"количество — положительное целое, получено {qty!r}")
+    return {"name": name, "price": round_up_amount(price), "qty": int(qty)}
+
+
+def parse_item_line(line: str) -> dict:
+    """
+    «Диван угловой, серый; 45000; 2» → {"name": ..., "price": 45000, "qty": 2}.
+    """
+    parts = _ITEM_SEPARATOR_RE.split(line.strip())
+    while parts and not parts[-1]:
+        parts.pop()
+    if len(parts) not in (2, 3):
+        raise ItemLineError("ожидается «наименование; цена; количество»")
+    return make_item(*parts)
+
+
+def parse_items_block(text: str) -> List[dict]:
+    """
+    Список товаров, вставленный одним сообщением: по строке на товар.
+    Пустые строки пропускаются; ошибка содержит номер строки.
+    """
+    items = []
+    for n, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            items.append(parse_item_line(line))
+        except ItemLineError as e:
+            raise ItemLineError(f"строка {n}: {e}") from None
+    if not items:
+        raise ItemLineError("список товаров пуст")
+    return items
+
+
+def istisna_items(ud: dict) -> List[dict]:
+    """
+    Товары Истисна из user_data; старые данные с одним товаром (item_name/item_price/item_qty)
+    дают список из одной строки.
+    """
+    if ud.get("items"):
+        return ud["items"]
+    return [{"name": ud["item_name"], "price": ud["item_price"], "qty": int(ud.get("item_qty", 1))}]
+
+
+def items_total(items: List[dict]) -> int:
+    """
+    Сумма спецификации: считается в Decimal, итог округляется вверх до рубля.
+    """
+    total = sum((Decimal(item["price"]) * item["qty"] for item in items), Decimal(0))
+    return round_up_amount(total)
+
+
+def istisna_replacements(ud: dict) -> dict:
+    """
+    Плейсхолдеры Истисна из собранных данных диалога (user_data).
+    Строки спецификации передаются отдельно, в repl["items"].
+    """
+    items = istisna_items(ud)
+    repl = {
+        "{{nomer_dogovora}}": ud["contract_number"],
+        "{{data_dogovora}}": ud["data_dogovora"],
+        "{{buyer_fio}}": ud["buyer_fio"],
+        "{{buyer_address}}": ud["buyer_address"],
+        "{{buyer_passport_series_number}}": ud["buyer_passport_series_number"],
+        "{{buyer_passport_issued_by}}": ud["buyer_passport_issued_by"],
+        "{{supplier_fio}}": ud["supplier_fio"],
+        "{{supplier_address}}": ud["supplier_address"],
+        "{{manufacturing_days}}": ud["manufacturing_days"],
+        "{{supplier_phone}}": ud["supplier_phone"],
+        "{{buyer_phone}}": ud["buyer_phone"],
+        "{{item_name}}": items[0]["name"],
+        "{{item_price}}": items[0]["price"],
+        "{{item_qty}}": sum(item["qty"] for item in items),
+        "{{total_cost_final}}": ud["total_cost_final"],
+    }
+    repl["items"] = [(item["name"], item["price"], item["qty"]) for item in items]
+    repl["contract_number"] = ud["contract_number"]
+    return repl
+
+
+def murabaha_replacements(ud: dict) -> dict:
+    """
+    Плейсхолдеры Мурабаха (договор + график) из собранных данных диалога (user_data).
+    Платежи — списком в repl["schedule"], по строке таблицы графика на платёж.
+    """
+    qty = int(ud.get("kolichestvo_tov", 1))
+    total_sebestoim = ud["sebestoimost_tovara"] * qty
+    total_nacenka = ud["nacenka_tov"] * qty
+    polnaya_stoimost = total_sebestoim + total_nacenka
+    ostatok_dolga = max(0, polnaya_stoimost - ud["pervi_vznos"])
+
+    schedule = generate_schedule(
+        start_date=ud["data_dogovora_dt"],
+        term=ud["srok_dogov"],
+        payday=ud["data_opl"],
+        cost=polnaya_stoimost,
+        advance=ud["pervi_vznos"],
+    )
+    ejemes = schedule[0]["amount"] if schedule else 0
+
+    repl = {
+        "{{nomer_dogovora}}": ud["contract_number"],
+        "{{data_dogovora}}": ud["data_dogovora"],
+        "{{fio_prodavca}}": ud["fio_prodavca"],
+        "{{fio_pokupatelya}}": ud["fio_pokupatelya"],
+        "{{tel_pokupatelya}}": ud["tel_pokupatelya"],
+        "{{fio_poruchitelya1}}": ud["fio_poruchitelya1"],
+        "{{tel_poruchit1}}": ud["tel_poruchit1"],
+        "{{pokupaemy_tov}}": ud["pokupaemy_tov"],
+        "{{kolichestvo_tov}}": ud["kolichestvo_tov"],
+        "{{polnaya_stoimost_tov}}": polnaya_stoimost,
+        "{{sebestoimost_tovara}}": total_sebestoim,
+        "{{nacenka_tov}}": total_nacenka,
+        "{{pervi_vznos}}": ud["pervi_vznos"],
+        "{{srok_dogov}}": ud["srok_dogov"],
+        "{{ejemes_oplata}}": ejemes,
+        "{{data_opl}}": ud["data_opl"],
+        "{{zalog}}": ud["zalog"],
+        "{{ostatok_dolga}}": ostatok_dolga,
+    }
+
+    # Строки графика: шаблон размножает строку {{schedule.*}} по числу платежей
+    repl["schedule"] = schedule
+    repl["contract_number"] = ud["contract_number"]
+    return repl
+
+
+def generation_job(ud: dict) -> Tuple[Callable, dict]:
+    """
+    Генератор документов и его данные для типа договора из user_data.
+    """
+    if ud.get("contract_type", "murabaha") == "istisna":
+        return generate_istisna_documents, istisna_replacements(ud)
+    return generate_contract_and_schedule, murabaha_replacements(ud)
+
+
+def document_jobs(ud: dict) -> List[DocumentJob]:
+    """
+    Документы договора из user_data по отдельности — для параллельного рендера.
+    """
+    if ud.get("contract_type", "murabaha") == "istisna":
+        return istisna_document_jobs(istisna_replacements(ud))
+    return murabaha_document_jobs(murabaha_replacements(ud))
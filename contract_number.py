@@ -1,9 +1,79 @@
 # contract_number.py
+"""
+Нумерация договоров: X-YY/MM/DD, X — порядковый номер за дату договора.
+
+Хранилище счётчиков подключаемое (NUMBER_BACKEND):
+- sqlite (по умолчанию) — data/counters.sqlite3 в режиме WAL, одна машина;
+- file — data/counter.json под файловой блокировкой, одна машина;
+- tcp://host:port, unix:///path — сервис номеров (number_service.py), общий для реплик;
+  протокол — подмножество Redis, поэтому подходит и redis://host:port[/db].
+
+Реплика может брать номера пачкой (NUMBER_LEASE) — меньше обращений к хранилищу.
+Невыданный остаток пачки и номера отменённых договоров возвращаются в хранилище
+и выдаются снова первыми, так что нумерация остаётся без пропусков. Исключение —
+аварийная остановка реплики при NUMBER_LEASE > 1: остаток её пачки теряется.
+"""
+import abc
+import asyncio
 import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import deque
 from datetime import datetime
-from paths import COUNTER_FILE
+from pathlib import Path
+from typing import Deque, Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+
 import portalocker
 
+import metrics
+from paths import COUNTER_DB, COUNTER_FILE
+
+# Счётчики номеров: SQLite в режиме WAL, по строке на дату договора.
+# Выдача номера — один UPSERT по первичному ключу, стоимость не зависит от истории.
+# released — возвращённые номера, они выдаются раньше новых.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS counters (
+    day   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS released (
+    day   TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (day, value)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Сколько ждать, если хранилище занято другим процессом (мс)
+BUSY_TIMEOUT_MS = 10000
+
+# Возвращённые номера в counter.json: {"_released": {"YYYY-MM-DD": [номера]}}
+_RELEASED_KEY = "_released"
+
+NUMBER_WAIT_SECONDS = metrics.histogram(
+    "contract_number_wait_seconds", "Получение номера договора (ожидание блокировки хранилища)"
+)
+
+
+class NumberAllocationTimeout(TimeoutError):
+    """
+    Номер договора не выдан за отведённое время (хранилище занято или недоступно).
+    """
+
+
+class NumberBackendError(RuntimeError):
+    """
+    Сервис номеров ответил ошибкой.
+    """
+
 
 def load_counters():
     """
@@ -26,33 +96,489 @@ def save_counters(counters: dict):
     COUNTER_FILE.write_text(json.dumps(counters, ensure_ascii=False, indent=2), encoding="utf-8")
 
 
-def generate_contract_number(contract_date: datetime) -> str:
+def _timeout_ms(timeout: Optional[float]) -> int:
+    return BUSY_TIMEOUT_MS if timeout is None else max(0, int(timeout * 1000))
+
+
+class NumberBackend(abc.ABC):
     """
-    Формат номера договора:
-    X-YY/MM/DD
+    Хранилище счётчиков; day — дата договора YYYY-MM-DD.
+    lease() выдаёт count уникальных номеров (сначала возвращённые, потом новые),
+    release() возвращает невыданные номера для повторной выдачи.
     """
-    COUNTER_FILE.parent.mkdir(parents=True, exist_ok=True)
 
-    # открываем файл с блокировкой
-    with open(COUNTER_FILE, "a+", encoding="utf-8") as f:
-        portalocker.lock(f, portalocker.LOCK_EX)
-        f.seek(0)
+    @abc.abstractmethod
+    def lease(self, day: str, count: int = 1, timeout: Optional[float] = None) -> List[int]:
+        ...
+
+    @abc.abstractmethod
+    def release(self, day: str, numbers: Iterable[int], timeout: Optional[float] = None) -> None:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteBackend(NumberBackend):
+    """
+    SQLite в режиме WAL. Соединение — одно на поток (sqlite3 не делит соединения между потоками).
+    При первом открытии создаёт схему и однократно переносит старый counter.json.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path), timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.executescript(_SCHEMA)
+        if not conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._migrate_json(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+        self._local.conn = conn
+        return conn
 
+    @staticmethod
+    def _migrate_json(conn: sqlite3.Connection) -> None:
+        """
+        Однократный перенос data/counter.json в базу (внутри открытой транзакции).
+        Если в базе по дате уже больше — остаётся большее значение, номера не повторяются.
+        """
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+            return
+        counters = load_counters()
+        rows = []
+        for day, value in counters.items():
+            try:
+                rows.append((str(day), int(value)))
+            except (TypeError, ValueError):
+                continue
+        conn.executemany(
+            "INSERT INTO counters (day, value) VALUES (?, ?) "
+            "ON CONFLICT(day) DO UPDATE SET value = MAX(value, excluded.value)",
+            rows,
+        )
+        released = counters.get(_RELEASED_KEY)
+        if isinstance(released, dict):
+            conn.executemany(
+                "INSERT OR IGNORE INTO released (day, value) VALUES (?, ?)",
+                [(str(day), int(n)) for day, numbers in released.items() for n in numbers],
+            )
+        conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', ?)", (str(COUNTER_FILE),))
+
+    def _transaction(self, timeout: Optional[float], func, *args):
+        # BEGIN IMMEDIATE сразу берёт блокировку записи: параллельные процессы
+        # выстраиваются в очередь (busy_timeout), а не получают одинаковые номера.
+        busy_ms = _timeout_ms(timeout)
+        try:
+            conn = self._connection()
+            conn.execute(f"PRAGMA busy_timeout = {busy_ms}")
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                raise NumberAllocationTimeout(f"counter database is locked for more than {busy_ms} ms") from None
+            raise
         try:
+            result = func(conn, *args)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    @staticmethod
+    def _incr(conn: sqlite3.Connection, day: str, count: int) -> int:
+        conn.execute(
+            "INSERT INTO counters (day, value) VALUES (?, ?) "
+            "ON CONFLICT(day) DO UPDATE SET value = value + excluded.value",
+            (day, count),
+        )
+        return conn.execute("SELECT value FROM counters WHERE day = ?", (day,)).fetchone()[0]
+
+    @staticmethod
+    def _pop_released(conn: sqlite3.Connection, day: str, count: int) -> List[int]:
+        numbers = [n for (n,) in conn.execute(
+            "SELECT value FROM released WHERE day = ? ORDER BY value LIMIT ?", (day, count),
+        )]
+        conn.executemany("DELETE FROM released WHERE day = ? AND value = ?", [(day, n) for n in numbers])
+        return numbers
+
+    @staticmethod
+    def _push_released(conn: sqlite3.Connection, day: str, numbers: List[int]) -> None:
+        row = conn.execute("SELECT value FROM counters WHERE day = ?", (day,)).fetchone()
+        top = row[0] if row else 0
+        # Вернуть можно только уже выданный номер
+        conn.executemany(
+            "INSERT OR IGNORE INTO released (day, value) VALUES (?, ?)",
+            [(day, n) for n in numbers if 0 < n <= top],
+        )
+
+    def _lease(self, conn: sqlite3.Connection, day: str, count: int) -> List[int]:
+        numbers = self._pop_released(conn, day, count)
+        rest = count - len(numbers)
+        if rest:
+            top = self._incr(conn, day, rest)
+            numbers.extend(range(top - rest + 1, top + 1))
+        return numbers
+
+    def lease(self, day: str, count: int = 1, timeout: Optional[float] = None) -> List[int]:
+        return self._transaction(timeout, self._lease, day, count)
+
+    def release(self, day: str, numbers: Iterable[int], timeout: Optional[float] = None) -> None:
+        numbers = list(numbers)
+        if numbers:
+            self._transaction(timeout, self._push_released, day, numbers)
+
+    # Отдельные операции для number_service.py — каждая в своей транзакции
+    def incr(self, day: str, count: int, timeout: Optional[float] = None) -> int:
+        return self._transaction(timeout, self._incr, day, count)
+
+    def pop_released(self, day: str, count: int, timeout: Optional[float] = None) -> List[int]:
+        return self._transaction(timeout, self._pop_released, day, count)
+
+    def push_released(self, day: str, numbers: List[int], timeout: Optional[float] = None) -> None:
+        self._transaction(timeout, self._push_released, day, numbers)
+
+    def counter(self, day: str) -> int:
+        row = self._connection().execute("SELECT value FROM counters WHERE day = ?", (day,)).fetchone()
+        return row[0] if row else 0
+
+    def released_count(self, day: str) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM released WHERE day = ?", (day,)).fetchone()[0]
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class FileBackend(NumberBackend):
+    """
+    JSON-файл {"YYYY-MM-DD": последний номер} (формат data/counter.json) под эксклюзивной
+    блокировкой portalocker. Каждая операция перечитывает и переписывает файл целиком.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+
+    def _update(self, timeout: Optional[float], func):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        lock = portalocker.Lock(
+            str(self.path), mode="a+", timeout=_timeout_ms(timeout) / 1000, check_interval=0.02,
+            flags=portalocker.LOCK_EX | portalocker.LOCK_NB, encoding="utf-8",
+        )
+        try:
+            f = lock.acquire()
+        except portalocker.LockException:
+            raise NumberAllocationTimeout(f"{self.path} is locked") from None
+        try:
+            f.seek(0)
             data = f.read().strip()
-            counters = json.loads(data) if data else {}
-        except json.JSONDecodeError:
-            counters = {}
+            try:
+                counters = json.loads(data) if data else {}
+            except json.JSONDecodeError:
+                counters = {}
+            result = func(counters)
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(counters, ensure_ascii=False, indent=2))
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            lock.release()
+        return result
+
+    def lease(self, day: str, count: int = 1, timeout: Optional[float] = None) -> List[int]:
+        def take(counters: dict) -> List[int]:
+            released = counters.pop(_RELEASED_KEY, {})
+            free = sorted(released.pop(day, []))
+            numbers = free[:count]
+            if free[count:]:
+                released[day] = free[count:]
+            if released:
+                counters[_RELEASED_KEY] = released
+            rest = count - len(numbers)
+            if rest:
+                top = counters[day] = counters.get(day, 0) + rest
+                numbers.extend(range(top - rest + 1, top + 1))
+            return numbers
+        return self._update(timeout, take)
 
-        date_key = contract_date.strftime("%Y-%m-%d")
-        current_count = counters.get(date_key, 0) + 1
-        counters[date_key] = current_count
+    def release(self, day: str, numbers: Iterable[int], timeout: Optional[float] = None) -> None:
+        numbers = list(numbers)
+        if not numbers:
+            return
 
-        f.seek(0)
-        f.truncate()
-        f.write(json.dumps(counters, ensure_ascii=False, indent=2))
-        f.flush()
+        def give_back(counters: dict) -> None:
+            top = counters.get(day, 0)
+            released = counters.setdefault(_RELEASED_KEY, {})
+            free = set(released.get(day, [])) | {n for n in numbers if 0 < n <= top}
+            if free:
+                released[day] = sorted(free)
+            if not released:
+                del counters[_RELEASED_KEY]
+        self._update(timeout, give_back)
 
-        portalocker.unlock(f)
 
-    return f"{current_count}-{contract_date.strftime('%y/%m/%d')}"
\ No newline at end of file
+class RespBackend(NumberBackend):
+    """
+    Клиент сервиса номеров по протоколу Redis (RESP2): number_service.py или сам Redis ≥ 6.2.
+    Команды: LPOP <prefix>:released:<day> <n>, INCRBY <prefix>:counter:<day> <n>,
+    RPUSH <prefix>:released:<day> <номера>. Каждая команда атомарна на сервере,
+    поэтому номера уникальны для всех реплик. Одно соединение, запросы — под блокировкой.
+    Если INCRBY после LPOP не прошёл, снятые номера возвращаются обратно (RPUSH).
+    """
+
+    def __init__(
+        self,
+        address: Union[str, Tuple[str, int]],
+        prefix: str = "dogovorshik",
+        db: int = 0,
+        password: Optional[str] = None,
+    ):
+        self.address = address
+        self.prefix = prefix
+        self.db = db
+        self.password = password
+        self._sock: Optional[socket.socket] = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def _connect(self, timeout: float) -> None:
+        if isinstance(self.address, str):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            try:
+                sock.connect(self.address)
+            except OSError:
+                sock.close()
+                raise
+        else:
+            sock = socket.create_connection(self.address, timeout=timeout)
+        self._sock, self._reader = sock, sock.makefile("rb")
+        if self.password:
+            self._roundtrip(("AUTH", self.password))
+        if self.db:
+            self._roundtrip(("SELECT", self.db))
+
+    def _disconnect(self) -> None:
+        if self._sock is not None:
+            try:
+                self._reader.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = self._reader = None
+
+    def _roundtrip(self, args):
+        payload = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = str(arg).encode()
+            payload.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._sock.sendall(b"".join(payload))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("connection closed by number service")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise NumberBackendError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            size = int(body)
+            return None if size < 0 else self._reader.read(size + 2)[:-2].decode()
+        if kind == b"*":
+            size = int(body)
+            return None if size < 0 else [self._read_reply() for _ in range(size)]
+        raise ConnectionError(f"unexpected reply from number service: {line[:50]!r}")
+
+    def _command(self, args, timeout: Optional[float]):
+        seconds = _timeout_ms(timeout) / 1000
+        # Соединение одно: ждём его не дольше таймаута, как и ответа
+        if not self._lock.acquire(timeout=seconds):
+            raise NumberAllocationTimeout(f"number service connection is busy for more than {seconds}s")
+        try:
+            if self._sock is None:
+                self._connect(seconds)
+            self._sock.settimeout(seconds)
+            return self._roundtrip(args)
+        except socket.timeout:
+            # Поздний ответ сбил бы разбор следующего — соединение сбрасываем
+            self._disconnect()
+            raise NumberAllocationTimeout(f"number service {self.address} did not answer in {seconds}s") from None
+        except OSError as e:
+            self._disconnect()
+            raise NumberAllocationTimeout(f"number service {self.address} is unavailable: {e}") from None
+        finally:
+            self._lock.release()
+
+    def lease(self, day: str, count: int = 1, timeout: Optional[float] = None) -> List[int]:
+        numbers = [int(n) for n in self._command(("LPOP", f"{self.prefix}:released:{day}", count), timeout) or []]
+        rest = count - len(numbers)
+        if rest:
+            try:
+                top = self._command(("INCRBY", f"{self.prefix}:counter:{day}", rest), timeout)
+            except (NumberAllocationTimeout, NumberBackendError):
+                # Снятые LPOP номера уже не в списке — без возврата они пропали бы
+                self._push_back(day, numbers, timeout)
+                raise
+            numbers.extend(range(top - rest + 1, top + 1))
+        return numbers
+
+    def _push_back(self, day: str, numbers: List[int], timeout: Optional[float]) -> None:
+        try:
+            self.release(day, numbers, timeout)
+        except (NumberAllocationTimeout, NumberBackendError):
+            logging.error("Lost released contract numbers %s for %s: number service unavailable", numbers, day)
+
+    def release(self, day: str, numbers: Iterable[int], timeout: Optional[float] = None) -> None:
+        numbers = list(numbers)
+        if numbers:
+            self._command(("RPUSH", f"{self.prefix}:released:{day}", *numbers), timeout)
+
+    def close(self) -> None:
+        with self._lock:
+            self._disconnect()
+
+
+def backend_from_url(url: str) -> NumberBackend:
+    """
+    sqlite[:///path] | file[:///path] | tcp://host:port | redis://[:password@]host:port[/db] | unix:///path
+    """
+    parsed = urlparse(url)
+    scheme = parsed.scheme or url
+    if scheme == "sqlite":
+        return SqliteBackend(parsed.path or COUNTER_DB)
+    if scheme == "file":
+        return FileBackend(parsed.path or COUNTER_FILE)
+    if scheme in ("tcp", "redis"):
+        db = int(parsed.path.strip("/") or 0) if scheme == "redis" else 0
+        return RespBackend((parsed.hostname or "127.0.0.1", parsed.port or 6379), db=db, password=parsed.password)
+    if scheme == "unix":
+        return RespBackend(parsed.path)
+    raise ValueError(f"Unknown NUMBER_BACKEND: {url!r}")
+
+
+class NumberAllocator:
+    """
+    Выдача номеров поверх хранилища пачками по lease_size.
+    Остаток пачки живёт в памяти реплики; release_unused() возвращает его в хранилище.
+    При аварийной остановке (падение, SIGKILL) остаток теряется — в нумерации будут пропуски.
+    """
+
+    def __init__(self, backend: NumberBackend, lease_size: int = 1):
+        self.backend = backend
+        self.lease_size = max(1, lease_size)
+        self._leased: Dict[str, Deque[int]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, day: str, timeout: Optional[float] = None) -> int:
+        with self._lock:
+            pool = self._leased.get(day)
+            if pool:
+                return pool.popleft()
+        numbers = sorted(self.backend.lease(day, self.lease_size, timeout))
+        if len(numbers) > 1:
+            with self._lock:
+                # Пачки параллельных потоков могли перемешаться — выдаём по возрастанию
+                self._leased[day] = deque(sorted([*self._leased.get(day, ()), *numbers[1:]]))
+        return numbers[0]
+
+    def give_back(self, day: str, number: int, timeout: Optional[float] = None) -> None:
+        self.backend.release(day, [number], timeout)
+
+    def release_unused(self, timeout: Optional[float] = None) -> None:
+        with self._lock:
+            leased, self._leased = self._leased, {}
+        for day, pool in leased.items():
+            if pool:
+                self.backend.release(day, pool, timeout)
+
+
+_allocator: Optional[NumberAllocator] = None
+_allocator_lock = threading.Lock()
+
+
+def configure_numbering(backend: Optional[NumberBackend] = None, lease_size: Optional[int] = None) -> NumberAllocator:
+    """
+    Настраивает общий аллокатор (прежний возвращает остаток пачек и закрывается).
+    Без аргументов — из env: NUMBER_BACKEND (см. backend_from_url, по умолчанию sqlite),
+    NUMBER_LEASE (номеров за одно обращение, по умолчанию 1).
+    NUMBER_LEASE > 1 — нумерация без пропусков только при штатной остановке: остаток пачки
+    хранится в памяти реплики и при падении процесса не возвращается.
+    """
+    global _allocator
+    with _allocator_lock:
+        if _allocator is not None:
+            _allocator.release_unused()
+            _allocator.backend.close()
+        _allocator = NumberAllocator(
+            backend or backend_from_url(os.getenv("NUMBER_BACKEND", "sqlite")),
+            lease_size if lease_size is not None else int(os.getenv("NUMBER_LEASE", "1")),
+        )
+        return _allocator
+
+
+def _get_allocator() -> NumberAllocator:
+    return _allocator or configure_numbering()
+
+
+def generate_contract_number(contract_date: datetime, timeout: Optional[float] = None) -> str:
+    """
+    Формат номера договора:
+    X-YY/MM/DD
+    timeout (сек) — сколько ждать хранилище (по умолчанию BUSY_TIMEOUT_MS);
+    не дождались — NumberAllocationTimeout, номер не расходуется.
+    """
+    started = time.perf_counter()
+    try:
+        current_count = _get_allocator().take(contract_date.strftime("%Y-%m-%d"), timeout)
+    finally:
+        NUMBER_WAIT_SECONDS.observe(time.perf_counter() - started)
+    return f"{current_count}-{contract_date.strftime('%y/%m/%d')}"
+
+
+async def allocate_contract_number(contract_date: datetime, timeout: Optional[float] = None) -> str:
+    """
+    generate_contract_number для async-кода: ожидание хранилища идёт в потоке,
+    event loop не ждёт. timeout (сек, по умолчанию NUMBER_TIMEOUT из env, 10) ограничивает
+    ожидание; после него — NumberAllocationTimeout.
+    """
+    if timeout is None:
+        timeout = float(os.getenv("NUMBER_TIMEOUT", "10"))
+    return await asyncio.to_thread(generate_contract_number, contract_date, timeout)
+
+
+def release_contract_number(contract_date: datetime, number: str, timeout: Optional[float] = None) -> None:
+    """
+    Возвращает номер договора, который так и не был сформирован: его получит следующий.
+    """
+    _get_allocator().give_back(contract_date.strftime("%Y-%m-%d"), int(number.split("-", 1)[0]), timeout)
+
+
+def release_unused_numbers() -> None:
+    """
+    Возвращает в хранилище невыданный остаток пачек (при остановке реплики).
+    """
+    if _allocator is not None:
+        _allocator.release_unused()
@@ -0,0 +1,101 @@
+# convert_templates.py
+"""
+Перевод DOCX-шаблонов с текстовых плейсхолдеров {{...}} на content controls (w:sdt),
+привязанные к customXml-части с данными договора.
+
+    python convert_templates.py                 # три шаблона проекта → templates/content_controls/
+    python convert_templates.py --in-place      # заменить шаблоны проекта
+    python convert_templates.py a.docx --out-dir out/
+"""
+import argparse
+import logging
+from pathlib import Path
+from typing import Tuple
+
+from docx import Document
+from docx.opc.constants import CONTENT_TYPE as CT, RELATIONSHIP_TYPE as RT
+from docx.opc.packuri import PackURI
+from docx.opc.part import Part
+
+from docx_generator import _PLACEHOLDER_RE, _iter_document_paragraphs, _replace_in_paragraph
+from docx_sdt import build_binding_props_xml, build_binding_xml, read_binding_fields, split_run_into_controls
+from paths import TEMPLATES_DIR, TEMPLATE_CONTRACT, TEMPLATE_SCHEDULE, ISTISNA_TEMPLATE
+
+# w:id контролов: любые уникальные в документе числа
+_FIRST_SDT_ID = 700000
+
+
+def convert_template(src: Path, dst: Path) -> Tuple[str, ...]:
+    """
+    Конвертирует шаблон src в dst и возвращает имена полей.
+    Плейсхолдеры, разбитые Word'ом на несколько runs, сначала собираются в один run
+    (с форматированием донора, как при обычной замене), затем каждый оборачивается в w:sdt.
+    """
+    doc = Document(str(src))
+    package = doc.part.package
+    for part in package.iter_parts():
+        if str(part.partname).startswith("/customXml/item") and read_binding_fields(part.blob) is not None:
+            raise ValueError(f"{src} already uses content controls")
+
+    fields = []
+    next_id = _FIRST_SDT_ID
+    seen = set()
+    for para in list(_iter_document_paragraphs(doc)):
+        if para._p in seen:
+            continue
+        seen.add(para._p)
+        keys = tuple(dict.fromkeys(_PLACEHOLDER_RE.findall(para.text or "")))
+        if not keys:
+            continue
+        # Подстановка {{x}} → {{x}} склеивает разбитые плейсхолдеры в отдельные runs
+        _replace_in_paragraph(para, {k: k for k in keys})
+        for run in para.runs:
+            if not _PLACEHOLDER_RE.search(run.text or ""):
+                continue
+            elements, run_fields, next_id = split_run_into_controls(run._r, next_id)
+            for el in elements:
+                run._r.addprevious(el)
+            run._r.getparent().remove(run._r)
+            fields.extend(run_fields)
+
+    fields = tuple(dict.fromkeys(fields))
+    existing = {str(p.partname) for p in package.iter_parts()}
+    n = 1
+    while f"/customXml/item{n}.xml" in existing or f"/customXml/itemProps{n}.xml" in existing:
+        n += 1
+    item = Part(PackURI(f"/customXml/item{n}.xml"), CT.XML, build_binding_xml(fields, {}), package)
+    props = Part(
+        PackURI(f"/customXml/itemProps{n}.xml"),
+        CT.OFC_CUSTOM_XML_PROPERTIES,
+        build_binding_props_xml(),
+        package,
+    )
+    doc.part.relate_to(item, RT.CUSTOM_XML)
+    item.relate_to(props, RT.CUSTOM_XML_PROPS)
+
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    doc.save(str(dst))
+    return fields
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Перевод DOCX-шаблонов на content controls (w:sdt + customXml).")
+    parser.add_argument(
+        "templates",
+        nargs="*",
+        type=Path,
+        default=[TEMPLATE_CONTRACT, TEMPLATE_SCHEDULE, ISTISNA_TEMPLATE],
+    )
+    parser.add_argument("--out-dir", type=Path, default=TEMPLATES_DIR / "content_controls")
+    parser.add_argument("--in-place", action="store_true", help="перезаписать исходные шаблоны")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s | %(message)s")
+    for src in args.templates:
+        dst = src if args.in_place else args.out_dir / src.name
+        fields = convert_template(src, dst)
+        logging.info("%s → %s: %d fields", src.name, dst, len(fields))
+
+
+if __name__ == "__main__":
+    main()
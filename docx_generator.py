@@ -1,18 +1,34 @@
 # noinspection PyProtectedMember,PyBroadException,PyTypeChecker,DuplicatedCode
 # docx_generator.py
 
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+from io import BytesIO
 from pathlib import Path
 import copy
+import re
 import subprocess
-from typing import Optional, Tuple
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 
 from docx import Document
 from docx.document import Document as DocxDocument
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
-from docx.oxml import OxmlElement
+from docx.opc.oxml import serialize_part_xml
+from docx.opc.part import XmlPart
+from docx.oxml import OxmlElement, parse_xml
 from docx.oxml.ns import qn
+from docx.parts.hdrftr import FooterPart, HeaderPart
 from docx.shared import Pt
+from docx.table import _Row
+from docx.text.paragraph import Paragraph
+from docx.text.run import Run
 
+import metrics
+from docx_sdt import (
+    build_binding_xml, fill_bound_controls, flatten_bound_controls, has_bound_controls, read_binding_fields,
+)
+from docx_zip import ZipTemplate
 from paths import (
     TEMPLATE_CONTRACT,
     TEMPLATE_SCHEDULE,
@@ -23,6 +39,25 @@ from paths import (
 # Генератор делает только замену плейсхолдеров, сохраняя исходное форматирование шаблона.
 PRESERVE_TEMPLATE_FORMAT = True
 
+# Быстрый путь для документов без постобработки (Мурабаха): XML правится напрямую через lxml,
+# неизменённые части архива копируются без перепаковки. Истисна идёт через python-docx.
+RAW_XML_FAST_PATH = True
+
+# Плейсхолдер шаблона: {{имя}}. Ключи mapping — плейсхолдеры целиком, вместе со скобками.
+_PLACEHOLDER_RE = re.compile(r"\{\{[^{}]+\}\}")
+
+# Повторяемая строка таблицы: плейсхолдеры {{список.поле}}. Строка копируется для каждого
+# элемента mapping["список"] (список dict), {{список.n}} — номер элемента с 1.
+_ROW_PLACEHOLDER_RE = re.compile(r"\{\{(\w+)\.(\w+)\}\}")
+
+# Время этапов формирования DOCX. При GENERATION_EXECUTOR=process этапы идут
+# в процессах пула, и их метрики остаются там — в /metrics видны только в режиме thread.
+DOCX_STAGE_SECONDS = metrics.histogram_family("docx_stage_seconds", "Время этапа формирования DOCX", "stage")
+_STAGE_TEMPLATE_LOAD = DOCX_STAGE_SECONDS.labels("template_load")
+_STAGE_PLACEHOLDERS = DOCX_STAGE_SECONDS.labels("placeholders")
+_STAGE_ISTISNA_POSTPROCESS = DOCX_STAGE_SECONDS.labels("istisna_postprocess")
+_STAGE_SAVE = DOCX_STAGE_SECONDS.labels("save")
+
 
 def _clone_run_rpr(src_run, dst_run) -> None:
     """
@@ -141,96 +176,116 @@ def _force_font(run, pt=10, family="Times New Roman"):
         rpr.remove(rstyle)
 
 
-def _replace_placeholder_in_paragraph_strict(
+def _apply_donor_format(donor_run, new_run, preferred_font: Optional[Tuple[str, int]] = None) -> None:
+    """
+    Переносит форматирование шаблона с donor_run на вставленный run.
+    """
+    _clone_run_rpr(donor_run, new_run)
+    try:
+        new_run.style = donor_run.style
+    except Exception:
+        pass
+    # Fallback for runs without explicit rPr: copy high-level font attrs.
+    try:
+        new_run.font.name = donor_run.font.name
+        new_run.font.size = donor_run.font.size
+        new_run.bold = donor_run.bold
+        new_run.italic = donor_run.italic
+        new_run.underline = donor_run.underline
+    except Exception:
+        pass
+    # If donor has no explicit font, pin configured default.
+    if preferred_font and donor_run.font.name is None and donor_run.font.size is None:
+        try:
+            _set_run_font(new_run, preferred_font[0], preferred_font[1])
+        except Exception:
+            pass
+
+
+def _replace_split_placeholders_in_paragraph(
     paragraph,
-    key: str,
-    value: str,
+    mapping: dict,
     pt: int = 10,
     family: str = "Times New Roman",
     preferred_font: Optional[Tuple[str, int]] = None,
 ) -> bool:
     """
-    Жёсткая замена плейсхолдера key на value в абзаце, даже если key разбит на несколько runs.
+    Жёсткая замена всех плейсхолдеров из mapping в абзаце, даже если они разбиты на несколько runs.
+    Индекс позиций runs строится один раз, замены применяются справа налево,
+    поэтому уже посчитанные позиции левее не сдвигаются. Повторы ключа заменяются все.
     Возвращает True если была произведена замена.
     """
-    full = "".join(r.text or "" for r in paragraph.runs)
-    idx = full.find(key)
-    if idx < 0:
+    runs = paragraph.runs
+    texts = [r.text or "" for r in runs]
+    full = "".join(texts)
+    matches = [m for m in _PLACEHOLDER_RE.finditer(full) if m.group(0) in mapping]
+    if not matches:
         return False
 
-    spans = []
+    starts = []
+    ends = []
     pos = 0
-    for r in paragraph.runs:
-        txt = r.text or ""
-        spans.append((pos, pos + len(txt), r))
+    for txt in texts:
+        starts.append(pos)
         pos += len(txt)
+        ends.append(pos)
 
-    start = idx
-    end = idx + len(key)
-
-    first_i = next(i for i, (a, b, _) in enumerate(spans) if not (b <= start or a >= end))
-    last_i = next(i for i in range(len(spans) - 1, -1, -1) if not (spans[i][1] <= start or spans[i][0] >= end))
+    for m in reversed(matches):
+        start, end = m.span()
+        value = str(mapping[m.group(0)])
 
-    first_run = spans[first_i][2]
-    last_run = spans[last_i][2]
+        # первый run, заканчивающийся после start, и последний, начинающийся до end
+        first_i = bisect_right(ends, start)
+        last_i = bisect_left(starts, end) - 1
 
-    first_a, _, _ = spans[first_i]
-    _, last_b, _ = spans[last_i]
+        first_run = runs[first_i]
+        last_run = runs[last_i]
 
-    first_prefix_len = max(0, start - first_a)
-    last_suffix_len = max(0, last_b - end)
+        # Текст берём текущий: правее уже могли отрезать хвост, но начало run не меняется.
+        first_text = first_run.text or ""
+        prefix = first_text[:start - starts[first_i]]
 
-    # донор форматирования (важно для underline/линий в шапке)
-    donor_run = first_run
+        if first_i == last_i:
+            first_run.text = prefix + value + first_text[end - starts[first_i]:]
+            continue
 
-    # 1) Первый run: префикс до key
-    first_text = first_run.text or ""
-    first_run.text = first_text[:first_prefix_len]
+        # 1) Первый run: префикс до key
+        first_run.text = prefix
 
-    # 2) Промежуточные runs очистить
-    for j in range(first_i + 1, last_i):
-        spans[j][2].text = ""
+        # 2) Промежуточные runs очистить
+        for j in range(first_i + 1, last_i):
+            runs[j].text = ""
 
-    # 3) Последний run: суффикс после key
-    last_text = last_run.text or ""
-    last_run.text = last_text[len(last_text) - last_suffix_len:] if last_suffix_len > 0 else ""
+        # 3) Последний run: суффикс после key
+        last_text = last_run.text or ""
+        last_run.text = last_text[end - starts[last_i]:]
 
-    # 4) Вставляем новый run со значением сразу после first_run
-    insert_after = first_run
-    new_run = paragraph.add_run("")
-    paragraph._p.insert(paragraph._p.index(insert_after._r) + 1, new_run._r)
-    new_run.text = value
+        # 4) Вставляем новый run со значением сразу после first_run
+        # (донор форматирования — first_run, важно для underline/линий в шапке)
+        new_run = paragraph.add_run("")
+        first_run._r.addnext(new_run._r)
+        new_run.text = value
 
-    if PRESERVE_TEMPLATE_FORMAT:
-        _clone_run_rpr(donor_run, new_run)
-        try:
-            new_run.style = donor_run.style
-        except Exception:
-            pass
-        # Fallback for runs without explicit rPr: copy high-level font attrs.
-        try:
-            new_run.font.name = donor_run.font.name
-            new_run.font.size = donor_run.font.size
-            new_run.bold = donor_run.bold
-            new_run.italic = donor_run.italic
-            new_run.underline = donor_run.underline
-        except Exception:
-            pass
-        # If donor has no explicit font, pin configured default.
-        if preferred_font and donor_run.font.name is None and donor_run.font.size is None:
-            try:
-                _set_run_font(new_run, preferred_font[0], preferred_font[1])
-            except Exception:
-                pass
-    else:
-        _force_font(new_run, pt, family)
-        for j in range(first_i, last_i + 1):
-            _force_font(spans[j][2], pt, family)
-        _normalize_paragraph(paragraph, pt, family)
+        if PRESERVE_TEMPLATE_FORMAT:
+            _apply_donor_format(first_run, new_run, preferred_font)
+        else:
+            _force_font(new_run, pt, family)
+            for j in range(first_i, last_i + 1):
+                _force_font(runs[j], pt, family)
 
     return True
 
 
+def _substitute_placeholders(text: str, mapping: dict) -> str:
+    """
+    Подставляет значения всех {{...}} из mapping за один проход regex.
+    Плейсхолдеры, которых нет в mapping, остаются как есть.
+    """
+    if "{{" not in text:
+        return text
+    return _PLACEHOLDER_RE.sub(lambda m: str(mapping.get(m.group(0), m.group(0))), text)
+
+
 def _replace_in_paragraph(
     paragraph,
     mapping: dict,
@@ -239,13 +294,10 @@ def _replace_in_paragraph(
 ):
     changed = False
 
-    # 1) Простые замены внутри отдельных runs
+    # 1) Простые замены внутри отдельных runs: один проход regex на run
     for run in paragraph.runs:
         original = run.text or ""
-        new_text = original
-        for key, val in mapping.items():
-            if key in new_text:
-                new_text = new_text.replace(key, str(val))
+        new_text = _substitute_placeholders(original, mapping)
         if new_text != original:
             run.text = new_text
             if preferred_font and run.font.name is None and run.font.size is None:
@@ -258,17 +310,15 @@ def _replace_in_paragraph(
             changed = True
 
     # 2) Жёсткая замена, если плейсхолдеры разбиты на несколько runs
-    for key, val in mapping.items():
-        if key in (paragraph.text or ""):
-            if _replace_placeholder_in_paragraph_strict(
-                paragraph,
-                key,
-                str(val),
-                fallback_font_pt,
-                "Times New Roman",
-                preferred_font=preferred_font,
-            ):
-                changed = True
+    if "{{" in (paragraph.text or ""):
+        if _replace_split_placeholders_in_paragraph(
+            paragraph,
+            mapping,
+            fallback_font_pt,
+            "Times New Roman",
+            preferred_font=preferred_font,
+        ):
+            changed = True
 
     if changed and not PRESERVE_TEMPLATE_FORMAT:
         _normalize_paragraph(paragraph, fallback_font_pt, "Times New Roman")
@@ -412,34 +462,449 @@ def _desuperscript_paragraph(paragraph):
             run.text = run.text.translate(_SUPERSCRIPT_MAP)
 
 
+def _iter_document_paragraphs(doc: DocxDocument):
+    """
+    Обходит абзацы, в которых генератор ищет плейсхолдеры:
+    тело, таблицы (включая вложенные), верхние и нижние колонтитулы секций.
+    """
+    yield from doc.paragraphs
+
+    def iter_table(table):
+        for row in table.rows:
+            for cell in row.cells:
+                yield from cell.paragraphs
+                for inner_tbl in cell.tables:
+                    yield from iter_table(inner_tbl)
+
+    for tbl in doc.tables:
+        yield from iter_table(tbl)
+
+    for section in doc.sections:
+        for story in (section.header, section.footer):
+            yield from story.paragraphs
+            for story_tbl in story.tables:
+                yield from iter_table(story_tbl)
+
+
 def _replace_in_document(
     doc: DocxDocument,
     mapping: dict,
     preferred_font: Optional[Tuple[str, int]] = None,
 ):
-    for para in doc.paragraphs:
+    for para in _iter_document_paragraphs(doc):
         _replace_in_paragraph(para, mapping, preferred_font=preferred_font)
 
-    def process_table(table):
-        for row in table.rows:
-            for cell in row.cells:
-                for cell_para in cell.paragraphs:
-                    _replace_in_paragraph(cell_para, mapping, preferred_font=preferred_font)
-                for inner_tbl in cell.tables:
-                    process_table(inner_tbl)
 
-    for tbl in doc.tables:
-        process_table(tbl)
+class PlaceholderSite(NamedTuple):
+    """
+    Место плейсхолдеров в шаблоне: часть пакета, путь до w:p от корня части
+    (индексы дочерних элементов), найденные ключи и индексы runs с их текстом.
+    """
+    partname: str
+    path: Tuple[int, ...]
+    keys: Tuple[str, ...]
+    runs: Tuple[int, ...]
 
-    for section in doc.sections:
-        for header_para in section.header.paragraphs:
-            _replace_in_paragraph(header_para, mapping, preferred_font=preferred_font)
-        for header_tbl in section.header.tables:
-            process_table(header_tbl)
-        for footer_para in section.footer.paragraphs:
-            _replace_in_paragraph(footer_para, mapping, preferred_font=preferred_font)
-        for footer_tbl in section.footer.tables:
-            process_table(footer_tbl)
+
+class RepeatRow(NamedTuple):
+    """
+    Повторяемая строка таблицы: часть пакета, путь до w:tr от корня части,
+    имя списка в mapping и w:t с плейсхолдерами (путь от w:tr, исходный текст).
+    """
+    partname: str
+    path: Tuple[int, ...]
+    source: str
+    texts: Tuple[Tuple[Tuple[int, ...], str], ...]
+
+
+class _PartParent:
+    """
+    Минимальный родитель для Paragraph: python-docx берёт у него только .part
+    (стили, колонтитулы).
+    """
+    __slots__ = ("part",)
+
+    def __init__(self, part):
+        self.part = part
+
+
+def _element_path(root, element) -> Tuple[int, ...]:
+    path = []
+    while element is not root:
+        parent = element.getparent()
+        path.append(parent.index(element))
+        element = parent
+    return tuple(reversed(path))
+
+
+def _resolve_path(root, path: Tuple[int, ...]):
+    element = root
+    for idx in path:
+        element = element[idx]
+    return element
+
+
+def _glue_row_placeholders(tr, part) -> Tuple[Tuple[Tuple[int, ...], str], ...]:
+    """
+    Собирает разбитые плейсхолдеры строки в отдельные runs (с форматированием донора)
+    и возвращает w:t с плейсхолдерами: (путь от w:tr, текст).
+    """
+    for p in list(tr.iter(qn("w:p"))):
+        paragraph = Paragraph(p, _PartParent(part))
+        keys = tuple(dict.fromkeys(_PLACEHOLDER_RE.findall(paragraph.text or "")))
+        if keys:
+            _replace_in_paragraph(paragraph, {k: k for k in keys})
+    return tuple(
+        (_element_path(tr, t), t.text)
+        for t in tr.iter(qn("w:t"))
+        if t.text and _PLACEHOLDER_RE.search(t.text)
+    )
+
+
+def _expand_repeat_row(tr, row: RepeatRow, mapping: dict) -> None:
+    """
+    Заменяет строку-образец копиями, по одной на элемент mapping[row.source].
+    В копиях меняется только текст w:t; все копии вставляются одной вставкой.
+    Пустой список убирает строку; нет списка в mapping — строка остаётся как в шаблоне.
+    """
+    items = mapping.get(row.source)
+    if items is None:
+        return
+    clones = []
+    for n, item in enumerate(items, start=1):
+        values = {"n": n, **item}
+
+        def value(m):
+            key = m.group(0)
+            rm = _ROW_PLACEHOLDER_RE.fullmatch(key)
+            if rm is not None and rm.group(1) == row.source:
+                return str(values.get(rm.group(2), key))
+            return str(mapping[key]) if key in mapping else key
+
+        clone = copy.deepcopy(tr)
+        for path, text in row.texts:
+            t = _resolve_path(clone, path)
+            t.text = _PLACEHOLDER_RE.sub(value, text)
+            if t.text != t.text.strip():
+                t.set(qn("xml:space"), "preserve")
+        clones.append(clone)
+    parent = tr.getparent()
+    idx = parent.index(tr)
+    parent[idx:idx + 1] = clones
+
+
+def _placeholder_runs(paragraph) -> Tuple[int, ...]:
+    """
+    Индексы runs абзаца, на которые приходится текст плейсхолдеров.
+    """
+    spans = []
+    pos = 0
+    for r in paragraph.runs:
+        txt = r.text or ""
+        spans.append((pos, pos + len(txt)))
+        pos += len(txt)
+    full = "".join(r.text or "" for r in paragraph.runs)
+    hit = set()
+    for m in _PLACEHOLDER_RE.finditer(full):
+        for i, (a, b) in enumerate(spans):
+            if a < m.end() and b > m.start():
+                hit.add(i)
+    return tuple(sorted(hit))
+
+
+class CompiledTemplate:
+    """
+    Шаблон DOCX, разобранный один раз.
+    Хранит распарсенный пакет и заранее найденные места плейсхолдеров.
+    render() клонирует только изменяемые части (документ и колонтитулы),
+    остальные части пакета (стили, нумерация, картинки) разделяются с шаблоном.
+    render_bytes() — быстрый путь: правит XML только тех частей, где есть плейсхолдеры,
+    остальные члены архива копируются байт в байт.
+    Строки таблиц с {{список.поле}} (repeat_rows) размножаются по mapping["список"].
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.mtime = path.stat().st_mtime
+
+        blob = path.read_bytes()
+        doc = Document(BytesIO(blob))
+
+        # Повторяемые строки (только тело документа): плейсхолдеры склеиваются заранее,
+        # абзацы строки в места плейсхолдеров не попадают — их заполняет _expand_repeat_row.
+        repeat_rows = []
+        seen = set()
+        body_part = doc.part
+        for tr in body_part.element.iter(qn("w:tr")):
+            m = _ROW_PLACEHOLDER_RE.search("".join(tr.itertext()))
+            if m is None or tr.find(".//" + qn("w:tr")) is not None:
+                continue
+            repeat_rows.append(RepeatRow(
+                partname=str(body_part.partname),
+                path=_element_path(body_part.element, tr),
+                source=m.group(1),
+                texts=_glue_row_placeholders(tr, body_part),
+            ))
+            seen.update(tr.iter(qn("w:p")))
+        self.repeat_rows: Tuple[RepeatRow, ...] = tuple(repeat_rows)
+
+        sites = []
+        # Обход тот же, что и при полной замене: он же создаёт недостающие
+        # колонтитулы, поэтому клоны получают ту же структуру пакета.
+        for para in _iter_document_paragraphs(doc):
+            p = para._p
+            if p in seen:
+                continue
+            seen.add(p)
+            keys = tuple(dict.fromkeys(_PLACEHOLDER_RE.findall(para.text or "")))
+            if not keys:
+                continue
+            part = para.part
+            sites.append(PlaceholderSite(
+                partname=str(part.partname),
+                path=_element_path(part.element, p),
+                keys=keys,
+                runs=_placeholder_runs(para),
+            ))
+
+        self.sites: Tuple[PlaceholderSite, ...] = tuple(sites)
+        self._package = doc.part.package
+
+        # Режим content controls: поля — w:sdt, привязанные к нашей customXml-части
+        self.binding_partname: Optional[str] = None
+        self.binding_fields: Tuple[str, ...] = ()
+        for part in self._package.iter_parts():
+            if str(part.partname).startswith("/customXml/item"):
+                fields = read_binding_fields(part.blob)
+                if fields is not None:
+                    self.binding_partname = str(part.partname)
+                    self.binding_fields = fields
+                    break
+
+        self._mutable_parts = {
+            str(part.partname): part
+            for part in self._package.iter_parts()
+            if part is doc.part
+            or isinstance(part, (HeaderPart, FooterPart))
+            or str(part.partname) == self.binding_partname
+        }
+        self._shared_parts = [
+            part for part in self._package.iter_parts()
+            if str(part.partname) not in self._mutable_parts
+        ]
+
+        # Исходный XML частей с плейсхолдерами — для render_bytes().
+        # Пути мест считаются по дереву python-docx; если в сыром XML они
+        # не указывают на те же абзацы, быстрый путь для шаблона выключается.
+        self._zip = ZipTemplate(blob)
+        self._raw_roots = {}
+        for partname in [site.partname for site in self.sites] + [row.partname for row in self.repeat_rows]:
+            name = partname.lstrip("/")
+            if partname not in self._raw_roots and name in self._zip.names:
+                self._raw_roots[partname] = parse_xml(self._zip.read(name))
+        # Части с привязанными контролами: их текст тоже заполняется (не только customXml)
+        self._bound_partnames: Tuple[str, ...] = ()
+        if self.binding_partname is not None:
+            bound = []
+            for partname, part in self._mutable_parts.items():
+                if isinstance(part, XmlPart) and has_bound_controls(part.element):
+                    bound.append(partname)
+                    if partname not in self._raw_roots and partname.lstrip("/") in self._zip.names:
+                        self._raw_roots[partname] = parse_xml(self._zip.read(partname.lstrip("/")))
+            self._bound_partnames = tuple(bound)
+        self.raw_xml_supported = (
+            all(self._raw_row_ok(row) for row in self.repeat_rows)
+            and all(self._raw_site_ok(site) for site in self.sites)
+            and (self.binding_partname is None or self.binding_partname.lstrip("/") in self._zip.names)
+            and all(partname in self._raw_roots for partname in self._bound_partnames)
+        )
+
+    def _raw_row_ok(self, row: RepeatRow) -> bool:
+        # Склеивание в сыром XML должно дать те же w:t, что и в дереве python-docx
+        root = self._raw_roots.get(row.partname)
+        if root is None:
+            return False
+        try:
+            tr = _resolve_path(root, row.path)
+        except IndexError:
+            return False
+        return tr.tag == qn("w:tr") and _glue_row_placeholders(tr, self._mutable_parts[row.partname]) == row.texts
+
+    def _raw_site_ok(self, site: PlaceholderSite) -> bool:
+        root = self._raw_roots.get(site.partname)
+        if root is None:
+            return False
+        try:
+            p = _resolve_path(root, site.path)
+        except IndexError:
+            return False
+        return p.tag == qn("w:p") and _PLACEHOLDER_RE.search("".join(p.itertext())) is not None
+
+    def render(
+        self,
+        replacements: dict,
+        preferred_font: Optional[Tuple[str, int]] = None,
+    ) -> DocxDocument:
+        """
+        Возвращает новый Document с подставленными значениями.
+        Шаблон при этом не меняется.
+        """
+        started = time.perf_counter()
+        # Если стили нормализуются, общие части тоже меняются — клонируем всё.
+        memo = {id(part): part for part in self._shared_parts} if PRESERVE_TEMPLATE_FORMAT else {}
+        package = copy.deepcopy(self._package, memo)
+        doc = package.main_document_part.document
+
+        if not PRESERVE_TEMPLATE_FORMAT:
+            try:
+                normal_style = doc.styles["Normal"]
+                normal_style.font.name = "Times New Roman"
+                normal_style.font.size = Pt(10)
+            except Exception:
+                pass
+
+        parts = {name: memo[id(part)] for name, part in self._mutable_parts.items()}
+        for site in self.sites:
+            if not any(k in replacements for k in site.keys):
+                continue
+            part = parts[site.partname]
+            paragraph = Paragraph(_resolve_path(part.element, site.path), _PartParent(part))
+            _replace_in_paragraph(paragraph, replacements, preferred_font=preferred_font)
+
+        # Места плейсхолдеров уже заполнены: вставка строк больше не сдвигает их пути
+        for row in self.repeat_rows:
+            _expand_repeat_row(_resolve_path(parts[row.partname].element, row.path), row, replacements)
+
+        if self.binding_partname is not None:
+            parts[self.binding_partname]._blob = build_binding_xml(self.binding_fields, replacements)
+            # Постобработка python-docx видит только обычные runs — разворачиваем контролы в текст
+            for part in parts.values():
+                if not isinstance(part, XmlPart):
+                    continue
+                story = _PartParent(part)
+                for r in flatten_bound_controls(part.element, replacements):
+                    run = Run(r, story)
+                    if preferred_font and run.font.name is None and run.font.size is None:
+                        _set_run_font(run, preferred_font[0], preferred_font[1])
+
+        _STAGE_PLACEHOLDERS.observe(time.perf_counter() - started)
+        return doc
+
+    def render_bytes(
+        self,
+        replacements: dict,
+        preferred_font: Optional[Tuple[str, int]] = None,
+    ) -> bytes:
+        """
+        Возвращает готовый DOCX в байтах без сборки пакета python-docx.
+        Семантика замены та же, что у render(); стили для донорского
+        форматирования читаются из разобранного шаблона (только чтение).
+        """
+        if not PRESERVE_TEMPLATE_FORMAT or not self.raw_xml_supported:
+            return document_to_bytes(self.render(replacements, preferred_font=preferred_font))
+
+        started = time.perf_counter()
+        roots = {}
+        for site in self.sites:
+            if not any(k in replacements for k in site.keys):
+                continue
+            root = roots.get(site.partname)
+            if root is None:
+                root = roots[site.partname] = copy.deepcopy(self._raw_roots[site.partname])
+            paragraph = Paragraph(
+                _resolve_path(root, site.path),
+                _PartParent(self._mutable_parts[site.partname]),
+            )
+            _replace_in_paragraph(paragraph, replacements, preferred_font=preferred_font)
+
+        for row in self.repeat_rows:
+            if replacements.get(row.source) is None:
+                continue
+            root = roots.get(row.partname)
+            if root is None:
+                root = roots[row.partname] = copy.deepcopy(self._raw_roots[row.partname])
+            _expand_repeat_row(_resolve_path(root, row.path), row, replacements)
+
+        for partname in self._bound_partnames:
+            root = roots.get(partname)
+            if root is None:
+                root = roots[partname] = copy.deepcopy(self._raw_roots[partname])
+            fill_bound_controls(root, replacements)
+
+        _STAGE_PLACEHOLDERS.observe(time.perf_counter() - started)
+        started = time.perf_counter()
+        replaced = {
+            partname.lstrip("/"): serialize_part_xml(root)
+            for partname, root in roots.items()
+        }
+        if self.binding_partname is not None:
+            # Word обновит контролы из этой части; текст в них уже заполнен выше
+            replaced[self.binding_partname.lstrip("/")] = build_binding_xml(self.binding_fields, replacements)
+        blob = self._zip.rebuild(replaced)
+        _STAGE_SAVE.observe(time.perf_counter() - started)
+        return blob
+
+
+_TEMPLATE_CACHE: Dict[Path, CompiledTemplate] = {}
+
+
+def get_compiled_template(doc_path: Path) -> CompiledTemplate:
+    """
+    Возвращает скомпилированный шаблон из кэша.
+    Если файл шаблона изменился на диске — компилирует заново.
+    """
+    key = Path(doc_path).resolve()
+    compiled = _TEMPLATE_CACHE.get(key)
+    if compiled is None or compiled.mtime != key.stat().st_mtime:
+        with _STAGE_TEMPLATE_LOAD.time():
+            compiled = CompiledTemplate(key)
+        _TEMPLATE_CACHE[key] = compiled
+    return compiled
+
+
+def preload_templates() -> None:
+    """
+    Компилирует все шаблоны проекта заранее (при старте бота).
+    """
+    for path in (TEMPLATE_CONTRACT, TEMPLATE_SCHEDULE, ISTISNA_TEMPLATE):
+        if path.exists():
+            get_compiled_template(path)
+
+
+def render_template_bytes(
+    doc_path: Path,
+    replacements: dict,
+    preferred_font: Optional[Tuple[str, int]] = None,
+) -> bytes:
+    """
+    Заполняет шаблон и возвращает DOCX в байтах.
+    При RAW_XML_FAST_PATH правится только XML частей с плейсхолдерами.
+    """
+    compiled = get_compiled_template(doc_path)
+    if RAW_XML_FAST_PATH:
+        return compiled.render_bytes(replacements, preferred_font=preferred_font)
+    return document_to_bytes(compiled.render(replacements, preferred_font=preferred_font))
+
+
+def render_template(
+    doc_path: Path,
+    replacements: dict,
+    preferred_font: Optional[Tuple[str, int]] = None,
+) -> DocxDocument:
+    """
+    Заполняет шаблон и возвращает Document в памяти (без записи на диск).
+    """
+    return get_compiled_template(doc_path).render(replacements, preferred_font=preferred_font)
+
+
+def document_to_bytes(doc: DocxDocument) -> bytes:
+    """
+    Сериализует Document в байты DOCX.
+    """
+    buf = BytesIO()
+    with _STAGE_SAVE.time():
+        doc.save(buf)
+    return buf.getvalue()
 
 
 def fill_placeholders(
@@ -448,25 +913,24 @@ def fill_placeholders(
     replacements: dict,
     preferred_font: Optional[Tuple[str, int]] = None,
 ):
-    doc = Document(str(doc_path))
+    doc = render_template(doc_path, replacements, preferred_font=preferred_font)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with _STAGE_SAVE.time():
+        doc.save(str(output_path))
 
-    if not PRESERVE_TEMPLATE_FORMAT:
-        try:
-            normal_style = doc.styles["Normal"]
-            normal_style.font.name = "Times New Roman"
-            normal_style.font.size = Pt(10)
-        except Exception:
-            pass
 
-    _replace_in_document(doc, replacements, preferred_font=preferred_font)
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    doc.save(str(output_path))
+class GeneratedDocument(NamedTuple):
+    """
+    Готовый документ в памяти: имя файла для отправки и содержимое DOCX.
+    """
+    filename: str
+    content: bytes
 
 
 def convert_docx_to_pdf(docx_path: Path) -> Path:
     """
-    Конвертация DOCX → PDF через LibreOffice (headless).
-    Сейчас НЕ используется (PDF отключён), но оставлено для будущего.
+    Разовая конвертация DOCX → PDF через LibreOffice (headless), с холодным стартом soffice.
+    Бот делает PDF через pdf_pool (прогретые конвертеры); эта функция — для ручных скриптов.
     """
     out_dir = docx_path.parent
     cmd = [
@@ -480,42 +944,145 @@ def convert_docx_to_pdf(docx_path: Path) -> Path:
     return docx_path.with_suffix(".pdf")
 
 
+class DocumentJob(NamedTuple):
+    """
+    Один документ договора: имя файла и функция, которая его рендерит — render(*args) → bytes DOCX.
+    Документы договора независимы: их можно рендерить параллельно (и в пуле процессов).
+    """
+    filename: str
+    render: Callable[..., bytes]
+    args: tuple
+
+
+def murabaha_document_jobs(data: dict) -> List[DocumentJob]:
+    """
+    Договор (templates/murabaha_template.docx) и график (templates/murabaha_schedule.docx).
+    Имена файлов используют data['contract_number'].
+    """
+    safe_number = str(data["contract_number"]).replace("/", "_")
+    return [
+        DocumentJob(f"dogovor_{safe_number}.docx", render_template_bytes, (TEMPLATE_CONTRACT, data)),
+        DocumentJob(f"schedule_{safe_number}.docx", render_template_bytes, (TEMPLATE_SCHEDULE, data)),
+    ]
+
+
+def _render_istisna_bytes(data: dict) -> bytes:
+    doc = render_template(ISTISNA_TEMPLATE, data, preferred_font=("Aptos", 11))
+    with _STAGE_ISTISNA_POSTPROCESS.time():
+        _postprocess_istisna(doc, data)
+    return document_to_bytes(doc)
+
+
+def istisna_document_jobs(data: dict) -> List[DocumentJob]:
+    """
+    Единый docx по Истисна (3 страницы в одном файле).
+    """
+    safe_number = str(data["contract_number"]).replace("/", "_")
+    return [DocumentJob(f"istisna_{safe_number}.docx", _render_istisna_bytes, (data,))]
+
+
 # noinspection SpellCheckingInspection,PyPep8Naming
-def generate_contract_and_schedule(data: dict, out_dir: Path):
+def generate_contract_and_schedule(data: dict) -> Tuple[GeneratedDocument, GeneratedDocument]:
     """
-    Формирует два готовых docx:
+    Формирует два готовых docx (в памяти), один за другим:
     1) Договор (templates/murabaha_template.docx)
     2) График (templates/murabaha_schedule.docx)
-    Имена файлов используют data['contract_number'].
     """
-    out_dir.mkdir(parents=True, exist_ok=True)
+    return tuple(GeneratedDocument(job.filename, job.render(*job.args)) for job in murabaha_document_jobs(data))
 
-    contract_template = TEMPLATE_CONTRACT
-    schedule_template = TEMPLATE_SCHEDULE
 
-    safe_number = str(data["contract_number"]).replace("/", "_")
-    contract_out = out_dir / f"dogovor_{safe_number}.docx"
-    schedule_out = out_dir / f"schedule_{safe_number}.docx"
+def generate_istisna_documents(data: dict) -> Tuple[GeneratedDocument]:
+    """
+    Формирует единый docx по Истисна (3 страницы в одном файле), в памяти.
+    """
+    return tuple(GeneratedDocument(job.filename, job.render(*job.args)) for job in istisna_document_jobs(data))
 
-    fill_placeholders(contract_template, contract_out, data)
-    fill_placeholders(schedule_template, schedule_out, data)
 
-    return contract_out, schedule_out
+def _fill_spec_row(row, number: int, values: Tuple[str, ...]) -> None:
+    """
+    Заполняет строку спецификации Истисна: номер + values в колонки 1..5,
+    числовые колонки по центру, текст — Aptos 11.
+    """
+    cells = row.cells
+    if len(cells) >= 6:
+        cells[0].text = str(number)
+        for c_idx, value in enumerate(values, start=1):
+            cells[c_idx].text = value
+
+    # Ensure inserted values in table rows are explicitly Aptos 11.
+    for c_idx, cell in enumerate(cells):
+        for para in cell.paragraphs:
+            # Center numeric columns: price, qty, total.
+            if c_idx in (3, 4, 5):
+                para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+            for run in para.runs:
+                if run.text:
+                    _set_run_font(run, "Aptos", 11)
 
 
-def generate_istisna_documents(data: dict, out_dir: Path):
+def _spec_lines(data: dict) -> List[Tuple[str, ...]]:
     """
-    Формирует единый docx по Истисна (3 страницы в одном файле).
+    Значения колонок 1..5 для каждой строки спецификации.
+    data["items"] — [(наименование, цена, количество), ...]: строка на товар, суммы в Decimal.
+    У нескольких товаров сумма строки — всегда цена × количество; итог, введённый
+    вручную, показывается только в «Итого» и в строки не разносится.
+    Без items (один товар в плейсхолдерах) — по строке на единицу товара, как раньше.
     """
-    out_dir.mkdir(parents=True, exist_ok=True)
+    total_cost = str(data.get("{{total_cost_final}}", ""))
+    items = data.get("items")
+    if items:
+        if len(items) == 1:
+            name, price, qty = items[0]
+            return [(str(name), str(name), str(price), str(qty), total_cost)]
+        return [(str(name), str(name), str(price), str(qty), str(Decimal(price) * qty)) for name, price, qty in items]
 
-    safe_number = str(data["contract_number"]).replace("/", "_")
-    out = out_dir / f"istisna_{safe_number}.docx"
-    fill_placeholders(ISTISNA_TEMPLATE, out, data, preferred_font=("Aptos", 11))
+    item_qty = int(data.get("{{item_qty}}", 1) or 1)
+    if item_qty < 1:
+        item_qty = 1
+    item_name = str(data.get("{{item_name}}", ""))
+    item_price = str(data.get("{{item_price}}", ""))
+    per_row_qty = "1" if item_qty > 1 else str(item_qty)
+    per_row_total = item_price if item_qty > 1 else total_cost
+    return [(item_name, item_name, item_price, per_row_qty, per_row_total)] * item_qty
 
-    # Post-process Istisna document: clean highlight and fit item rows count.
-    doc = Document(str(out))
 
+def _clone_spec_rows(prototype, lines, first_number: int, table) -> list:
+    """
+    Копии заполненной строки-прототипа для lines, с номерами от first_number.
+    В копии меняется только текст w:t ячеек; если ячейку нельзя так заполнить
+    (несколько w:t, перенос строки в значении, вертикальное объединение),
+    строка заполняется через python-docx.
+    """
+    proto_tr = prototype._tr
+    cells = prototype.cells
+    text_paths = None
+    if len(cells) >= 6:
+        text_paths = []
+        for cell in cells[:6]:
+            ts = list(cell._tc.iter(qn("w:t")))
+            if len(ts) != 1 or not any(anc is proto_tr for anc in ts[0].iterancestors()):
+                text_paths = None
+                break
+            text_paths.append(_element_path(proto_tr, ts[0]))
+
+    new_trs = []
+    for number, values in enumerate(lines, start=first_number):
+        tr = copy.deepcopy(proto_tr)
+        texts = (str(number),) + tuple(values)
+        if text_paths is not None and not any("\n" in v or "\t" in v for v in texts):
+            for path, text in zip(text_paths, texts):
+                _resolve_path(tr, path).text = text
+        else:
+            _fill_spec_row(_Row(tr, table), number, values)
+        new_trs.append(tr)
+    return new_trs
+
+
+def _postprocess_istisna(doc: DocxDocument, data: dict) -> None:
+    """
+    Постобработка Истисна в том же Document: чистка подсветки,
+    шрифты блока оплаты и строки спецификации (по товару или по единице товара).
+    """
     # Убрать лишние пробелы/табы в блоке ФИО покупателя (как у поставщика).
     def _normalize_fio_paragraph(paragraph):
         full = (paragraph.text or "").strip()
@@ -562,9 +1129,7 @@ def generate_istisna_documents(data: dict, out_dir: Path):
                 if run.text:
                     _set_run_font(run, "Aptos", 11)
 
-    item_qty = int(data.get("{{item_qty}}", 1) or 1)
-    if item_qty < 1:
-        item_qty = 1
+    lines = _spec_lines(data)
     spec_table = None
     for table in doc.tables:
         if table.rows and "НАИМЕНОВАНИЕ ТОВАРА" in " | ".join(c.text for c in table.rows[0].cells):
@@ -572,64 +1137,34 @@ def generate_istisna_documents(data: dict, out_dir: Path):
             break
 
     if spec_table is not None and len(spec_table.rows) >= 3:
+        # Прокси строк строим один раз: каждое обращение к table.rows пересоздаёт список.
+        rows = spec_table.rows
         total_idx = None
-        for i, row in enumerate(spec_table.rows):
+        for i, row in enumerate(rows):
             if "Итого:" in " ".join(c.text for c in row.cells):
                 total_idx = i
                 break
         if total_idx is not None and total_idx > 1:
             item_start = 1
-            existing_items = total_idx - item_start
-            template_row = spec_table.rows[item_start]
-
-            # Expand rows if requested qty is larger than template item rows.
-            while existing_items < item_qty:
-                new_tr = copy.deepcopy(template_row._tr)
-                spec_table._tbl.insert(total_idx, new_tr)
-                existing_items += 1
-                total_idx += 1
-
-            # Remove extra rows from bottom (keep exactly item_qty rows).
-            while existing_items > item_qty:
-                drop_idx = item_start + existing_items - 1
-                spec_table._tbl.remove(spec_table.rows[drop_idx]._tr)
-                existing_items -= 1
-                total_idx -= 1
+            item_rows = rows[item_start:total_idx]
+            total_row = rows[total_idx]
+
+            # Remove extra rows from bottom (keep exactly one row per line).
+            for row in item_rows[len(lines):]:
+                spec_table._tbl.remove(row._tr)
+            item_rows = item_rows[:len(lines)]
 
             # Fill item rows to avoid empty cells and keep visible numbering.
-            item_name = str(data.get("{{item_name}}", ""))
-            item_price = str(data.get("{{item_price}}", ""))
             total_cost = str(data.get("{{total_cost_final}}", ""))
-            per_row_qty = "1" if item_qty > 1 else str(item_qty)
-            per_row_total = item_price if item_qty > 1 else total_cost
-            for n in range(item_qty):
-                row = spec_table.rows[item_start + n]
-                if len(row.cells) >= 6:
-                    row.cells[0].text = str(n + 1)
-                    row.cells[1].text = item_name
-                    row.cells[2].text = item_name
-                    row.cells[3].text = item_price
-                    row.cells[4].text = per_row_qty
-                    row.cells[5].text = per_row_total
-
-            # Ensure inserted values in table rows are explicitly Aptos 11.
-            for n in range(item_qty):
-                row = spec_table.rows[item_start + n]
-                for c_idx, cell in enumerate(row.cells):
-                    for para in cell.paragraphs:
-                        # Center numeric columns: price, qty, total.
-                        if c_idx in (3, 4, 5):
-                            para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-                        for run in para.runs:
-                            if run.text:
-                                _set_run_font(run, "Aptos", 11)
+            for n, (row, values) in enumerate(zip(item_rows, lines)):
+                _fill_spec_row(row, n + 1, values)
 
             # Merge total row right-side cells so no extra vertical separators appear.
-            total_row = spec_table.rows[total_idx]
-            if len(total_row.cells) >= 6:
+            total_cells = total_row.cells
+            if len(total_cells) >= 6:
                 for i in range(0, 6):
-                    total_row.cells[i].text = ""
-                merged_total = total_row.cells[0].merge(total_row.cells[5])
+                    total_cells[i].text = ""
+                merged_total = total_cells[0].merge(total_cells[5])
                 merged_total.text = f"Итого: {total_cost} рублей 00 копеек."
                 for para in merged_total.paragraphs:
                     para.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT
@@ -637,5 +1172,11 @@ def generate_istisna_documents(data: dict, out_dir: Path):
                         if run.text:
                             _set_run_font(run, "Aptos", 11)
 
-    doc.save(str(out))
-    return (out,)
\ No newline at end of file
+            # Expand rows if there are more lines than template item rows:
+            # заполненная первая строка — прототип, в копиях меняется только текст,
+            # все копии вставляются перед «Итого» одной вставкой.
+            if len(lines) > len(item_rows):
+                new_trs = _clone_spec_rows(item_rows[0], lines[len(item_rows):], len(item_rows) + 1, spec_table)
+                tbl = spec_table._tbl
+                pos = tbl.index(total_row._tr)
+                tbl[pos:pos] = new_trs
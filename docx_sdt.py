@@ -0,0 +1,180 @@
+# docx_sdt.py
+import copy
+import re
+from typing import List, Optional, Tuple
+
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from lxml import etree
+
+# Режим шаблонов с content controls: каждое поле — w:sdt, привязанный (w:dataBinding)
+# к элементу customXml-части. Word при открытии подставляет значения из неё сам;
+# для остальных просмотрщиков (LibreOffice, превью) значение пишется и в текст контрола.
+BINDING_NS = "urn:dogovorshikbot:contract"
+BINDING_ROOT = "contract"
+BINDING_STORE_ID = "{6B1D7C2E-4F0A-4D55-9E3B-2C8A1F6D9B40}"
+_PREFIX_MAPPINGS = f"xmlns:ns0='{BINDING_NS}'"
+
+# {{список.поле}} — поле повторяемой строки таблицы, в контрол не превращается
+_FIELD_NAME_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_-]*$")
+
+_DATASTORE_NS = "http://schemas.openxmlformats.org/officeDocument/2006/customXml"
+
+
+def field_name(placeholder: str) -> Optional[str]:
+    """
+    {{nomer_dogovora}} → nomer_dogovora.
+    None, если имя не годится как имя XML-элемента (такой плейсхолдер остаётся текстом).
+    """
+    name = placeholder[2:-2].strip()
+    return name if _FIELD_NAME_RE.match(name) else None
+
+
+def placeholder_key(name: str) -> str:
+    return "{{" + name + "}}"
+
+
+def make_content_control(run_element, name: str, sdt_id: int):
+    """
+    Оборачивает run в w:sdt, привязанный к полю name customXml-части.
+    """
+    sdt = OxmlElement("w:sdt")
+    sdt_pr = OxmlElement("w:sdtPr")
+    for tag, value in (("w:alias", name), ("w:tag", name), ("w:id", str(sdt_id))):
+        el = OxmlElement(tag)
+        el.set(qn("w:val"), value)
+        sdt_pr.append(el)
+    binding = OxmlElement("w:dataBinding")
+    binding.set(qn("w:prefixMappings"), _PREFIX_MAPPINGS)
+    binding.set(qn("w:xpath"), f"/ns0:{BINDING_ROOT}[1]/ns0:{name}[1]")
+    binding.set(qn("w:storeItemID"), BINDING_STORE_ID)
+    sdt_pr.append(binding)
+    text = OxmlElement("w:text")
+    text.set(qn("w:multiLine"), "1")
+    sdt_pr.append(text)
+    sdt.append(sdt_pr)
+
+    content = OxmlElement("w:sdtContent")
+    content.append(run_element)
+    sdt.append(content)
+    return sdt
+
+
+def split_run_into_controls(run_element, next_id: int) -> Tuple[List, List[str], int]:
+    """
+    Режет run с плейсхолдерами на куски: обычный текст остаётся run'ами,
+    каждый плейсхолдер становится content control. Все куски — копии исходного
+    run, т.е. с его форматированием.
+    Возвращает (элементы на замену run, имена полей, следующий свободный w:id).
+    """
+    text = run_element.text or ""
+    elements = []
+    fields = []
+    pos = 0
+    for m in re.finditer(r"\{\{[^{}]+\}\}", text):
+        name = field_name(m.group(0))
+        if name is None:
+            continue
+        if m.start() > pos:
+            elements.append(_run_with_text(run_element, text[pos:m.start()]))
+        elements.append(make_content_control(_run_with_text(run_element, m.group(0)), name, next_id))
+        fields.append(name)
+        next_id += 1
+        pos = m.end()
+    if pos < len(text):
+        elements.append(_run_with_text(run_element, text[pos:]))
+    return elements, fields, next_id
+
+
+def _run_with_text(run_element, text: str):
+    r = copy.deepcopy(run_element)
+    r.text = text
+    return r
+
+
+def build_binding_xml(fields, replacements: dict) -> bytes:
+    """
+    XML-часть с данными договора. Значения берутся из replacements по ключам {{поле}};
+    поля без значения сохраняют текст плейсхолдера, как и в текстовом режиме.
+    """
+    root = etree.Element(f"{{{BINDING_NS}}}{BINDING_ROOT}", nsmap={None: BINDING_NS})
+    for name in fields:
+        key = placeholder_key(name)
+        etree.SubElement(root, f"{{{BINDING_NS}}}{name}").text = str(replacements.get(key, key))
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+
+def build_binding_props_xml() -> bytes:
+    root = etree.Element(f"{{{_DATASTORE_NS}}}datastoreItem", nsmap={"ds": _DATASTORE_NS})
+    root.set(f"{{{_DATASTORE_NS}}}itemID", BINDING_STORE_ID)
+    etree.SubElement(root, f"{{{_DATASTORE_NS}}}schemaRefs")
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=False)
+
+
+def read_binding_fields(blob: bytes) -> Optional[Tuple[str, ...]]:
+    """
+    Имена полей из customXml-части, если это наша часть с данными договора, иначе None.
+    """
+    if not blob or BINDING_NS.encode() not in blob:
+        return None
+    try:
+        root = etree.fromstring(blob)
+    except etree.XMLSyntaxError:
+        return None
+    if root.tag != f"{{{BINDING_NS}}}{BINDING_ROOT}":
+        return None
+    return tuple(etree.QName(child).localname for child in root if isinstance(child.tag, str))
+
+
+def _bound_controls(root):
+    """
+    Наши привязанные content controls: (w:sdt, ключ {{поле}}, w:sdtContent или None).
+    """
+    for sdt in list(root.iter(qn("w:sdt"))):
+        sdt_pr = sdt.find(qn("w:sdtPr"))
+        binding = sdt_pr.find(qn("w:dataBinding")) if sdt_pr is not None else None
+        if binding is None or binding.get(qn("w:storeItemID")) != BINDING_STORE_ID:
+            continue
+        tag = sdt_pr.find(qn("w:tag"))
+        yield sdt, placeholder_key(tag.get(qn("w:val"))), sdt.find(qn("w:sdtContent"))
+
+
+def has_bound_controls(root) -> bool:
+    return next(_bound_controls(root), None) is not None
+
+
+def _fill_content(content, key: str, replacements: dict):
+    runs = content.findall(qn("w:r")) if content is not None else []
+    if not runs:
+        return None
+    runs[0].text = str(replacements.get(key, key))
+    for extra in runs[1:]:
+        content.remove(extra)
+    return runs[0]
+
+
+def fill_bound_controls(root, replacements: dict) -> None:
+    """
+    Записывает значения в текст привязанных контролов, не снимая привязку.
+    Word всё равно возьмёт значения из customXml, а LibreOffice (PDF), превью Telegram
+    и другие просмотрщики привязку не обновляют и показывают именно этот текст.
+    """
+    for _, key, content in _bound_controls(root):
+        _fill_content(content, key, replacements)
+
+
+def flatten_bound_controls(root, replacements: dict) -> List:
+    """
+    Заменяет привязанные content controls обычными runs со значениями.
+    Нужно для пути python-docx: постобработка (Истисна) видит только прямые runs абзаца.
+    Возвращает заполненные runs.
+    """
+    filled = []
+    for sdt, key, content in _bound_controls(root):
+        run = _fill_content(content, key, replacements)
+        if run is not None:
+            filled.append(run)
+        for child in list(content if content is not None else []):
+            sdt.addprevious(child)
+        sdt.getparent().remove(sdt)
+    return filled
@@ -0,0 +1,131 @@
+# docx_zip.py
+import struct
+import zlib
+from typing import Dict, List, NamedTuple
+
+# Сигнатуры и форматы записей ZIP (PKWARE APPNOTE)
+_LOCAL_SIG = 0x04034B50
+_CENTRAL_SIG = 0x02014B50
+_END_SIG = 0x06054B50
+_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_END_RECORD = struct.Struct("<IHHHHIIH")
+
+_STORED = 0
+_DEFLATED = 8
+_VERSION = 20
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+
+
+class ZipMember(NamedTuple):
+    """
+    Член архива в сжатом виде: копируется в результат байт в байт.
+    """
+    name: str
+    flags: int
+    method: int
+    dos_time: int
+    dos_date: int
+    crc: int
+    data: bytes
+    size: int
+    external_attr: int
+
+
+def _read_members(blob: bytes) -> List[ZipMember]:
+    """
+    Читает центральный каталог и вынимает сжатые данные членов без распаковки.
+    """
+    end_pos = blob.rfind(struct.pack("<I", _END_SIG))
+    if end_pos < 0:
+        raise ValueError("Not a zip archive: end of central directory not found")
+    _, _, _, _, count, _, cd_offset, _ = _END_RECORD.unpack_from(blob, end_pos)
+
+    members = []
+    pos = cd_offset
+    for _ in range(count):
+        (sig, _, _, flags, method, dos_time, dos_date, crc, csize, usize,
+         name_len, extra_len, comment_len, _, _, external_attr, local_offset) = _CENTRAL_HEADER.unpack_from(blob, pos)
+        if sig != _CENTRAL_SIG:
+            raise ValueError("Broken zip central directory")
+        raw_name = blob[pos + _CENTRAL_HEADER.size:pos + _CENTRAL_HEADER.size + name_len]
+        name = raw_name.decode("utf-8" if flags & _FLAG_UTF8 else "cp437")
+        pos += _CENTRAL_HEADER.size + name_len + extra_len + comment_len
+
+        local_name_len, local_extra_len = struct.unpack_from("<HH", blob, local_offset + 26)
+        data_start = local_offset + _LOCAL_HEADER.size + local_name_len + local_extra_len
+        members.append(ZipMember(
+            name=name,
+            flags=flags & ~_FLAG_DATA_DESCRIPTOR,
+            method=method,
+            dos_time=dos_time,
+            dos_date=dos_date,
+            crc=crc,
+            data=blob[data_start:data_start + csize],
+            size=usize,
+            external_attr=external_attr,
+        ))
+    return members
+
+
+def _deflate(content: bytes) -> bytes:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return compressor.compress(content) + compressor.flush()
+
+
+class ZipTemplate:
+    """
+    Архив-шаблон в памяти.
+    rebuild() собирает новый архив: заменённые члены сжимаются заново,
+    остальные копируются из шаблона без перепаковки.
+    """
+
+    def __init__(self, blob: bytes):
+        self.members: List[ZipMember] = _read_members(blob)
+        self.names = frozenset(m.name for m in self.members)
+
+    def read(self, name: str) -> bytes:
+        """
+        Распакованное содержимое члена архива.
+        """
+        member = next(m for m in self.members if m.name == name)
+        if member.method == _STORED:
+            return member.data
+        return zlib.decompress(member.data, -15)
+
+    def rebuild(self, replaced: Dict[str, bytes]) -> bytes:
+        local_chunks = []
+        central_chunks = []
+        offset = 0
+        for member in self.members:
+            content = replaced.get(member.name)
+            if content is not None:
+                member = member._replace(
+                    method=_DEFLATED,
+                    crc=zlib.crc32(content),
+                    data=_deflate(content),
+                    size=len(content),
+                )
+
+            name = member.name.encode("utf-8")
+            flags = member.flags | _FLAG_UTF8 if not name.isascii() else member.flags
+            local_chunks.append(_LOCAL_HEADER.pack(
+                _LOCAL_SIG, _VERSION, flags, member.method, member.dos_time, member.dos_date,
+                member.crc, len(member.data), member.size, len(name), 0,
+            ))
+            local_chunks.append(name)
+            local_chunks.append(member.data)
+            central_chunks.append(_CENTRAL_HEADER.pack(
+                _CENTRAL_SIG, _VERSION, _VERSION, flags, member.method, member.dos_time, member.dos_date,
+                member.crc, len(member.data), member.size, len(name), 0, 0, 0, 0,
+                member.external_attr, offset,
+            ))
+            central_chunks.append(name)
+            offset += _LOCAL_HEADER.size + len(name) + len(member.data)
+
+        central = b"".join(central_chunks)
+        end = _END_RECORD.pack(
+            _END_SIG, 0, 0, len(self.members), len(self.members), len(central), offset, 0,
+        )
+        return b"".join(local_chunks) + central + end
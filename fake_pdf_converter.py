@@ -0,0 +1,49 @@
+# fake_pdf_converter.py
+"""
+Фейковый конвертер для pdf_pool: тот же протокол, что у soffice_worker.py, но без LibreOffice.
+
+    PDF_CONVERTER="python3 fake_pdf_converter.py" python bot.py
+
+PDF — строка "%PDF-fake pid=<pid>" и содержимое исходного файла. Поведение задаётся
+содержимым DOCX:
+    sleep:<сек>  — ответить через столько секунд (проверка таймаута и параллельности)
+    crash        — завершиться, не ответив
+    error        — ответить {"ok": false}
+    nopdf        — ответить {"ok": true}, не записав PDF
+FAKE_START_DELAY — задержка перед {"ready": true} (сек).
+"""
+import json
+import os
+import sys
+import time
+
+
+def _reply(**kwargs) -> None:
+    sys.stdout.write(json.dumps(kwargs) + "\n")
+    sys.stdout.flush()
+
+
+def main() -> None:
+    time.sleep(float(os.getenv("FAKE_START_DELAY", "0")))
+    _reply(ready=True)
+    for line in sys.stdin:
+        job = json.loads(line)
+        with open(job["src"], "rb") as f:
+            content = f.read()
+        if content.startswith(b"sleep:"):
+            time.sleep(float(content.split(b":", 1)[1].split()[0]))
+        elif content == b"crash":
+            sys.exit(3)
+        elif content == b"error":
+            _reply(ok=False, error="fake conversion error")
+            continue
+        elif content == b"nopdf":
+            _reply(ok=True)
+            continue
+        with open(job["dst"], "wb") as f:
+            f.write(b"%%PDF-fake pid=%d\n" % os.getpid() + content)
+        _reply(ok=True)
+
+
+if __name__ == "__main__":
+    main()
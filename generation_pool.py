@@ -0,0 +1,176 @@
+# generation_pool.py
+import asyncio
+import logging
+import os
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Set
+
+import metrics
+from docx_generator import preload_templates
+
+GENERATIONS_IN_FLIGHT = metrics.gauge("generations_in_flight", "Документы в пуле генерации (выполняются или ждут воркер)")
+GENERATIONS_ABANDONED = metrics.gauge(
+    "generations_abandoned", "Генерации, брошенные по таймауту, но ещё занимающие воркер"
+)
+GENERATION_POOL_RECYCLED = metrics.counter(
+    "generation_pool_recycled_total", "Перезапуски процессов пула из-за зависших генераций"
+)
+
+
+class GenerationTimeout(TimeoutError):
+    """
+    Генерация документов не уложилась в отведённое время.
+    """
+
+
+class GenerationPoolBusy(GenerationTimeout):
+    """
+    Все допустимые воркеры заняты брошенными по таймауту генерациями — задача не принята.
+    """
+
+
+def _init_worker() -> None:
+    """
+    Инициализация воркера: шаблоны компилируются один раз на процесс/поток.
+    """
+    preload_templates()
+
+
+class GenerationPool:
+    """
+    Пул для блокирующей генерации DOCX (python-docx + lxml + zip),
+    чтобы async-хэндлеры не останавливали event loop.
+    - kind: "thread" или "process"
+    - workers: сколько генераций идёт одновременно (остальные ждут в очереди пула)
+    - timeout: сколько секунд ждать результат (вместе с ожиданием в очереди)
+    - max_abandoned: сколько брошенных по таймауту генераций может занимать воркеры
+
+    Таймаут не останавливает уже начатую генерацию: она продолжает занимать воркер
+    («брошенная»). Когда брошенных max_abandoned: в режиме process процессы пула
+    убиваются и пул создаётся заново, в режиме thread (поток не убить) новые задачи
+    отклоняются GenerationPoolBusy, пока брошенные не завершатся.
+    """
+
+    def __init__(
+        self,
+        kind: str = "thread",
+        workers: int = 2,
+        timeout: float = 60.0,
+        max_abandoned: Optional[int] = None,
+    ):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown generation executor: {kind!r} (expected 'thread' or 'process')")
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.max_abandoned = max(1, max_abandoned if max_abandoned is not None else self.workers)
+        self._executor: Optional[Executor] = None
+        self._abandoned: Set[Future] = set()
+        GENERATIONS_ABANDONED.set_function(self.abandoned_count)
+
+    def start(self) -> None:
+        if self._executor is not None:
+            return
+        if self.kind == "process":
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        else:
+            _init_worker()
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="docx-gen",
+            )
+        logging.info("Generation pool started: %s x%d, timeout %.0fs", self.kind, self.workers, self.timeout)
+
+    def abandoned_count(self) -> int:
+        self._abandoned = {f for f in self._abandoned if not f.done()}
+        return len(self._abandoned)
+
+    def _recycle(self) -> None:
+        """
+        Убивает процессы пула вместе с зависшими генерациями и создаёт пул заново.
+        Задачи, ждавшие в старом пуле, завершатся BrokenProcessPool.
+        """
+        logging.warning("Generation pool: %d abandoned jobs, restarting worker processes", len(self._abandoned))
+        old, self._executor = self._executor, None
+        self._abandoned.clear()
+        # Своего API, чтобы убить процессы ProcessPoolExecutor, в 3.11 нет
+        for process in list((getattr(old, "_processes", None) or {}).values()):
+            process.terminate()
+        old.shutdown(wait=False)
+        GENERATION_POOL_RECYCLED.inc()
+        self.start()
+
+    async def run(self, func, *args):
+        """
+        Выполняет func(*args) в пуле и возвращает результат.
+        При превышении таймаута бросает GenerationTimeout
+        (задача, не успевшая стартовать, снимается из очереди пула; начатая — становится брошенной).
+        """
+        self.start()
+        if self.abandoned_count() >= self.max_abandoned:
+            if self.kind != "process":
+                raise GenerationPoolBusy(f"{len(self._abandoned)} timed out generations are still running")
+            self._recycle()
+        job = self._executor.submit(func, *args)
+        GENERATIONS_IN_FLIGHT.inc()
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(job), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            # wait_for отменяет задачу; если она уже выполняется, отмена не срабатывает
+            if not job.done():
+                self._abandoned.add(job)
+                logging.warning("Generation %s abandoned after %.0fs", getattr(func, "__name__", func), self.timeout)
+            raise GenerationTimeout(f"{getattr(func, '__name__', func)} took longer than {self.timeout}s") from None
+        except BrokenProcessPool:
+            raise GenerationTimeout("generation worker was restarted") from None
+        finally:
+            GENERATIONS_IN_FLIGHT.dec()
+
+    def shutdown(self) -> None:
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+
+_pool: Optional[GenerationPool] = None
+
+
+def start_generation_pool(
+    kind: Optional[str] = None,
+    workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> GenerationPool:
+    """
+    Создаёт и запускает общий пул генерации.
+    Без аргументов берёт настройки из env:
+    GENERATION_EXECUTOR (thread|process), GENERATION_WORKERS, GENERATION_TIMEOUT (сек),
+    GENERATION_MAX_ABANDONED (по умолчанию GENERATION_WORKERS).
+    """
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+    _pool = GenerationPool(
+        kind=kind or os.getenv("GENERATION_EXECUTOR", "thread"),
+        workers=workers if workers is not None else int(os.getenv("GENERATION_WORKERS", "2")),
+        timeout=timeout if timeout is not None else float(os.getenv("GENERATION_TIMEOUT", "60")),
+        max_abandoned=int(os.getenv("GENERATION_MAX_ABANDONED", "0")) or None,
+    )
+    _pool.start()
+    return _pool
+
+
+def shutdown_generation_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+async def run_generation(func, *args):
+    """
+    Запускает генерацию в общем пуле (при первом вызове пул создаётся с настройками из env).
+    """
+    pool = _pool or start_generation_pool()
+    return await pool.run(func, *args)
@@ -0,0 +1,179 @@
+# generation_queue.py
+"""
+Очередь заданий на формирование документов (между «✅ Сгенерировать» и генераторами).
+
+- одновременно выполняется не больше workers заданий, остальные ждут;
+- очередь ограничена max_depth: сверх неё задание сразу отклоняется (GenerationQueueFull),
+  а не замедляет всех;
+- порядок справедливый между чатами: по кругу, по одному заданию от каждого чата;
+- ожидающему заданию сообщается его место (1 — следующее), не чаще раза в notify_interval сек.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Hashable, List, Optional, TypeVar
+
+import metrics
+
+T = TypeVar("T")
+PositionCallback = Callable[[int], Awaitable[None]]
+
+QUEUE_DEPTH = metrics.gauge("generation_queue_depth", "Задания, ждущие в очереди генерации")
+QUEUE_RUNNING = metrics.gauge("generation_queue_running", "Задания генерации в работе")
+QUEUE_REJECTED = metrics.counter("generation_queue_rejected_total", "Задания, отклонённые из-за полной очереди")
+QUEUE_WAIT_SECONDS = metrics.histogram("generation_queue_wait_seconds", "Ожидание задания в очереди генерации")
+
+
+class GenerationQueueFull(RuntimeError):
+    """
+    Очередь генерации заполнена — задание не принято.
+    """
+
+
+class _Job:
+    __slots__ = ("chat", "on_position", "started", "position", "notifier", "queued_at")
+
+    def __init__(self, chat: Hashable, on_position: Optional[PositionCallback]):
+        self.chat = chat
+        self.on_position = on_position
+        self.started = asyncio.Event()
+        self.position = 0
+        self.notifier: Optional[asyncio.Task] = None
+        self.queued_at = time.perf_counter()
+
+
+class GenerationQueue:
+    """
+    - workers: сколько заданий выполняется одновременно
+    - max_depth: сколько заданий может ждать (0 — без ожидания: только свободные слоты)
+    - notify_interval: минимальный интервал между сообщениями о месте в очереди (сек)
+    """
+
+    def __init__(self, workers: int = 2, max_depth: int = 50, notify_interval: float = 2.0):
+        self.workers = max(1, workers)
+        self.max_depth = max(0, max_depth)
+        self.notify_interval = notify_interval
+        self._running = 0
+        self._waiting = 0
+        # Чат → его ожидающие задания; порядок ключей — очередь обхода по кругу
+        self._chats: "OrderedDict[Hashable, Deque[_Job]]" = OrderedDict()
+
+    @property
+    def depth(self) -> int:
+        return self._waiting
+
+    def _order(self) -> List[_Job]:
+        """
+        Порядок запуска ожидающих заданий: по кругу по чатам, по одному за проход.
+        """
+        order = []
+        queues = [list(q) for q in self._chats.values()]
+        for i in range(max(map(len, queues), default=0)):
+            order.extend(q[i] for q in queues if i < len(q))
+        return order
+
+    def _dispatch(self) -> None:
+        while self._running < self.workers and self._chats:
+            chat, jobs = self._chats.popitem(last=False)
+            job = jobs.popleft()
+            if jobs:
+                # Чат уходит в конец круга
+                self._chats[chat] = jobs
+            self._waiting -= 1
+            self._running += 1
+            job.started.set()
+        QUEUE_DEPTH.set(self._waiting)
+        QUEUE_RUNNING.set(self._running)
+        for position, job in enumerate(self._order(), start=1):
+            if job.position != position:
+                job.position = position
+                self._notify(job)
+
+    def _notify(self, job: _Job) -> None:
+        if job.on_position is None or (job.notifier is not None and not job.notifier.done()):
+            return
+        job.notifier = asyncio.get_running_loop().create_task(self._notifier(job))
+
+    async def _notifier(self, job: _Job) -> None:
+        # Последнее место отправляется, промежуточные при частых сдвигах пропускаются
+        sent = None
+        while not job.started.is_set() and job.position != sent:
+            sent = job.position
+            try:
+                await job.on_position(sent)
+            except Exception:
+                logging.exception("Queue position callback failed")
+            try:
+                await asyncio.wait_for(job.started.wait(), self.notify_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self, chat: Hashable, func: Callable[[], Awaitable[T]], on_position: Optional[PositionCallback] = None) -> T:
+        """
+        Выполняет func() в порядке очереди. on_position(n) вызывается, пока задание ждёт
+        (n — место, 1 — следующее). Очередь заполнена — GenerationQueueFull сразу.
+        """
+        if self._running >= self.workers and self._waiting >= self.max_depth:
+            QUEUE_REJECTED.inc()
+            raise GenerationQueueFull(f"generation queue is full ({self.max_depth} jobs waiting)")
+
+        job = _Job(chat, on_position)
+        self._chats.setdefault(chat, deque()).append(job)
+        self._waiting += 1
+        self._dispatch()
+        try:
+            await job.started.wait()
+            # Сообщение о месте, отправка которого уже идёт, должно уйти раньше старта
+            if job.notifier is not None:
+                await job.notifier
+        except asyncio.CancelledError:
+            if job.notifier is not None:
+                job.notifier.cancel()
+            if not job.started.is_set():
+                jobs = self._chats.get(chat)
+                jobs.remove(job)
+                if not jobs:
+                    del self._chats[chat]
+                self._waiting -= 1
+                self._dispatch()
+                raise
+            # Отмена пришла вместе со стартом — слот уже выдан, его надо вернуть
+            self._running -= 1
+            self._dispatch()
+            raise
+
+        QUEUE_WAIT_SECONDS.observe(time.perf_counter() - job.queued_at)
+        try:
+            return await func()
+        finally:
+            self._running -= 1
+            self._dispatch()
+
+
+_queue: Optional[GenerationQueue] = None
+
+
+def start_generation_queue(workers: Optional[int] = None, max_depth: Optional[int] = None) -> GenerationQueue:
+    """
+    Создаёт общую очередь. Без аргументов — из env:
+    GENERATION_CONCURRENCY (по умолчанию GENERATION_WORKERS), GENERATION_QUEUE_SIZE.
+    """
+    global _queue
+    _queue = GenerationQueue(
+        workers=workers if workers is not None else int(
+            os.getenv("GENERATION_CONCURRENCY") or os.getenv("GENERATION_WORKERS", "2")
+        ),
+        max_depth=max_depth if max_depth is not None else int(os.getenv("GENERATION_QUEUE_SIZE", "50")),
+        notify_interval=float(os.getenv("QUEUE_NOTIFY_INTERVAL", "2")),
+    )
+    return _queue
+
+
+async def run_queued(chat: Hashable, func: Callable[[], Awaitable[T]], on_position: Optional[PositionCallback] = None) -> T:
+    """
+    Выполняет func() через общую очередь (при первом вызове она создаётся с настройками из env).
+    """
+    queue = _queue or start_generation_queue()
+    return await queue.run(chat, func, on_position)
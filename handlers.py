@@ -1,17 +1,29 @@
 # handlers.py
 from datetime import datetime
-import os
+import asyncio
 import logging
+import os
 
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram import InputMediaDocument, Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram.error import TelegramError
 from telegram.ext import (
     ConversationHandler, CommandHandler, MessageHandler, ContextTypes, filters
 )
 
-from contract_number import generate_contract_number
-from docx_generator import generate_contract_and_schedule, generate_istisna_documents
-from utils import generate_schedule, round_up_amount
-from paths import OUTPUT_DIR
+import metrics
+from batch import run_batch
+from contract_data import ItemLineError, document_jobs, istisna_items, items_total, parse_items_block
+from docx_generator import DocumentJob, GeneratedDocument
+from contract_number import (
+    NumberAllocationTimeout,
+    NumberBackendError,
+    allocate_contract_number,
+    release_contract_number,
+)
+from generation_pool import GenerationTimeout, run_generation
+from generation_queue import GenerationQueueFull, run_queued
+from pdf_pool import PdfConversionError, convert_to_pdf, pdf_enabled
+from utils import round_up_amount
 
 # Conversation states
 (
@@ -45,7 +57,18 @@ from paths import OUTPUT_DIR
     ISTISNA_ITEM_QTY,
     ISTISNA_TOTAL_CHOICE,
     ISTISNA_TOTAL_OVERRIDE,
-) = range(30)
+    ISTISNA_ITEM_MORE,
+) = range(31)
+
+# Имена состояний для метрик: {номер: "date_contract", ...}
+STATE_NAMES = {value: name.lower() for name, value in list(globals().items()) if name.isupper() and type(value) is int}
+STATE_NAMES[ConversationHandler.WAITING] = "waiting"
+
+UPDATES_BY_STATE = metrics.counter_family(
+    "conversation_updates_total", "Обновления диалога по состоянию, в котором их застали", "state"
+)
+ACTIVE_CONVERSATIONS = metrics.gauge("conversations_active", "Диалоги, в которых заполняется договор")
+DOCUMENT_UPLOAD_SECONDS = metrics.histogram("document_upload_seconds", "Отправка документа (или альбома) в Telegram")
 
 
 # /start
@@ -53,6 +76,14 @@ def contract_choice_keyboard() -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup([["Мурабаха", "Истисна"]], resize_keyboard=True, one_time_keyboard=True)
 
 
+def confirm_keyboard() -> ReplyKeyboardMarkup:
+    return ReplyKeyboardMarkup(
+        [["✅ Сгенерировать", "✏️ Исправить"], ["⛔️ Отмена"]],
+        resize_keyboard=True,
+        one_time_keyboard=True,
+    )
+
+
 async def start(update: Update, _: ContextTypes.DEFAULT_TYPE):
     logging.info("START -> CHOOSE_CONTRACT")
     kb = contract_choice_keyboard()
@@ -88,7 +119,7 @@ async def ask_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     context.user_data["data_dogovora_dt"] = dt
     context.user_data["data_dogovora"] = dt.strftime("%d.%m.%Y")
-    context.user_data["contract_number"] = generate_contract_number(dt)  # X-YY_MM_DD
+    # Номер (X-YY/MM/DD) выдаётся только при подтверждении — брошенные диалоги номера не тратят
 
     if context.user_data.get("contract_type") == "istisna":
         await update.message.reply_text("Введите ФИО покупателя:")
@@ -269,14 +300,58 @@ async def istisna_ask_phone_supplier(update: Update, context: ContextTypes.DEFAU
     return ISTISNA_PHONE_BUYER
 
 
+def items_more_keyboard() -> ReplyKeyboardMarkup:
+    return ReplyKeyboardMarkup([["Добавить товар", "Готово"]], resize_keyboard=True, one_time_keyboard=True)
+
+
+def _format_items(items, limit: int = 20) -> str:
+    # Длинный список обрезаем: сообщение Telegram ограничено 4096 символами
+    lines = [
+        f"{n}. {item['name']} — {item['price']} руб. × {item['qty']}"
+        for n, item in enumerate(items[:limit], start=1)
+    ]
+    if len(items) > limit:
+        lines.append(f"… и ещё {len(items) - limit}")
+    return "\n".join(lines)
+
+
+async def _ask_item_name(update: Update):
+    await update.message.reply_text(
+        "Введите наименование товара (цвет/размер).\n"
+        "Можно вставить список сразу: по строке на товар в формате «наименование; цена; количество».",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+    return ISTISNA_ITEM_NAME
+
+
+async def _ask_items_more(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    items = context.user_data.get("items", [])
+    await update.message.reply_text(
+        f"Товары ({len(items)}):\n{_format_items(items)}\n\nДобавить ещё товар?",
+        reply_markup=items_more_keyboard(),
+    )
+    return ISTISNA_ITEM_MORE
+
+
 async def istisna_ask_phone_buyer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["buyer_phone"] = update.message.text.strip()
-    await update.message.reply_text("Введите наименование товара (цвет/размер):")
-    return ISTISNA_ITEM_NAME
+    context.user_data["items"] = []
+    return await _ask_item_name(update)
 
 
 async def istisna_ask_item_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data["item_name"] = update.message.text.strip()
+    text = (update.message.text or "").strip()
+    # Вставленный список: хотя бы одна строка с разделителем «;» (или табом — копия из таблицы)
+    if ";" in text or "\t" in text:
+        try:
+            items = parse_items_block(text)
+        except ItemLineError as e:
+            await update.message.reply_text(f"Не удалось разобрать список: {e}. Повторите:")
+            return ISTISNA_ITEM_NAME
+        context.user_data.setdefault("items", []).extend(items)
+        return await _ask_items_more(update, context)
+
+    context.user_data["item_name"] = text
     await update.message.reply_text("Введите цену товара (рубли):")
     return ISTISNA_ITEM_PRICE
 
@@ -297,9 +372,20 @@ async def istisna_ask_item_qty(update: Update, context: ContextTypes.DEFAULT_TYP
     if not s.isdigit() or int(s) <= 0:
         await update.message.reply_text("Количество должно быть положительным целым числом.")
         return ISTISNA_ITEM_QTY
-    qty = int(s)
-    context.user_data["item_qty"] = qty
-    auto_total = context.user_data["item_price"] * qty
+    ud = context.user_data
+    ud.setdefault("items", []).append({"name": ud.pop("item_name"), "price": ud.pop("item_price"), "qty": int(s)})
+    return await _ask_items_more(update, context)
+
+
+async def istisna_ask_item_more(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    txt = (update.message.text or "").strip().lower()
+    if "добав" in txt:
+        return await _ask_item_name(update)
+    if "готов" not in txt:
+        await update.message.reply_text("Выберите кнопкой: «Добавить товар» или «Готово».")
+        return ISTISNA_ITEM_MORE
+
+    auto_total = items_total(context.user_data["items"])
     context.user_data["total_cost_auto"] = auto_total
     context.user_data["total_cost_final"] = auto_total
 
@@ -333,14 +419,24 @@ async def istisna_ask_total_override(update: Update, context: ContextTypes.DEFAU
     return await ask_confirm(update, context)
 
 
+def docs_as_album() -> bool:
+    """
+    DOCS_AS_ALBUM=1 — несколько документов договора одним альбомом (send_media_group).
+    """
+    return os.getenv("DOCS_AS_ALBUM", "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _number_preview(ud: dict) -> str:
+    return ud.get("contract_number") or "будет присвоен при формировании"
+
+
 async def ask_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ud = context.user_data
     if ud.get("contract_type") == "istisna":
-        qty = int(ud.get("item_qty", 1))
         text = (
             "Проверьте данные:\n\n"
             "Договор: Истисна\n"
-            f"Номер: {ud['contract_number']}\n"
+            f"Номер: {_number_preview(ud)}\n"
             f"Дата: {ud['data_dogovora']}\n\n"
             f"Покупатель: {ud['buyer_fio']}\n"
             f"Адрес покупателя: {ud['buyer_address']}\n"
@@ -348,9 +444,7 @@ async def ask_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"Поставщик: {ud['supplier_fio']}\n"
             f"Адрес поставщика: {ud['supplier_address']}\n"
             f"Телефон поставщика: {ud['supplier_phone']}\n\n"
-            f"Товар: {ud['item_name']}\n"
-            f"Цена за единицу: {ud['item_price']} руб.\n"
-            f"Количество: {qty}\n"
+            f"Товары:\n{_format_items(istisna_items(ud))}\n"
             f"Срок изготовления: {ud['manufacturing_days']} рабочих дней\n"
             f"Общая стоимость (авто): {ud['total_cost_auto']} руб.\n"
             f"Общая стоимость (итог): {ud['total_cost_final']} руб.\n"
@@ -364,7 +458,7 @@ async def ask_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
         text = (
             "Проверьте данные:\n\n"
             f"Договор: Мурабаха\n"
-            f"Номер: {ud['contract_number']}\n"
+            f"Номер: {_number_preview(ud)}\n"
             f"Дата: {ud['data_dogovora']}\n\n"
             f"Покупатель: {ud['fio_pokupatelya']}\n"
             f"Телефон: {ud['tel_pokupatelya']}\n\n"
@@ -377,16 +471,30 @@ async def ask_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"Залог: {ud['zalog']}\n"
         )
 
-    kb = ReplyKeyboardMarkup(
-        [["✅ Сгенерировать", "✏️ Исправить"], ["⛔️ Отмена"]],
-        resize_keyboard=True,
-        one_time_keyboard=True,
-    )
-
-    await update.message.reply_text(text, reply_markup=kb)
+    await update.message.reply_text(text, reply_markup=confirm_keyboard())
     return CONFIRM
 
 
+async def _release_number(ud: dict) -> None:
+    """
+    Договор не сформирован (отмена/исправление после сбоя генерации) — номер возвращается в выдачу.
+    Если хотя бы один документ с этим номером уже ушёл пользователю, номер не возвращается:
+    иначе его получил бы другой договор.
+    """
+    number = ud.get("contract_number")
+    if not number or ud.get("number_sent"):
+        return
+    try:
+        await asyncio.to_thread(release_contract_number, ud["data_dogovora_dt"], number, 5.0)
+    except (NumberAllocationTimeout, NumberBackendError, ValueError) as e:
+        logging.warning("Could not release contract number %s: %s", number, e)
+
+
+async def busy_generating(update: Update, _: ContextTypes.DEFAULT_TYPE):
+    # Диалог ждёт завершения неблокирующего handle_confirm (очередь/генерация)
+    await update.message.reply_text("⏳ Документы формируются, дождитесь их, пожалуйста.")
+
+
 async def handle_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     txt = (update.message.text or "").strip()
 
@@ -396,12 +504,14 @@ async def handle_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if txt.startswith("✏️"):
         contract_type = context.user_data.get("contract_type", "murabaha")
+        await _release_number(context.user_data)
         context.user_data.clear()
         context.user_data["contract_type"] = contract_type
         await update.message.reply_text("Начнём заново. Введите дату договора (ДД.ММ.ГГГГ):", reply_markup=ReplyKeyboardRemove())
         return DATE_CONTRACT
 
     if txt.startswith("⛔"):
+        await _release_number(context.user_data)
         context.user_data.clear()
         kb = contract_choice_keyboard()
         await update.message.reply_text("Отменено. Выберите договор:", reply_markup=kb)
@@ -412,93 +522,121 @@ async def handle_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def confirm_and_generate(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ud = context.user_data
-    contract_type = ud.get("contract_type", "murabaha")
-
-    if contract_type == "istisna":
-        repl = {
-            "{{nomer_dogovora}}": ud["contract_number"],
-            "{{data_dogovora}}": ud["data_dogovora"],
-            "{{buyer_fio}}": ud["buyer_fio"],
-            "{{buyer_address}}": ud["buyer_address"],
-            "{{buyer_passport_series_number}}": ud["buyer_passport_series_number"],
-            "{{buyer_passport_issued_by}}": ud["buyer_passport_issued_by"],
-            "{{supplier_fio}}": ud["supplier_fio"],
-            "{{supplier_address}}": ud["supplier_address"],
-            "{{manufacturing_days}}": ud["manufacturing_days"],
-            "{{supplier_phone}}": ud["supplier_phone"],
-            "{{buyer_phone}}": ud["buyer_phone"],
-            "{{item_name}}": ud["item_name"],
-            "{{item_price}}": ud["item_price"],
-            "{{item_qty}}": ud["item_qty"],
-            "{{total_cost_final}}": ud["total_cost_final"],
-        }
-        repl["contract_number"] = ud["contract_number"]
-
-        OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-        generated_docs = generate_istisna_documents(data=repl, out_dir=OUTPUT_DIR)
-    else:
-        qty = int(ud.get("kolichestvo_tov", 1))
-        total_sebestoim = ud["sebestoimost_tovara"] * qty
-        total_nacenka = ud["nacenka_tov"] * qty
-        polnaya_stoimost = total_sebestoim + total_nacenka
-        ostatok_dolga = max(0, polnaya_stoimost - ud["pervi_vznos"])
-
-        schedule = generate_schedule(
-            start_date=ud["data_dogovora_dt"],
-            term=ud["srok_dogov"],
-            payday=ud["data_opl"],
-            cost=polnaya_stoimost,
-            advance=ud["pervi_vznos"],
+    # Формирование идёт через общую очередь: ограниченное число одновременно, чаты по кругу
+    status = None
+
+    async def show_position(position: int):
+        nonlocal status
+        text = f"⏳ Вы {position}-й в очереди на формирование документов."
+        if status is None:
+            status = await update.message.reply_text(text)
+        else:
+            await status.edit_text(text)
+
+    async def job():
+        if status is not None:
+            try:
+                await status.edit_text("Очередь подошла, формирую документы...")
+            except TelegramError:
+                pass
+        return await generate_and_send(update, context)
+
+    try:
+        return await run_queued(update.effective_chat.id, job, show_position)
+    except GenerationQueueFull:
+        logging.warning("Generation queue is full, request rejected")
+        await update.message.reply_text(
+            "Сейчас формируется слишком много документов. Попробуйте через минуту.",
+            reply_markup=confirm_keyboard(),
         )
-        ejemes = schedule[0]["amount"] if schedule else 0
-
-        repl = {
-            "{{nomer_dogovora}}": ud["contract_number"],
-            "{{data_dogovora}}": ud["data_dogovora"],
-            "{{fio_prodavca}}": ud["fio_prodavca"],
-            "{{fio_pokupatelya}}": ud["fio_pokupatelya"],
-            "{{tel_pokupatelya}}": ud["tel_pokupatelya"],
-            "{{fio_poruchitelya1}}": ud["fio_poruchitelya1"],
-            "{{tel_poruchit1}}": ud["tel_poruchit1"],
-            "{{pokupaemy_tov}}": ud["pokupaemy_tov"],
-            "{{kolichestvo_tov}}": ud["kolichestvo_tov"],
-            "{{polnaya_stoimost_tov}}": polnaya_stoimost,
-            "{{sebestoimost_tovara}}": total_sebestoim,
-            "{{nacenka_tov}}": total_nacenka,
-            "{{pervi_vznos}}": ud["pervi_vznos"],
-            "{{srok_dogov}}": ud["srok_dogov"],
-            "{{ejemes_oplata}}": ejemes,
-            "{{data_opl}}": ud["data_opl"],
-            "{{zalog}}": ud["zalog"],
-            "{{ostatok_dolga}}": ostatok_dolga,
-        }
-
-        for i in range(1, 13):
-            if i <= len(schedule):
-                row = schedule[i - 1]
-                repl[f"{{{{data_plateja{i}}}}}"] = row["date"]
-                repl[f"{{{{summa_plateja{i}}}}}"] = row["amount"]
-                repl[f"{{{{ostatok_posle_plateja{i}}}}}"] = row["balance"]
-            else:
-                repl[f"{{{{data_plateja{i}}}}}"] = ""
-                repl[f"{{{{summa_plateja{i}}}}}"] = ""
-                repl[f"{{{{ostatok_posle_plateja{i}}}}}"] = ""
-
-        repl["contract_number"] = ud["contract_number"]
-        OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-        generated_docs = generate_contract_and_schedule(data=repl, out_dir=OUTPUT_DIR)
+        return CONFIRM
 
+
+async def _cancel_documents(tasks) -> None:
+    """
+    Снимает незавершённые рендеры и отправки документов, затем — PDF,
+    уже поставленные в очередь пула завершёнными задачами.
+    """
+    for task in tasks:
+        task.cancel()
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(result, tuple) and result[1] is not None:
+            result[1].cancel()
+
+
+async def generate_and_send(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ud = context.user_data
+    # Номер резервируется здесь; при повторе после таймаута генерации используется тот же
+    if not ud.get("contract_number"):
+        try:
+            ud["contract_number"] = await allocate_contract_number(ud["data_dogovora_dt"])
+        except (NumberAllocationTimeout, NumberBackendError) as e:
+            logging.warning("Contract number allocation failed: %s", e)
+            await update.message.reply_text(
+                "Не удалось получить номер договора. Попробуйте ещё раз.",
+                reply_markup=confirm_keyboard(),
+            )
+            return CONFIRM
+    jobs = document_jobs(ud)
+    send_album = len(jobs) > 1 and docs_as_album()
+
+    async def render(job: DocumentJob):
+        # Генерация блокирующая (python-docx/lxml) — уводим её с event loop в пул
+        doc = GeneratedDocument(job.filename, await run_generation(job.render, *job.args))
+        # PDF делает пул прогретых конвертеров; ставим в очередь сразу, пока отправляются DOCX
+        return doc, (convert_to_pdf(doc.content) if pdf_enabled() else None)
+
+    async def render_and_send(job: DocumentJob):
+        doc, pdf_future = await render(job)
+        # Готовый документ уходит сразу, не дожидаясь остальных
+        try:
+            with DOCUMENT_UPLOAD_SECONDS.time():
+                await update.message.reply_document(doc.content, filename=doc.filename)
+        except BaseException:
+            # DOCX не ушёл (ошибка или отмена) — его PDF не нужен
+            if pdf_future is not None:
+                pdf_future.cancel()
+            raise
+        ud["number_sent"] = True
+        return doc, pdf_future
+
+    # Документы договора рендерятся параллельно; время ожидания — самый долгий документ, а не сумма
+    tasks = [asyncio.ensure_future(render(job) if send_album else render_and_send(job)) for job in jobs]
     try:
-        for path in generated_docs:
-            with open(path, "rb") as f:
-                await update.message.reply_document(f, filename=path.name)
-    finally:
-        for p in generated_docs:
-            try:
-                os.remove(p)
-            except Exception:
-                pass
+        rendered = await asyncio.gather(*tasks)
+        # Документы целиком в памяти: на диск ничего не пишется
+        if send_album:
+            with DOCUMENT_UPLOAD_SECONDS.time():
+                await update.message.reply_media_group(
+                    [InputMediaDocument(doc.content, filename=doc.filename) for doc, _ in rendered]
+                )
+            ud["number_sent"] = True
+    except Exception as e:
+        await _cancel_documents(tasks)
+        if isinstance(e, GenerationTimeout):
+            logging.warning("Generation timed out for %s: %s", ud.get("contract_number"), e)
+            # Брошенная генерация ещё занимает воркер — сразу повторять не предлагаем
+            reason = "Не удалось сформировать документы вовремя. Попробуйте через пару минут."
+        else:
+            logging.exception("Generation failed for %s", ud.get("contract_number"))
+            reason = "Не удалось сформировать документы. Попробуйте ещё раз."
+        if ud.get("number_sent"):
+            # Часть документов уже у пользователя: повтор пришлёт комплект заново под тем же номером
+            reason = f"Отправлены не все документы договора {ud['contract_number']}. " + reason
+        await update.message.reply_text(reason, reply_markup=confirm_keyboard())
+        return CONFIRM
+
+    for doc, future in rendered:
+        if future is None:
+            continue
+        try:
+            pdf = await asyncio.wrap_future(future)
+        except PdfConversionError:
+            logging.exception("PDF conversion failed for %s", doc.filename)
+            await update.message.reply_text(f"Не удалось сделать PDF для {doc.filename}, отправлен только DOCX.")
+            continue
+        with DOCUMENT_UPLOAD_SECONDS.time():
+            await update.message.reply_document(pdf, filename=doc.filename.rsplit(".", 1)[0] + ".pdf")
 
     try:
         context.user_data.clear()
@@ -509,7 +647,28 @@ async def confirm_and_generate(update: Update, context: ContextTypes.DEFAULT_TYP
     return CHOOSE_CONTRACT
 
 
-conv_handler = ConversationHandler(
+class MeteredConversationHandler(ConversationHandler):
+    """
+    ConversationHandler, который считает обновления по текущему состоянию диалога
+    и отдаёт число диалогов с договором в работе в метрику conversations_active.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Считается при чтении метрик: словарь диалогов заменяется при загрузке из persistence
+        ACTIVE_CONVERSATIONS.set_function(self.active_count)
+
+    def active_count(self) -> int:
+        # Диалог не завершается: после договора пользователь ждёт в выборе договора
+        return sum(1 for state in list(self._conversations.values()) if state != CHOOSE_CONTRACT)
+
+    async def handle_update(self, update, application, check_result, context):
+        # check_result[0] — состояние до обработки (None — диалога ещё нет)
+        UPDATES_BY_STATE.labels(STATE_NAMES.get(check_result[0], "start")).inc()
+        return await super().handle_update(update, application, check_result, context)
+
+
+conv_handler = MeteredConversationHandler(
     entry_points=[CommandHandler("start", start)],
     states={
         CHOOSE_CONTRACT: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_contract)],
@@ -527,7 +686,10 @@ conv_handler = ConversationHandler(
         TERM_MONTHS: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_term_months)],
         PAYDAY: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_payday)],
         PLEDGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_pledge)],
-        CONFIRM: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_confirm)],
+        # block=False: ожидание в очереди генерации не держит блокировку чата и слот UPDATE_WORKERS,
+        # остальные чаты обрабатываются дальше; сообщения этого чата до конца — в WAITING
+        CONFIRM: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_confirm, block=False)],
+        ConversationHandler.WAITING: [MessageHandler(filters.TEXT, busy_generating)],
         ISTISNA_FIO_BUYER: [MessageHandler(filters.TEXT & ~filters.COMMAND, istisna_ask_fio_buyer)],
         ISTISNA_ADDRESS_BUYER: [MessageHandler(filters.TEXT & ~filters.COMMAND, istisna_ask_address_buyer)],
         ISTISNA_PASSPORT_SN_BUYER: [MessageHandler(filters.TEXT & ~filters.COMMAND, istisna_ask_passport_sn)],
@@ -542,6 +704,67 @@ conv_handler = ConversationHandler(
         ISTISNA_ITEM_QTY: [MessageHandler(filters.TEXT & ~filters.COMMAND, istisna_ask_item_qty)],
         ISTISNA_TOTAL_CHOICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, istisna_ask_total_choice)],
         ISTISNA_TOTAL_OVERRIDE: [MessageHandler(filters.TEXT & ~filters.COMMAND, istisna_ask_total_override)],
+        ISTISNA_ITEM_MORE: [MessageHandler(filters.TEXT & ~filters.COMMAND, istisna_ask_item_more)],
     },
     fallbacks=[CommandHandler("start", start)],
-)
\ No newline at end of file
+    # Состояния диалогов переживают перезапуск (SqlitePersistence в bot.py)
+    name="contract",
+    persistent=True,
+)
+
+
+def _batch_allowed(update: Update) -> bool:
+    """
+    BATCH_ADMIN_IDS — список Telegram user id через запятую; если пусто, пакеты недоступны никому
+    (пакет расходует номера дня и пул процессов — открывать его всем нельзя).
+    """
+    allowed = {x.strip() for x in os.getenv("BATCH_ADMIN_IDS", "").split(",") if x.strip()}
+    return str(update.effective_user.id) in allowed
+
+
+async def batch_help(update: Update, _: ContextTypes.DEFAULT_TYPE):
+    if not _batch_allowed(update):
+        await update.message.reply_text("Пакетная генерация недоступна.")
+        return
+    await update.message.reply_text(
+        "Пакетная генерация: пришлите файл CSV или JSONL с подписью /batch.\n"
+        "Поля строки — как в диалоге (contract_type, data_dogovora, ...).\n"
+        "В ответ придёт один zip с документами и report.csv по каждой строке."
+    )
+
+
+async def batch_upload(update: Update, _: ContextTypes.DEFAULT_TYPE):
+    if not _batch_allowed(update):
+        await update.message.reply_text("Пакетная генерация недоступна.")
+        return
+    document = update.message.document
+    await update.message.reply_text("Принял пакет, формирую документы...")
+    tg_file = await document.get_file()
+    data = bytes(await tg_file.download_as_bytearray())
+
+    workers = int(os.getenv("BATCH_WORKERS", "0")) or None
+    # Пакет рендерится в своём пуле процессов; сам вызов блокирующий — уводим из event loop
+    try:
+        archive, results = await asyncio.to_thread(run_batch, data, document.file_name or "", workers)
+    except UnicodeDecodeError:
+        logging.warning("Batch file %r is not UTF-8", document.file_name)
+        await update.message.reply_text("Не удалось прочитать пакет: файл должен быть в кодировке UTF-8.")
+        return
+    except Exception as e:
+        logging.exception("Batch %r failed", document.file_name)
+        await update.message.reply_text(f"Пакет не сформирован: {e or type(e).__name__}")
+        return
+
+    ok = sum(1 for r in results if r.status == "ok")
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    await update.message.reply_document(
+        archive,
+        filename=f"batch_{stamp}.zip",
+        caption=f"Готово: {ok} из {len(results)}. Ошибки — в report.csv.",
+    )
+
+
+batch_handlers = [
+    CommandHandler("batch", batch_help),
+    MessageHandler(filters.Document.ALL & filters.CaptionRegex(r"^/batch\b"), batch_upload),
+]
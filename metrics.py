@@ -0,0 +1,232 @@
+# metrics.py
+"""
+Метрики процесса в памяти: счётчики, текущие значения и гистограммы.
+
+Метрика создаётся один раз на уровне модуля (counter()/gauge()/histogram(),
+с меткой — counter_family()/histogram_family()) и обновляется из любого потока.
+snapshot() — все значения одним dict (для проверок вроде rate_limit_sim.py),
+exposition() — они же в текстовом формате Prometheus (GET /metrics служебного сервера).
+"""
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Union
+
+# Границы гистограмм по умолчанию (сек): от миллисекунд до минуты
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name, self.help = name, help
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def snapshot(self) -> float:
+        return self._value
+
+
+class Gauge(Counter):
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._function: Optional[Callable[[], float]] = None
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """
+        Значение считается при чтении: function() вызывается на каждый snapshot/exposition.
+        """
+        self._function = function
+
+    @property
+    def value(self) -> float:
+        return self._value if self._function is None else float(self._function())
+
+    def snapshot(self) -> float:
+        return self.value
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = value
+
+
+class Histogram:
+    """
+    Накопительная гистограмма: число наблюдений ≤ каждой границы, сумма и количество.
+    """
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name, self.help = name, help
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # последняя — +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """
+        with histogram.time(): ... — наблюдение длительности блока в секундах.
+        """
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - started)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        cumulative: List[int] = []
+        running = 0
+        for c in counts:
+            running += c
+            cumulative.append(running)
+        return {
+            "count": count,
+            "sum": total,
+            "buckets": dict(zip([*map(str, self.buckets), "+Inf"], cumulative)),
+        }
+
+
+class Family:
+    """
+    Метрика с одной меткой: своё значение на каждое значение метки — labels("save").
+    Дочерние метрики создаются при первом обращении; их лучше получить заранее, на уровне модуля.
+    """
+
+    def __init__(self, name: str, help: str, label: str, kind: str, factory: Callable[[], Union[Counter, Histogram]]):
+        self.name, self.help, self.label, self.kind = name, help, label, kind
+        self._factory = factory
+        self._children: Dict[str, Union[Counter, Histogram]] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, value: str) -> Union[Counter, Histogram]:
+        child = self._children.get(value)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(value, self._factory())
+        return child
+
+    def children(self) -> Dict[str, Union[Counter, Histogram]]:
+        with self._lock:
+            return dict(self._children)
+
+    def snapshot(self) -> dict:
+        return {value: child.snapshot() for value, child in self.children().items()}
+
+
+Metric = Union[Counter, Gauge, Histogram, Family]
+_registry: Dict[str, Metric] = {}
+_registry_lock = threading.Lock()
+
+
+def _register(metric: Metric) -> Metric:
+    with _registry_lock:
+        existing = _registry.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric):
+                raise ValueError(f"metric {metric.name!r} already registered as {type(existing).__name__}")
+            return existing
+        _registry[metric.name] = metric
+        return metric
+
+
+def counter(name: str, help: str) -> Counter:
+    return _register(Counter(name, help))
+
+
+def gauge(name: str, help: str) -> Gauge:
+    return _register(Gauge(name, help))
+
+
+def histogram(name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, help, buckets))
+
+
+def counter_family(name: str, help: str, label: str) -> Family:
+    return _register(Family(name, help, label, "counter", lambda: Counter(name, help)))
+
+
+def histogram_family(name: str, help: str, label: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Family:
+    return _register(Family(name, help, label, "histogram", lambda: Histogram(name, help, buckets)))
+
+
+def snapshot() -> dict:
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {m.name: m.snapshot() for m in metrics}
+
+
+# Текстовый формат Prometheus 0.0.4
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs: Sequence[tuple]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_label_value(str(v))}"' for k, v in pairs) + "}"
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _samples(name: str, metric: Union[Counter, Histogram], pairs: Sequence[tuple]) -> Iterator[str]:
+    if isinstance(metric, Histogram):
+        data = metric.snapshot()
+        for le, count in data["buckets"].items():
+            yield f"{name}_bucket{_labels([*pairs, ('le', le)])} {count}"
+        yield f"{name}_sum{_labels(pairs)} {_number(data['sum'])}"
+        yield f"{name}_count{_labels(pairs)} {data['count']}"
+    else:
+        yield f"{name}{_labels(pairs)} {_number(metric.value)}"
+
+
+def _kind(metric: Metric) -> str:
+    if isinstance(metric, Family):
+        return metric.kind
+    if isinstance(metric, Histogram):
+        return "histogram"
+    return "gauge" if isinstance(metric, Gauge) else "counter"
+
+
+def exposition() -> str:
+    """
+    Все метрики в текстовом формате Prometheus.
+    """
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda m: m.name)
+    lines: List[str] = []
+    for m in metrics:
+        help_text = m.help.replace("\\", "\\\\").replace("\n", "\\n")
+        lines.append(f"# HELP {m.name} {help_text}")
+        lines.append(f"# TYPE {m.name} {_kind(m)}")
+        if isinstance(m, Family):
+            for value, child in sorted(m.children().items()):
+                lines.extend(_samples(m.name, child, [(m.label, value)]))
+        else:
+            lines.extend(_samples(m.name, m, []))
+    return "\n".join(lines) + "\n"
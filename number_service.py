@@ -0,0 +1,195 @@
+# number_service.py
+"""
+Сервис номеров договоров для нескольких реплик бота.
+
+    python number_service.py --listen tcp://0.0.0.0:7379
+    python number_service.py --listen unix:///run/dogovorshik/numbers.sock
+
+Реплики подключаются через NUMBER_BACKEND=tcp://host:7379 (или unix:///...).
+Протокол — подмножество Redis (RESP2), поэтому сервис заменяется настоящим Redis
+(NUMBER_BACKEND=redis://host:6379) без изменений в боте.
+
+Команды: PING, INCR/INCRBY <p>:counter:<day> [n], GET <p>:counter:<day>,
+LPOP <p>:released:<day> [n], RPUSH <p>:released:<day> <номер>..., QUIT.
+Данные — в SQLite (та же схема, что у NUMBER_BACKEND=sqlite), поэтому переход
+с одной реплики на сервис продолжает нумерацию из data/counters.sqlite3.
+Префикс ключа не хранится: день — часть ключа после :counter: / :released:.
+"""
+import argparse
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+from urllib.parse import urlparse
+
+from contract_number import SqliteBackend
+from paths import COUNTER_DB
+
+DEFAULT_LISTEN = "tcp://127.0.0.1:7379"
+
+# Ограничение на длину запроса: команды короткие, всё длиннее — мусор
+MAX_ARGS = 10000
+MAX_BULK = 1 << 16
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+async def _read_command(reader: asyncio.StreamReader) -> Optional[List[str]]:
+    """
+    Одна команда: массив bulk-строк RESP или inline-строка (для nc / redis-cli).
+    None — клиент закрыл соединение.
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        return line.decode().split()
+    count = int(line[1:].strip())
+    if not 0 <= count <= MAX_ARGS:
+        raise ProtocolError("invalid multibulk length")
+    args = []
+    for _ in range(count):
+        header = await reader.readline()
+        if not header.startswith(b"$"):
+            raise ProtocolError("expected '$'")
+        size = int(header[1:].strip())
+        if not 0 <= size <= MAX_BULK:
+            raise ProtocolError("invalid bulk length")
+        data = await reader.readexactly(size + 2)
+        args.append(data[:-2].decode())
+    return args
+
+
+def _encode(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, bool):
+        return b"+OK\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(_encode(str(v)) for v in value)
+    data = str(value).encode()
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+def _day(key: str, kind: str) -> str:
+    marker = f":{kind}:"
+    if marker not in key:
+        raise ProtocolError(f"key must look like <prefix>{marker}<day>")
+    return key.rsplit(marker, 1)[1]
+
+
+class NumberService:
+    """
+    Выполняет команды над SqliteBackend. Все операции идут в одном потоке:
+    у SqliteBackend соединение на поток, а транзакции короткие.
+    """
+
+    def __init__(self, db_path: Path):
+        self.backend = SqliteBackend(db_path)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="numbers")
+
+    def execute(self, args: List[str]):
+        name = args[0].upper()
+        if name == "PING":
+            return "PONG" if len(args) == 1 else args[1]
+        if name == "INCR" and len(args) == 2:
+            return self.backend.incr(_day(args[1], "counter"), 1)
+        if name == "INCRBY" and len(args) == 3:
+            count = int(args[2])
+            if count < 1:
+                raise ProtocolError("increment must be positive")
+            return self.backend.incr(_day(args[1], "counter"), count)
+        if name == "GET" and len(args) == 2:
+            return str(self.backend.counter(_day(args[1], "counter")))
+        if name == "LPOP" and len(args) in (2, 3):
+            day = _day(args[1], "released")
+            count = int(args[2]) if len(args) == 3 else 1
+            numbers = self.backend.pop_released(day, count) if count > 0 else []
+            if len(args) == 2:
+                return numbers[0] if numbers else None
+            return numbers or None
+        if name == "RPUSH" and len(args) >= 3:
+            day = _day(args[1], "released")
+            self.backend.push_released(day, [int(n) for n in args[2:]])
+            return self.backend.released_count(day)
+        raise ProtocolError(f"unknown command or wrong number of arguments for '{args[0]}'")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    args = await _read_command(reader)
+                except (ProtocolError, ValueError, asyncio.IncompleteReadError) as e:
+                    writer.write(f"-ERR protocol error: {e}\r\n".encode())
+                    break
+                if args is None:
+                    break
+                if not args:
+                    continue
+                if args[0].upper() == "QUIT":
+                    writer.write(_encode(True))
+                    break
+                try:
+                    reply = _encode(await loop.run_in_executor(self._executor, self.execute, args))
+                except (ProtocolError, ValueError) as e:
+                    reply = f"-ERR {e}\r\n".encode()
+                except TimeoutError as e:
+                    reply = f"-BUSY {e}\r\n".encode()
+                writer.write(reply)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+
+    def close(self) -> None:
+        self._executor.submit(self.backend.close).result()
+        self._executor.shutdown()
+
+
+async def serve(listen: str, db_path: Path) -> None:
+    service = NumberService(db_path)
+    parsed = urlparse(listen)
+    if parsed.scheme == "unix":
+        if os.path.exists(parsed.path):
+            os.unlink(parsed.path)
+        server = await asyncio.start_unix_server(service.handle, path=parsed.path)
+    elif parsed.scheme == "tcp":
+        server = await asyncio.start_server(service.handle, parsed.hostname or "127.0.0.1", parsed.port or 7379)
+    else:
+        raise SystemExit(f"Unsupported --listen {listen!r}: use tcp://host:port or unix:///path")
+    logging.info("Number service on %s, db %s", listen, db_path)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Сервис номеров договоров для нескольких реплик.")
+    parser.add_argument("--listen", default=os.getenv("NUMBER_SERVICE_LISTEN", DEFAULT_LISTEN),
+                        help="tcp://host:port или unix:///path")
+    parser.add_argument("--db", default=str(COUNTER_DB), help="файл SQLite со счётчиками")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+    try:
+        asyncio.run(serve(args.listen, Path(args.db)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
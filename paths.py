@@ -6,7 +6,9 @@ TEMPLATES_DIR = PROJECT_ROOT / "templates"
 OUTPUT_DIR = PROJECT_ROOT / "output" / "ready_contracts"
 DATA_DIR = PROJECT_ROOT / "data"
 
-COUNTER_FILE = DATA_DIR / "counter.json"
+COUNTER_FILE = DATA_DIR / "counter.json"  # старый формат, переносится в COUNTER_DB
+COUNTER_DB = DATA_DIR / "counters.sqlite3"
+STATE_DB = DATA_DIR / "state.sqlite3"  # незавершённые диалоги (user_data + состояния)
 
 TEMPLATE_CONTRACT = TEMPLATES_DIR / "murabaha_template.docx"
 TEMPLATE_SCHEDULE = TEMPLATES_DIR / "murabaha_schedule.docx"
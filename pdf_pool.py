@@ -0,0 +1,315 @@
+# pdf_pool.py
+"""
+Пул прогретых конвертеров DOCX → PDF.
+
+Каждый воркер — долгоживущий процесс-конвертер (по умолчанию soffice_worker.py:
+один запущенный LibreOffice), задачи идут ему через stdin/stdout JSON-строками.
+Процесс не запускается заново на каждый файл; зависший (таймаут) или упавший
+конвертер убивается вместе с дочерними процессами и перезапускается к следующей задаче.
+Готовые PDF кэшируются по sha256 содержимого DOCX.
+
+Конвертер — любая программа с тем же протоколом (см. soffice_worker.py),
+поэтому пул проверяется и без LibreOffice, на фейковом конвертере.
+"""
+import hashlib
+import json
+import logging
+import os
+import queue
+import shlex
+import signal
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from paths import PROJECT_ROOT
+
+
+class PdfConversionError(RuntimeError):
+    """
+    Конвертер не смог сделать PDF.
+    """
+
+
+class PdfConversionTimeout(PdfConversionError, TimeoutError):
+    """
+    Конвертер не уложился в таймаут (и был перезапущен).
+    """
+
+
+def default_converter_command() -> List[str]:
+    """
+    PDF_CONVERTER из env (командная строка) или soffice_worker.py под python3 с uno.
+    """
+    cmd = os.getenv("PDF_CONVERTER")
+    if cmd:
+        return shlex.split(cmd)
+    return ["python3", str(PROJECT_ROOT / "soffice_worker.py")]
+
+
+class _Converter:
+    """
+    Один процесс-конвертер. Ответы читает отдельный поток в очередь,
+    чтобы ожидание ответа можно было ограничить таймаутом.
+    """
+
+    def __init__(self, command: List[str], start_timeout: float):
+        try:
+            self._proc = subprocess.Popen(
+                command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+                bufsize=1,
+                # Своя группа процессов: при убийстве гасим и дочерний soffice
+                start_new_session=True,
+            )
+        except OSError as e:
+            raise PdfConversionError(f"cannot start converter {command[0]!r}: {e}") from None
+        self._lines: "queue.Queue[Optional[str]]" = queue.Queue()
+        threading.Thread(target=self._read, name=f"pdf-read-{self._proc.pid}", daemon=True).start()
+        try:
+            reply = self._reply(start_timeout)
+        except PdfConversionError:
+            self.kill()
+            raise
+        if not reply.get("ready"):
+            self.kill()
+            raise PdfConversionError(f"converter did not report ready: {reply!r}")
+
+    def _read(self) -> None:
+        for line in self._proc.stdout:
+            self._lines.put(line)
+        self._lines.put(None)
+
+    def _reply(self, timeout: float) -> dict:
+        try:
+            line = self._lines.get(timeout=timeout)
+        except queue.Empty:
+            raise PdfConversionTimeout(f"converter did not answer in {timeout}s") from None
+        if line is None:
+            raise PdfConversionError(f"converter exited with code {self._proc.wait()}")
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError:
+            raise PdfConversionError(f"bad converter reply: {line.strip()[:200]!r}") from None
+
+    @property
+    def alive(self) -> bool:
+        return self._proc.poll() is None
+
+    def convert(self, src: Path, dst: Path, timeout: float) -> None:
+        try:
+            self._proc.stdin.write(json.dumps({"src": str(src), "dst": str(dst)}) + "\n")
+            self._proc.stdin.flush()
+        except (BrokenPipeError, OSError):
+            raise PdfConversionError("converter is not running") from None
+        reply = self._reply(timeout)
+        if not reply.get("ok"):
+            raise PdfConversionError(reply.get("error") or "conversion failed")
+
+    def kill(self) -> None:
+        try:
+            os.killpg(self._proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        self._proc.wait()
+
+    def close(self, timeout: float = 10.0) -> None:
+        # EOF на stdin — штатное завершение; не успел — добиваем
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self._proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.kill()
+
+
+class PdfConverterPool:
+    """
+    Пул прогретых конвертеров.
+    - command: командная строка конвертера (список аргументов)
+    - workers: сколько конвертеров работает параллельно
+    - timeout: сколько секунд ждать один PDF; после этого конвертер перезапускается
+    - start_timeout: сколько ждать старта конвертера
+    - cache_size: сколько PDF держать в кэше (по sha256 DOCX)
+    - queue_size: длина очереди задач; submit() ждёт места не дольше timeout
+    """
+
+    def __init__(
+        self,
+        command: Optional[List[str]] = None,
+        workers: int = 2,
+        timeout: float = 60.0,
+        start_timeout: float = 60.0,
+        cache_size: int = 256,
+        queue_size: int = 100,
+    ):
+        self.command = list(command or default_converter_command())
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.cache_size = cache_size
+        self._jobs: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._threads: List[threading.Thread] = []
+        self._converters: Dict[int, _Converter] = {}
+        self._cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        for n in range(self.workers):
+            t = threading.Thread(target=self._run, args=(n,), name=f"pdf-{n}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        logging.info("PDF pool started: %s x%d, timeout %.0fs", self.command[-1], self.workers, self.timeout)
+
+    def submit(self, docx: bytes) -> "Future[bytes]":
+        """
+        Ставит DOCX в очередь и возвращает Future с байтами PDF.
+        Одинаковые DOCX (по sha256) конвертируются один раз: из кэша или общей задачей.
+        Не блокирует (вызывается из event loop): очередь полна — Future сразу с PdfConversionError.
+        """
+        self.start()
+        key = hashlib.sha256(docx).hexdigest()
+        with self._lock:
+            pdf = self._cache.get(key)
+            if pdf is not None:
+                self._cache.move_to_end(key)
+                future = Future()
+                future.set_result(pdf)
+                return future
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            future = self._pending[key] = Future()
+        future.add_done_callback(lambda f, k=key: self._done(k, f))
+        try:
+            self._jobs.put_nowait((key, docx, future))
+        except queue.Full:
+            future.set_exception(PdfConversionError(f"PDF queue is full ({self._jobs.maxsize} jobs)"))
+        return future
+
+    def convert(self, docx: bytes) -> bytes:
+        """
+        Блокирующая конвертация (с ожиданием в очереди).
+        """
+        return self.submit(docx).result()
+
+    def _done(self, key: str, future: Future) -> None:
+        with self._lock:
+            self._pending.pop(key, None)
+            if future.cancelled() or future.exception() is not None:
+                return
+            self._cache[key] = future.result()
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _run(self, n: int) -> None:
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            key, docx, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._convert(n, docx))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _convert(self, n: int, docx: bytes) -> bytes:
+        converter = self._converters.get(n)
+        if converter is None or not converter.alive:
+            if converter is not None:
+                logging.warning("PDF converter %d exited, restarting", n)
+            converter = self._converters[n] = _Converter(self.command, self.start_timeout)
+
+        with tempfile.TemporaryDirectory(prefix="dogovorshik-pdf-") as tmp:
+            src, dst = Path(tmp) / "document.docx", Path(tmp) / "document.pdf"
+            src.write_bytes(docx)
+            try:
+                converter.convert(src, dst, self.timeout)
+            except PdfConversionTimeout:
+                logging.warning("PDF converter %d timed out after %.0fs, restarting", n, self.timeout)
+                self._converters.pop(n, None)
+                converter.kill()
+                raise
+            except PdfConversionError:
+                if not converter.alive:
+                    self._converters.pop(n, None)
+                raise
+            if not dst.exists():
+                raise PdfConversionError("converter reported success but wrote no PDF")
+            return dst.read_bytes()
+
+    def shutdown(self) -> None:
+        if not self._threads:
+            return
+        # Снимаем ожидающие задачи, затем будим потоки
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                job[2].cancel()
+        for _ in self._threads:
+            self._jobs.put(None)
+        for t in self._threads:
+            t.join(timeout=self.timeout)
+        self._threads = []
+        for converter in self._converters.values():
+            converter.close()
+        self._converters.clear()
+
+
+_pool: Optional[PdfConverterPool] = None
+
+
+def pdf_enabled() -> bool:
+    """
+    PDF_OUTPUT=1 — вместе с DOCX отправлять PDF.
+    """
+    return os.getenv("PDF_OUTPUT", "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def start_pdf_pool(workers: Optional[int] = None, timeout: Optional[float] = None) -> PdfConverterPool:
+    """
+    Создаёт и запускает общий пул. Без аргументов берёт настройки из env:
+    PDF_CONVERTER, PDF_WORKERS, PDF_TIMEOUT (сек), PDF_CACHE_SIZE.
+    """
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+    _pool = PdfConverterPool(
+        workers=workers if workers is not None else int(os.getenv("PDF_WORKERS", "2")),
+        timeout=timeout if timeout is not None else float(os.getenv("PDF_TIMEOUT", "60")),
+        cache_size=int(os.getenv("PDF_CACHE_SIZE", "256")),
+    )
+    _pool.start()
+    return _pool
+
+
+def shutdown_pdf_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def convert_to_pdf(docx: bytes) -> "Future[bytes]":
+    """
+    Конвертирует DOCX в общем пуле (при первом вызове пул создаётся с настройками из env).
+    """
+    pool = _pool or start_pdf_pool()
+    return pool.submit(docx)
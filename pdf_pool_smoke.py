@@ -0,0 +1,110 @@
+# pdf_pool_smoke.py
+"""
+Проверка пула PDF-конвертеров без LibreOffice.
+
+    python pdf_pool_smoke.py
+
+Пул запускается с fake_pdf_converter.py вместо soffice_worker.py и проверяет:
+параллельные задачи, кэш и общую задачу для одинаковых DOCX, ответ-ошибку
+(конвертер остаётся), таймаут и падение (конвертер перезапускается), полную очередь.
+Ошибка — код выхода 1.
+"""
+import sys
+import time
+from concurrent.futures import wait
+from typing import List, Optional
+
+from paths import PROJECT_ROOT
+from pdf_pool import PdfConversionError, PdfConversionTimeout, PdfConverterPool
+
+FAKE_CONVERTER = [sys.executable, str(PROJECT_ROOT / "fake_pdf_converter.py")]
+
+
+def _pid(pdf: bytes) -> int:
+    return int(pdf.split(b"\n", 1)[0].rsplit(b"=", 1)[1])
+
+
+def _error(pool: PdfConverterPool, docx: bytes) -> Optional[PdfConversionError]:
+    try:
+        pool.convert(docx)
+    except PdfConversionError as e:
+        return e
+    return None
+
+
+def run_smoke() -> List[str]:
+    failures = []
+
+    def check(name: str, ok: bool) -> None:
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        if not ok:
+            failures.append(name)
+
+    pool = PdfConverterPool(FAKE_CONVERTER, workers=2, timeout=1.0, start_timeout=10.0)
+    try:
+        pool.start()
+        # Прогрев: оба конвертера запущены (одинаковый sleep — задачи достанутся разным)
+        warm = [pool.submit(b"sleep:0.3 warm-1"), pool.submit(b"sleep:0.3 warm-2")]
+        warm_pids = {_pid(f.result()) for f in warm}
+
+        started = time.perf_counter()
+        futures = [pool.submit(b"sleep:0.5 a"), pool.submit(b"sleep:0.5 b")]
+        wait(futures)
+        elapsed = time.perf_counter() - started
+        check(f"two jobs run in parallel ({elapsed:.2f}s)", elapsed < 0.9 and all(not f.exception() for f in futures))
+
+        pdf = pool.convert(b"docx-1")
+        check("pdf produced", pdf.startswith(b"%PDF-fake") and pdf.endswith(b"docx-1"))
+        check("same docx served from cache", pool.submit(b"docx-1").done())
+        shared = pool.submit(b"sleep:0.2 shared")
+        check("same docx in flight shares the job", pool.submit(b"sleep:0.2 shared") is shared)
+        shared.result()
+
+        error = _error(pool, b"error")
+        check("error reply raises PdfConversionError", error is not None and "fake conversion error" in str(error))
+        error = _error(pool, b"nopdf")
+        check("missing PDF raises PdfConversionError", error is not None and "no PDF" in str(error))
+        pids = {_pid(pool.convert(b"pid-%d" % i)) for i in range(4)}
+        check("converters survive error replies", len(warm_pids) == 2 and pids <= warm_pids)
+
+        # Одновременно: зависание достаётся одному конвертеру, падение — другому
+        started = time.perf_counter()
+        hung, crashed = pool.submit(b"sleep:30"), pool.submit(b"crash")
+        error = hung.exception()
+        elapsed = time.perf_counter() - started
+        check(f"timeout raises PdfConversionTimeout ({elapsed:.2f}s)", isinstance(error, PdfConversionTimeout) and elapsed < 3)
+        error = crashed.exception()
+        check("crash raises PdfConversionError", isinstance(error, PdfConversionError) and not isinstance(error, PdfConversionTimeout))
+        after = [pool.submit(b"sleep:0.3 after-1"), pool.submit(b"sleep:0.3 after-2")]
+        pids = {_pid(f.result()) for f in after}
+        check("converters restarted after timeout and crash", len(pids) == 2 and not pids & warm_pids)
+    finally:
+        pool.shutdown()
+
+    pool = PdfConverterPool(FAKE_CONVERTER, workers=1, timeout=5.0, start_timeout=10.0, queue_size=1)
+    try:
+        pool.convert(b"warm")
+        running = pool.submit(b"sleep:0.5 running")
+        time.sleep(0.2)
+        queued = pool.submit(b"sleep:0.1 queued")
+        started = time.perf_counter()
+        rejected = pool.submit(b"rejected")
+        elapsed = time.perf_counter() - started
+        error = rejected.exception(timeout=0)
+        check(
+            f"full queue rejects at once ({elapsed * 1000:.1f}ms)",
+            isinstance(error, PdfConversionError) and "full" in str(error) and elapsed < 0.1,
+        )
+        check("queued jobs still complete", not running.exception() and not queued.exception())
+    finally:
+        pool.shutdown()
+    return failures
+
+
+def main() -> None:
+    if run_smoke():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+# persistence.py
+"""
+Хранение незавершённых диалогов между перезапусками бота.
+
+SqlitePersistence — persistence для PTB: user_data — одна строка на пользователя,
+состояние ConversationHandler — одна строка на диалог (data/state.sqlite3).
+PTB сам копит изменения и отдаёт их раз в update_interval секунд (STATE_FLUSH_INTERVAL);
+здесь они кодируются (снимок, пока хэндлеры не поменяли словарь) и складываются в буфер,
+а запись всей пачки одной транзакцией идёт в отдельном потоке — обработка сообщений
+запись не ждёт. Неудачная запись повторяется с нарастающей паузой.
+
+user_data пишется компактным JSON: datetime → {"$dt": "2025-01-31"} (время — только
+если оно не полночь), Decimal → {"$dec": "1.5"}. Что в JSON не ложится — pickle.
+"""
+import asyncio
+import json
+import logging
+import pickle
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+# Пауза перед повтором неудачной записи (сек): удваивается до WRITE_RETRY_MAX_DELAY
+WRITE_RETRY_DELAY = 1.0
+WRITE_RETRY_MAX_DELAY = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data    BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    name  TEXT NOT NULL,
+    key   TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (name, key)
+) WITHOUT ROWID;
+"""
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is None and value.time() == datetime.min.time():
+            return {"$dt": value.date().isoformat()}
+        return {"$dt": value.isoformat()}
+    if isinstance(value, date):
+        return {"$date": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"$dec": str(value)}
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _json_hook(obj: dict):
+    if len(obj) == 1:
+        (key, value), = obj.items()
+        if key == "$dt":
+            return datetime.fromisoformat(value)
+        if key == "$date":
+            return date.fromisoformat(value)
+        if key == "$dec":
+            return Decimal(value)
+    return obj
+
+
+def encode_user_data(data: dict) -> Union[str, bytes]:
+    """
+    JSON-строка; если в данных есть типы вне JSON — байты pickle.
+    """
+    try:
+        return json.dumps(data, default=_json_default, ensure_ascii=False, separators=(",", ":"))
+    except (TypeError, ValueError):
+        return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def decode_user_data(raw: Union[str, bytes]) -> dict:
+    if isinstance(raw, bytes):
+        return pickle.loads(raw)
+    return json.loads(raw, object_hook=_json_hook)
+
+
+class SqlitePersistence(BasePersistence):
+    """
+    Хранит user_data и состояния диалогов (chat_data, bot_data, callback_data — нет).
+    Вся работа с базой — в одном потоке, соединение живёт там же.
+    """
+
+    def __init__(self, path: Union[str, Path], update_interval: float = 5.0):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = Path(path)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-db")
+        self._conn: Optional[sqlite3.Connection] = None
+        # Закодированный user_data; None — удалить строку
+        self._pending_users: Dict[int, Optional[Union[str, bytes]]] = {}
+        self._pending_conversations: Dict[Tuple[str, str], Optional[object]] = {}
+        self._writer: Optional[asyncio.Task] = None
+        self._retry_wait = False
+        self._closing = False
+
+    async def _call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    # --- чтение (один раз при старте) ---
+
+    def _load_user_data(self) -> Dict[int, dict]:
+        result = {}
+        for user_id, raw in self._connection().execute("SELECT user_id, data FROM user_data"):
+            try:
+                result[user_id] = decode_user_data(raw)
+            except Exception:
+                logging.exception("Cannot restore user_data of %s, dropping it", user_id)
+        return result
+
+    def _load_conversations(self, name: str) -> Dict[tuple, object]:
+        rows = self._connection().execute("SELECT key, state FROM conversations WHERE name = ?", (name,))
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        return await self._call(self._load_user_data)
+
+    async def get_conversations(self, name: str) -> Dict[tuple, object]:
+        return await self._call(self._load_conversations, name)
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    # --- запись: буфер + фоновая пачка ---
+
+    def _write(
+        self,
+        users: Dict[int, Optional[Union[str, bytes]]],
+        conversations: Dict[Tuple[str, str], Optional[object]],
+    ) -> None:
+        conn = self._connection()
+        upsert_users = [(uid, data) for uid, data in users.items() if data is not None]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO user_data (user_id, data) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data",
+                upsert_users,
+            )
+            conn.executemany(
+                "DELETE FROM user_data WHERE user_id = ?",
+                [(uid,) for uid, data in users.items() if data is None],
+            )
+            conn.executemany(
+                "INSERT INTO conversations (name, key, state) VALUES (?, ?, ?) "
+                "ON CONFLICT(name, key) DO UPDATE SET state = excluded.state",
+                [(name, key, json.dumps(state)) for (name, key), state in conversations.items() if state is not None],
+            )
+            conn.executemany(
+                "DELETE FROM conversations WHERE name = ? AND key = ?",
+                [nk for nk, state in conversations.items() if state is None],
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    async def _write_pending(self) -> None:
+        delay = WRITE_RETRY_DELAY
+        while self._pending_users or self._pending_conversations:
+            users, self._pending_users = self._pending_users, {}
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            try:
+                await self._call(self._write, users, conversations)
+                delay = WRITE_RETRY_DELAY
+                continue
+            except Exception:
+                # Не теряем: вернём в буфер под более свежие изменения
+                self._pending_users = {**users, **self._pending_users}
+                self._pending_conversations = {**conversations, **self._pending_conversations}
+                if self._closing:
+                    logging.exception("Cannot save conversation state (%d users), giving up", len(self._pending_users))
+                    break
+                logging.exception("Cannot save conversation state (%d users), retry in %.0fs", len(users), delay)
+            # Повтор не ждёт следующего обновления; flush() прерывает паузу
+            self._retry_wait = True
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                break
+            finally:
+                self._retry_wait = False
+            delay = min(delay * 2, WRITE_RETRY_MAX_DELAY)
+
+    def _schedule_write(self) -> None:
+        # Все update_* одного прогона PTB попадают в буфер раньше, чем стартует задача записи
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.get_running_loop().create_task(self._write_pending())
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        # Кодируем здесь, в event loop: хэндлеры меняют data, пока поток пишет пачку
+        self._pending_users[user_id] = encode_user_data(data)
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._pending_users[user_id] = None
+        self._schedule_write()
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        self._pending_conversations[(name, json.dumps(list(key)))] = new_state
+        self._schedule_write()
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """
+        Остановка бота: дописывает буфер (одна последняя попытка) и закрывает базу.
+        """
+        self._closing = True
+        if self._writer is not None:
+            if self._retry_wait:
+                self._writer.cancel()
+            await self._writer
+        if self._pending_users or self._pending_conversations:
+            await self._write_pending()
+
+        def close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        await self._call(close)
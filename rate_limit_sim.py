@@ -0,0 +1,173 @@
+# rate_limit_sim.py
+"""
+Проверка ограничителя запросов на поддельном Bot API с flood control.
+
+    python rate_limit_sim.py
+
+FloodRequest отвечает 429 (retry_after), как Telegram, если бот превысил
+лимит на чат или на весь бот. Симуляция шлёт всплеск сообщений и документов
+из многих чатов через Bot с TelegramRateLimiter и проверяет: все запросы
+в итоге доставлены, ретраи были, документы уходили раньше сообщений.
+Второй прогон — общий лимит сервера ниже настроенного в боте: после 429 от
+общего лимита бот должен замолчать целиком на retry_after, а не только этот чат.
+Ошибка — код выхода 1.
+"""
+import asyncio
+import json
+import sys
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from telegram.ext import ExtBot
+from telegram.request import BaseRequest, RequestData
+
+import metrics
+from rate_limiter import TelegramRateLimiter
+
+CHATS = 20
+MESSAGES_PER_CHAT = 3
+DOCUMENTS_PER_CHAT = 2
+
+
+class FloodRequest(BaseRequest):
+    """
+    Bot API с лимитами Telegram: не больше chat_limit запросов в чат и global_limit
+    на весь бот за скользящую секунду, сверх — 429 с retry_after.
+    В delivered — (метод, chat_id) успешно принятых запросов по порядку.
+    """
+
+    def __init__(self, global_limit: int = 30, chat_limit: int = 1, retry_after: int = 1):
+        self.global_limit = global_limit
+        self.chat_limit = chat_limit
+        self.retry_after = retry_after
+        self._global: Deque[float] = deque()
+        self._chats: Dict[object, Deque[float]] = defaultdict(deque)
+        self.delivered: List[Tuple[str, object]] = []
+        self.flood_replies = 0
+        # Время прихода каждого запроса с чатом и первого ответа 429
+        self.arrivals: List[float] = []
+        self.first_flood: Optional[float] = None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return 5.0
+
+    @staticmethod
+    def _over(window: Deque[float], now: float, limit: int) -> bool:
+        while window and now - window[0] >= 1.0:
+            window.popleft()
+        return len(window) >= limit
+
+    async def do_request(self, url, method, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None):
+        name = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        chat_id = params.get("chat_id")
+        now = time.monotonic()
+        if name == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "sim", "username": "sim_bot"}
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+        if chat_id is not None:
+            self.arrivals.append(now)
+            if self._over(self._global, now, self.global_limit) or self._over(self._chats[chat_id], now, self.chat_limit):
+                self.flood_replies += 1
+                if self.first_flood is None:
+                    self.first_flood = now
+                body = {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }
+                return 429, json.dumps(body).encode()
+            self._global.append(now)
+            self._chats[chat_id].append(now)
+        self.delivered.append((name, chat_id))
+        result = {
+            "message_id": len(self.delivered),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+        }
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+async def run_simulation() -> List[str]:
+    failures = []
+
+    def check(name: str, ok: bool) -> None:
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        if not ok:
+            failures.append(name)
+
+    request = FloodRequest()
+    # Запас в ведре чата больше, чем допускает сервер, — часть запросов получит 429
+    limiter = TelegramRateLimiter(global_rate=30, chat_rate=1, chat_burst=2, max_retries=5)
+    bot = ExtBot("1:sim", request=request, get_updates_request=FloodRequest(), rate_limiter=limiter)
+    retries_before = metrics.snapshot()["telegram_retry_after_total"]
+
+    async with bot:
+        calls = []
+        for chat_id in range(1, CHATS + 1):
+            for i in range(MESSAGES_PER_CHAT):
+                calls.append(bot.send_message(chat_id, f"сообщение {i}"))
+            for i in range(DOCUMENTS_PER_CHAT):
+                calls.append(bot.send_document(chat_id, b"docx", filename=f"doc{i}.docx"))
+        started = time.monotonic()
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        elapsed = time.monotonic() - started
+
+    errors = [r for r in results if isinstance(r, Exception)]
+    retries = metrics.snapshot()["telegram_retry_after_total"] - retries_before
+    print(
+        f"     {len(results)} запросов за {elapsed:.1f}s, ответов 429: {request.flood_replies}, "
+        f"повторов: {retries:.0f}, ошибок: {len(errors)}"
+    )
+    check("all requests delivered", not errors and len(request.delivered) == len(results))
+    check("flood control was hit and retried", request.flood_replies > 0 and retries == request.flood_replies)
+
+    # Внутри каждого чата документы должны уйти раньше хотя бы части сообщений,
+    # хотя поставлены в очередь после всех сообщений этого чата
+    by_chat: Dict[object, List[str]] = defaultdict(list)
+    for name, chat_id in request.delivered:
+        by_chat[chat_id].append(name)
+    documents_first = sum(order[-1] == "sendMessage" for order in by_chat.values())
+    check("documents served before messages", documents_first == CHATS)
+
+    # Общий лимит: сервер пропускает 10 запросов в секунду на бот, бот настроен на 30
+    request = FloodRequest(global_limit=10, chat_limit=100)
+    limiter = TelegramRateLimiter(global_rate=30, chat_rate=1, chat_burst=1, max_retries=10)
+    bot = ExtBot("1:sim", request=request, get_updates_request=FloodRequest(), rate_limiter=limiter)
+    pauses_before = metrics.snapshot()["telegram_global_pauses_total"]
+    async with bot:
+        results = await asyncio.gather(
+            *(bot.send_message(chat_id, "сообщение") for chat_id in range(1, 2 * CHATS + 1)),
+            return_exceptions=True,
+        )
+    pauses = metrics.snapshot()["telegram_global_pauses_total"] - pauses_before
+    # Запросы, уже отправленные к моменту первого 429, приходят в ту же миллисекунду
+    t0 = request.first_flood or 0.0
+    during_pause = [t for t in request.arrivals if t0 + 0.1 < t < t0 + request.retry_after - 0.1]
+    print(
+        f"     общий лимит: {len(results)} запросов, ответов 429: {request.flood_replies}, "
+        f"пауз всего бота: {pauses:.0f}, запросов во время паузы: {len(during_pause)}"
+    )
+    check("bot-wide flood delivered", not any(isinstance(r, Exception) for r in results))
+    check("bot-wide flood pauses all chats", pauses > 0 and not during_pause)
+    return failures
+
+
+def main() -> None:
+    failures = asyncio.run(run_simulation())
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+# rate_limiter.py
+"""
+Ограничение исходящих запросов к Bot API под flood control Telegram.
+
+Token bucket на весь бот (TG_RATE_GLOBAL запросов/сек) и на каждый чат
+(TG_RATE_CHAT/сек в личке, TG_RATE_GROUP в минуту в группах). Запрос сначала
+ждёт свой чат, потом общий лимит — занятый чат не держит общие токены.
+Когда токенов не хватает, первыми их получают документы, потом обычные сообщения,
+последними — правки (например, «Вы N-й в очереди»).
+
+Если Telegram всё же ответил 429, чат ставится на паузу на retry_after секунд,
+и запрос повторяется до max_retries раз. Если же чат перед запросом ничего не
+отправлял (его ведро было полным) или запрос без чата, превышен не лимит чата,
+а общий — на паузу ставится весь бот.
+Запросы без chat_id (getUpdates, getMe, setWebhook...) не ограничиваются.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import metrics
+
+PRIORITY_DOCUMENT = 0
+PRIORITY_MESSAGE = 1
+PRIORITY_EDIT = 2
+
+_DOCUMENT_ENDPOINTS = {"sendDocument", "sendMediaGroup", "sendPhoto", "sendVideo", "sendAudio"}
+_EDIT_ENDPOINTS = {"editMessageText", "editMessageReplyMarkup", "editMessageCaption", "deleteMessage"}
+
+RATE_LIMIT_WAIT_SECONDS = metrics.histogram("telegram_rate_limit_wait_seconds", "Ожидание токена перед запросом к Bot API")
+RETRY_AFTER_TOTAL = metrics.counter("telegram_retry_after_total", "Ответы 429 (flood control) от Telegram")
+GLOBAL_PAUSES_TOTAL = metrics.counter("telegram_global_pauses_total", "Паузы всего бота из-за общего flood control")
+
+
+def endpoint_priority(endpoint: str) -> int:
+    if endpoint in _DOCUMENT_ENDPOINTS:
+        return PRIORITY_DOCUMENT
+    if endpoint in _EDIT_ENDPOINTS:
+        return PRIORITY_EDIT
+    return PRIORITY_MESSAGE
+
+
+class TokenBucket:
+    """
+    rate токенов в секунду, не больше capacity про запас. Ожидающие получают токены
+    по приоритету (меньше — раньше), при равном — в порядке прихода.
+    pause(seconds) — не выдавать токены до истечения паузы (ответ 429).
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def idle(self) -> bool:
+        """
+        Никто не ждёт и запас полный — ведро можно выбросить.
+        """
+        now = time.monotonic()
+        self._refill(now)
+        return not self._waiters and self._tokens >= self.capacity and now >= self._paused_until
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self, priority: int = PRIORITY_MESSAGE) -> bool:
+        """
+        Ждёт токен. True — ведро было полным: до этого запроса им давно не пользовались.
+        """
+        now = time.monotonic()
+        self._refill(now)
+        if not self._waiters and self._tokens >= 1 and now >= self._paused_until:
+            full = self._tokens >= self.capacity
+            self._tokens -= 1
+            return full
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Токен уже выдан, а запрос отменили — возвращаем
+                self._tokens = min(self.capacity, self._tokens + 1)
+            raise
+        return False
+
+    async def _dispatch(self) -> None:
+        while self._waiters:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._tokens -= 1
+                future.set_result(None)
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """
+    - global_rate: запросов в секунду на весь бот (Telegram: около 30)
+    - chat_rate: запросов в секунду в личный чат (Telegram: около 1, короткие всплески допустимы)
+    - group_rate: запросов в секунду в группу (Telegram: 20 в минуту)
+    - chat_burst: сколько запросов в чат можно отправить подряд без ожидания
+    - max_retries: сколько раз повторять запрос после 429
+    rate_limit_args вызова Bot API: {"priority": ..., "max_retries": ...} — переопределить для запроса.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        group_rate: float = 20 / 60,
+        chat_burst: float = 3.0,
+        max_retries: int = 3,
+    ):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[Union[int, str], TokenBucket] = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 1000:
+                # Вёдра простаивающих чатов не нужны: новое ведро и так полное
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle}
+            group = isinstance(chat_id, str) or int(chat_id) < 0
+            rate = self.group_rate if group else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    def _pause_bot(self, delay: float, endpoint: str) -> None:
+        GLOBAL_PAUSES_TOTAL.inc()
+        self._global.pause(delay)
+        logging.warning("Telegram flood control is bot-wide (%s): all chats paused for %.0fs", endpoint, delay)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                # Лимит не чата — значит, общий; повтор решает вызывающий (например, Updater)
+                RETRY_AFTER_TOTAL.inc()
+                self._pause_bot(float(e.retry_after), endpoint)
+                raise
+
+        options = rate_limit_args or {}
+        priority = options.get("priority", endpoint_priority(endpoint))
+        max_retries = options.get("max_retries", self.max_retries)
+        chat_bucket = self._chat_bucket(chat_id)
+
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            chat_idle = await chat_bucket.acquire(priority)
+            await self._global.acquire(priority)
+            RATE_LIMIT_WAIT_SECONDS.observe(time.monotonic() - started)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                RETRY_AFTER_TOTAL.inc()
+                delay = float(e.retry_after)
+                chat_bucket.pause(delay)
+                if chat_idle:
+                    # Чат до этого молчал — свой лимит он превысить не мог
+                    self._pause_bot(delay, endpoint)
+                if attempt >= max_retries:
+                    raise
+                attempt += 1
+                logging.warning(
+                    "Telegram flood control on %s (chat %s): retry %d/%d in %.0fs",
+                    endpoint, chat_id, attempt, max_retries, delay,
+                )
+
+
+def rate_limiter_from_env() -> TelegramRateLimiter:
+    """
+    TG_RATE_GLOBAL (30/сек), TG_RATE_CHAT (1/сек), TG_RATE_GROUP (20/мин),
+    TG_RATE_BURST (3 подряд в чат), TG_MAX_RETRIES (3).
+    """
+    return TelegramRateLimiter(
+        global_rate=float(os.getenv("TG_RATE_GLOBAL", "30")),
+        chat_rate=float(os.getenv("TG_RATE_CHAT", "1")),
+        group_rate=float(os.getenv("TG_RATE_GROUP", "20")) / 60,
+        chat_burst=float(os.getenv("TG_RATE_BURST", "3")),
+        max_retries=int(os.getenv("TG_MAX_RETRIES", "3")),
+    )
@@ -0,0 +1,107 @@
+# soffice_worker.py
+"""
+Долгоживущий конвертер DOCX → PDF для pdf_pool: один запущенный LibreOffice на процесс.
+
+Запускается интерпретатором, у которого есть модуль uno (python3-uno или python из
+поставки LibreOffice). Протокол — JSON-строки через stdin/stdout:
+    → {"ready": true}                              после старта soffice
+    ← {"src": "/tmp/a.docx", "dst": "/tmp/a.pdf"}
+    → {"ok": true} | {"ok": false, "error": "..."}
+SOFFICE — путь к soffice (по умолчанию soffice из PATH).
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import uno
+from com.sun.star.beans import PropertyValue
+from com.sun.star.connection import NoConnectException
+
+START_TIMEOUT = 60.0
+
+
+def _props(**kwargs):
+    props = []
+    for name, value in kwargs.items():
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        props.append(prop)
+    return tuple(props)
+
+
+def _reply(**kwargs) -> None:
+    sys.stdout.write(json.dumps(kwargs, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+
+def main() -> None:
+    pipe = f"dogovorshik_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+    connect = f"pipe,name={pipe};urp;StarOffice.ComponentContext"
+    # Отдельный профиль: несколько soffice на одной машине не делят блокировку профиля
+    profile = tempfile.mkdtemp(prefix="dogovorshik-lo-")
+    soffice = subprocess.Popen(
+        [
+            os.getenv("SOFFICE", "soffice"),
+            "--headless", "--invisible", "--nologo", "--norestore", "--nodefault", "--nolockcheck",
+            f"-env:UserInstallation={uno.systemPathToFileUrl(profile)}",
+            f"--accept={connect}",
+        ],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    desktop = None
+    try:
+        local = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local)
+        deadline = time.monotonic() + START_TIMEOUT
+        while True:
+            try:
+                ctx = resolver.resolve(f"uno:{connect}")
+                break
+            except NoConnectException:
+                if soffice.poll() is not None or time.monotonic() > deadline:
+                    raise
+                time.sleep(0.2)
+        desktop = ctx.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
+        _reply(ready=True)
+
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            try:
+                doc = desktop.loadComponentFromURL(
+                    uno.systemPathToFileUrl(job["src"]), "_blank", 0, _props(Hidden=True, ReadOnly=True),
+                )
+                try:
+                    doc.storeToURL(uno.systemPathToFileUrl(job["dst"]), _props(FilterName="writer_pdf_Export"))
+                finally:
+                    doc.close(True)
+            except Exception as e:
+                _reply(ok=False, error=str(e) or type(e).__name__)
+            else:
+                _reply(ok=True)
+    finally:
+        if desktop is not None:
+            try:
+                desktop.terminate()
+            except Exception:
+                pass
+        else:
+            soffice.terminate()
+        try:
+            soffice.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            soffice.kill()
+        shutil.rmtree(profile, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# telegram_http.py
+"""
+HTTP-клиенты бота к Bot API: пул соединений, таймауты, прокси, HTTP/2 — из env.
+
+Два отдельных клиента: для отправки (сообщения, документы) и для getUpdates —
+long polling не занимает соединения, нужные загрузкам. Ожидание свободного
+соединения пула измеряется (telegram_<имя>_pool_wait_seconds) и, если долгое, пишется в лог.
+"""
+import asyncio
+import importlib.util
+import logging
+import os
+import time
+from typing import Optional, Tuple
+
+from telegram.error import TimedOut
+from telegram.request import BaseRequest, HTTPXRequest, RequestData
+
+import metrics
+
+# Ожидание соединения дольше этого (сек) попадает в лог
+SLOW_POOL_WAIT_LOG = 1.0
+
+# Тип BaseRequest.DEFAULT_NONE: таймаут не передан в вызове Bot API
+_DefaultValue = type(BaseRequest.DEFAULT_NONE)
+
+
+class PoolTimedHTTPXRequest(HTTPXRequest):
+    """
+    HTTPXRequest, который сам выдаёт соединения пула (семафор размером с пул)
+    и измеряет, сколько запрос ждал свободного. pool_timeout — предел этого ожидания.
+    """
+
+    def __init__(self, name: str, connection_pool_size: int, pool_timeout: Optional[float] = 1.0, **kwargs):
+        super().__init__(connection_pool_size=connection_pool_size, pool_timeout=pool_timeout, **kwargs)
+        self.name = name
+        self.connection_pool_size = connection_pool_size
+        self._pool_timeout = pool_timeout
+        self._slots = asyncio.Semaphore(connection_pool_size)
+        self._wait_seconds = metrics.histogram(
+            f"telegram_{name}_pool_wait_seconds", f"Ожидание свободного соединения ({name})"
+        )
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> Tuple[int, bytes]:
+        limit = self._pool_timeout if isinstance(pool_timeout, _DefaultValue) else pool_timeout
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), limit)
+        except asyncio.TimeoutError as e:
+            self._wait_seconds.observe(time.perf_counter() - started)
+            raise TimedOut(
+                f"Pool timeout: all {self.connection_pool_size} {self.name} connections are busy "
+                f"for {limit}s. Request was not sent to Telegram."
+            ) from e
+        waited = time.perf_counter() - started
+        self._wait_seconds.observe(waited)
+        if waited > SLOW_POOL_WAIT_LOG:
+            logging.warning(
+                "Bot API %s waited %.1fs for a free %s connection (pool size %d)",
+                url.rsplit("/", 1)[-1], waited, self.name, self.connection_pool_size,
+            )
+        try:
+            # Соединение уже выделено семафором — пул httpx ждать не придётся
+            return await super().do_request(
+                url, method, request_data,
+                read_timeout=read_timeout, write_timeout=write_timeout,
+                connect_timeout=connect_timeout, pool_timeout=pool_timeout,
+            )
+        finally:
+            self._slots.release()
+
+
+def _float_env(name: str, default: str) -> Optional[float]:
+    """
+    Пустое значение или 0 — без таймаута.
+    """
+    value = float(os.getenv(name, default) or 0)
+    return value or None
+
+
+def http_version_from_env() -> str:
+    """
+    TG_HTTP2=1 — HTTP/2, если установлен h2 (pip install "httpx[http2]"); иначе HTTP/1.1.
+    """
+    if os.getenv("TG_HTTP2", "0") != "1":
+        return "1.1"
+    if importlib.util.find_spec("h2") is None:
+        logging.warning("TG_HTTP2=1, but the 'h2' package is not installed; using HTTP/1.1")
+        return "1.1"
+    return "2"
+
+
+def requests_from_env() -> Tuple[PoolTimedHTTPXRequest, PoolTimedHTTPXRequest]:
+    """
+    Клиенты (для отправки, для getUpdates). Env:
+    TG_POOL_SIZE (256), TG_CONNECT_TIMEOUT (5), TG_READ_TIMEOUT (10), TG_WRITE_TIMEOUT (10),
+    TG_MEDIA_WRITE_TIMEOUT (60 — загрузка документов), TG_POOL_TIMEOUT (5),
+    TG_UPDATES_POOL_SIZE (1), TG_PROXY, TG_HTTP2.
+    """
+    proxy = os.getenv("TG_PROXY") or None
+    http_version = http_version_from_env()
+    connect_timeout = _float_env("TG_CONNECT_TIMEOUT", "5")
+    read_timeout = _float_env("TG_READ_TIMEOUT", "10")
+    write_timeout = _float_env("TG_WRITE_TIMEOUT", "10")
+    pool_timeout = _float_env("TG_POOL_TIMEOUT", "5")
+
+    request = PoolTimedHTTPXRequest(
+        "send",
+        connection_pool_size=int(os.getenv("TG_POOL_SIZE", "256")),
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        write_timeout=write_timeout,
+        media_write_timeout=_float_env("TG_MEDIA_WRITE_TIMEOUT", "60"),
+        pool_timeout=pool_timeout,
+        proxy=proxy,
+        http_version=http_version,
+    )
+    # getUpdates сам добавляет к read_timeout время long polling
+    updates_request = PoolTimedHTTPXRequest(
+        "get_updates",
+        connection_pool_size=int(os.getenv("TG_UPDATES_POOL_SIZE", "1")),
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        write_timeout=write_timeout,
+        pool_timeout=pool_timeout,
+        proxy=proxy,
+        http_version=http_version,
+    )
+    logging.info(
+        "Bot API client: pool %d, HTTP/%s%s", request.connection_pool_size, http_version,
+        ", via proxy" if proxy else "",
+    )
+    return request, updates_request
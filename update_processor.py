@@ -0,0 +1,113 @@
+# update_processor.py
+"""
+Параллельная обработка обновлений с порядком внутри чата.
+
+Обновления разных чатов обрабатываются одновременно (не больше max_concurrent_updates),
+обновления одного чата — строго по очереди прихода: ConversationHandler видит
+сообщения пользователя в том же порядке, что и без параллельности.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Dict, Hashable, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+
+UPDATES_WAITING = metrics.gauge("updates_waiting", "Обновления, ждущие завершения предыдущих в своём чате")
+UPDATES_IN_PROGRESS = metrics.gauge("updates_in_progress", "Обновления в обработке")
+UPDATES_TOTAL = metrics.counter("updates_total", "Обработано обновлений")
+UPDATE_WAIT_SECONDS = metrics.histogram("update_wait_seconds", "Ожидание обновления своей очереди в чате")
+UPDATE_PROCESS_SECONDS = metrics.histogram("update_process_seconds", "Время обработки обновления")
+
+# Ожидание дольше этого (сек) попадает в лог
+SLOW_WAIT_LOG = 5.0
+
+
+def _order_key(update: object) -> Hashable:
+    """
+    Чат (или пользователь, если чата нет); обновления без них не упорядочиваются.
+    """
+    if isinstance(update, Update):
+        if update.effective_chat is not None:
+            return ("chat", update.effective_chat.id)
+        if update.effective_user is not None:
+            return ("user", update.effective_user.id)
+    return ("update", id(update))
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Слоты max_concurrent_updates выдаёт базовый класс (process_update), а здесь,
+    в do_process_update, обновление ждёт свой чат: asyncio.Lock отдаёт блокировку
+    в порядке ожидания. Ожидающее обновление занимает слот, поэтому хэндлеры
+    не должны держать чат долго — генерация документов идёт неблокирующим хэндлером.
+    """
+
+    def __init__(self, max_concurrent_updates: int, log_interval: float = 0.0):
+        super().__init__(max_concurrent_updates)
+        # Блокировка чата и число обновлений, которые её держат или ждут
+        self._chats: Dict[Hashable, Tuple[asyncio.Lock, int]] = {}
+        # Раз в log_interval сек — строка со сводкой очереди в лог (0 — не писать)
+        self.log_interval = log_interval
+        self._log_task: Optional[asyncio.Task] = None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        key = _order_key(update)
+        lock, users = self._chats.get(key) or (asyncio.Lock(), 0)
+        self._chats[key] = (lock, users + 1)
+        queued_at = time.perf_counter()
+        waiting = True
+        UPDATES_WAITING.inc()
+        try:
+            async with lock:
+                waited = time.perf_counter() - queued_at
+                waiting = False
+                UPDATES_WAITING.dec()
+                UPDATE_WAIT_SECONDS.observe(waited)
+                if waited > SLOW_WAIT_LOG:
+                    logging.warning("Update waited %.1fs for its %s", waited, key[0])
+                UPDATES_IN_PROGRESS.inc()
+                started = time.perf_counter()
+                try:
+                    await coroutine
+                finally:
+                    UPDATES_IN_PROGRESS.dec()
+                    UPDATE_PROCESS_SECONDS.observe(time.perf_counter() - started)
+                    UPDATES_TOTAL.inc()
+        finally:
+            if waiting:
+                # Отменено до начала обработки: корутина так и не запустится
+                UPDATES_WAITING.dec()
+                if asyncio.iscoroutine(coroutine):
+                    coroutine.close()
+            lock, users = self._chats[key]
+            if users == 1:
+                del self._chats[key]
+            else:
+                self._chats[key] = (lock, users - 1)
+
+    async def _log_stats(self) -> None:
+        last = UPDATE_WAIT_SECONDS.snapshot()
+        while True:
+            await asyncio.sleep(self.log_interval)
+            now = UPDATE_WAIT_SECONDS.snapshot()
+            count = now["count"] - last["count"]
+            if count:
+                logging.info(
+                    "Updates: %d processed, avg wait %.3fs, waiting %d, in progress %d/%d",
+                    count, (now["sum"] - last["sum"]) / count,
+                    UPDATES_WAITING.value, UPDATES_IN_PROGRESS.value, self.max_concurrent_updates,
+                )
+            last = now
+
+    async def initialize(self) -> None:
+        if self.log_interval > 0 and self._log_task is None:
+            self._log_task = asyncio.create_task(self._log_stats())
+
+    async def shutdown(self) -> None:
+        if self._log_task is not None:
+            self._log_task.cancel()
+            self._log_task = None
@@ -0,0 +1,285 @@
+# webhook.py
+"""
+Режим webhook (BOT_MODE=webhook) и локальный служебный HTTP-сервер.
+
+Webhook — Application.run_webhook из PTB (python-telegram-bot[webhooks], на tornado):
+PTB сам сверяет заголовок X-Telegram-Bot-Api-Secret-Token с WEBHOOK_SECRET, вызывает
+setWebhook с WEBHOOK_URL и ведёт жизненный цикл приложения (post_init, post_stop...).
+Несколько реплик за балансировщиком принимают обновления на один и тот же WEBHOOK_URL.
+
+Служебный сервер (start_service_server, METRICS_LISTEN) работает в обоих режимах
+и наружу не публикуется:
+- GET METRICS_PATH — метрики в формате Prometheus;
+- GET HEALTH_PATH — 200 {"status": "ok"}, пока приложение работает (для оркестратора).
+Это минимальный HTTP/1.1-сервер на asyncio (Content-Length, keep-alive, без chunked):
+два GET-маршрута не стоят зависимости от веб-фреймворка. Маршруты добавляются через
+ServiceServer.route(), обработчик получает HttpRequest и возвращает HttpResponse.
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+
+import metrics
+
+# Маршруты служебного сервера — GET без тела; всё крупнее — не запрос к нему
+MAX_BODY = 1 << 16
+MAX_HEADERS = 1 << 14
+# Сколько держать простаивающее keep-alive соединение (сек)
+IDLE_TIMEOUT = 75.0
+# Сколько ждать тело запроса после заголовков (сек)
+BODY_TIMEOUT = 10.0
+
+_REASONS = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+    408: "Request Timeout", 411: "Length Required", 413: "Payload Too Large", 503: "Service Unavailable",
+}
+
+
+class HttpRequest(NamedTuple):
+    method: str
+    path: str
+    headers: Dict[str, str]  # имена в нижнем регистре
+    body: bytes
+
+
+class HttpResponse(NamedTuple):
+    status: int = 200
+    body: bytes = b""
+    content_type: str = "text/plain; charset=utf-8"
+
+
+Handler = Callable[[HttpRequest], Awaitable[HttpResponse]]
+
+
+class _BadRequest(Exception):
+    def __init__(self, status: int):
+        self.status = status
+
+
+def _json_response(status: int, payload: dict) -> HttpResponse:
+    return HttpResponse(status, json.dumps(payload).encode(), "application/json")
+
+
+class ServiceServer:
+    """
+    Минимальный HTTP/1.1-сервер: Content-Length, keep-alive, без chunked.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9100):
+        self.host = host
+        self.port = port
+        self._routes: Dict[Tuple[str, str], Handler] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def route(self, method: str, path: str, handler: Handler) -> None:
+        self._routes[(method.upper(), path)] = handler
+
+    @property
+    def listening(self) -> bool:
+        return self._server is not None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        """
+        Фактический адрес (при port=0 — выданный системой порт).
+        """
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        logging.info("HTTP server listening on %s:%s", *self.address)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[HttpRequest]:
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT)
+        except asyncio.IncompleteReadError as e:
+            if e.partial:
+                raise _BadRequest(400) from None
+            return None
+        except asyncio.LimitOverrunError:
+            raise _BadRequest(413) from None
+        except asyncio.TimeoutError:
+            return None
+        if len(head) > MAX_HEADERS:
+            raise _BadRequest(413)
+
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise _BadRequest(400) from None
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, sep, value = line.partition(":")
+                if not sep:
+                    raise _BadRequest(400)
+                headers[name.strip().lower()] = value.strip()
+
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise _BadRequest(411)
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            raise _BadRequest(400) from None
+        if length < 0:
+            raise _BadRequest(400)
+        if length > MAX_BODY:
+            raise _BadRequest(413)
+        try:
+            body = await asyncio.wait_for(reader.readexactly(length), BODY_TIMEOUT) if length else b""
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+            raise _BadRequest(408) from None
+        return HttpRequest(method.upper(), target.split("?", 1)[0], headers, body)
+
+    async def _dispatch(self, request: HttpRequest) -> HttpResponse:
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            known = any(path == request.path for _, path in self._routes)
+            return HttpResponse(405 if known else 404, _REASONS[405 if known else 404].encode())
+        try:
+            return await handler(request)
+        except Exception:
+            logging.exception("HTTP handler failed: %s %s", request.method, request.path)
+            return HttpResponse(503, b"internal error")
+
+    @staticmethod
+    def _write(writer: asyncio.StreamWriter, response: HttpResponse, keep_alive: bool) -> None:
+        reason = _REASONS.get(response.status, "Unknown")
+        head = (
+            f"HTTP/1.1 {response.status} {reason}\r\n"
+            f"Content-Type: {response.content_type}\r\n"
+            f"Content-Length: {len(response.body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + response.body)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except _BadRequest as e:
+                    self._write(writer, HttpResponse(e.status, _REASONS[e.status].encode()), keep_alive=False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                response = await self._dispatch(request)
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                self._write(writer, response, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+
+def health_routes(server: ServiceServer, app: Application, path: str = "/healthz") -> None:
+    """
+    GET path — 200, пока приложение работает, 503 — при остановке. Метрик в ответе нет.
+    """
+
+    async def health(_: HttpRequest) -> HttpResponse:
+        if app.running:
+            return _json_response(200, {"status": "ok"})
+        return _json_response(503, {"status": "stopping"})
+
+    server.route("GET", path, health)
+
+
+def metrics_routes(server: ServiceServer, path: str = "/metrics") -> None:
+    """
+    GET path — все метрики процесса в текстовом формате Prometheus.
+    """
+
+    async def scrape(_: HttpRequest) -> HttpResponse:
+        return HttpResponse(200, metrics.exposition().encode(), metrics.CONTENT_TYPE)
+
+    server.route("GET", path, scrape)
+
+
+_service_server: Optional[ServiceServer] = None
+
+
+async def start_service_server(
+    app: Optional[Application] = None,
+    listen: Optional[str] = None,
+    metrics_path: Optional[str] = None,
+    health_path: Optional[str] = None,
+) -> Optional[ServiceServer]:
+    """
+    Локальный служебный сервер: метрики и (если передан app) health-check.
+    Без аргументов — из env: METRICS_LISTEN (127.0.0.1:9100; пусто или off — не запускать),
+    METRICS_PATH (/metrics), HEALTH_PATH (/healthz).
+    """
+    global _service_server
+    listen = os.getenv("METRICS_LISTEN", "127.0.0.1:9100") if listen is None else listen
+    if not listen or listen.lower() == "off" or _service_server is not None:
+        return _service_server
+    server = ServiceServer(*parse_listen(listen))
+    metrics_routes(server, metrics_path or os.getenv("METRICS_PATH", "/metrics"))
+    if app is not None:
+        health_routes(server, app, health_path or os.getenv("HEALTH_PATH", "/healthz"))
+    try:
+        await server.start()
+    except OSError as e:
+        # Занятый порт (например, вторая реплика на той же машине) не должен ронять бота
+        logging.warning("Service server not started on %s: %s", listen, e)
+        return None
+    _service_server = server
+    return server
+
+
+async def shutdown_service_server() -> None:
+    global _service_server
+    if _service_server is not None:
+        await _service_server.stop()
+        _service_server = None
+
+
+def parse_listen(listen: str) -> Tuple[str, int]:
+    """
+    «0.0.0.0:8080», «:8080» или «8080».
+    """
+    host, sep, port = listen.rpartition(":")
+    if not sep:
+        host, port = "", listen
+    return host.strip("[]") or "0.0.0.0", int(port)
+
+
+def run_webhook(app: Application) -> None:
+    """
+    Webhook-режим (Application.run_webhook) с настройками из env:
+    WEBHOOK_SECRET и WEBHOOK_URL (публичный https-адрес для setWebhook) — обязательны,
+    WEBHOOK_LISTEN (0.0.0.0:8080), WEBHOOK_PATH (/telegram).
+    """
+    secret = os.getenv("WEBHOOK_SECRET", "")
+    if not secret:
+        raise RuntimeError("WEBHOOK_SECRET is not set. It is required in webhook mode.")
+    url = os.getenv("WEBHOOK_URL", "")
+    if not url:
+        raise RuntimeError("WEBHOOK_URL is not set. It is required in webhook mode (setWebhook).")
+    host, port = parse_listen(os.getenv("WEBHOOK_LISTEN", "0.0.0.0:8080"))
+    app.run_webhook(
+        listen=host,
+        port=port,
+        url_path=os.getenv("WEBHOOK_PATH", "/telegram"),
+        webhook_url=url,
+        secret_token=secret,
+        allowed_updates=Update.ALL_TYPES,
+        close_loop=False,
+    )
@@ -0,0 +1,199 @@
+# webhook_smoke.py
+"""
+Сквозная проверка webhook-режима без Telegram.
+
+    python webhook_smoke.py
+
+Поднимает бот с настоящими хэндлерами на webhook-сервере PTB (как run_webhook),
+шлёт JSON обновлений (как Telegram) и проверяет ответы: setWebhook с секретом,
+проверку секрета, ответ бота на /start. Затем — служебный сервер: health, метрики
+и ошибки разбора запроса (большие заголовки, плохой Content-Length, chunked,
+медленное тело). Исходящие запросы к Bot API перехватываются OfflineRequest,
+состояние диалогов — во временном каталоге. Ошибка — код выхода 1.
+"""
+import asyncio
+import json
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest, RequestData
+
+from handlers import conv_handler
+from persistence import SqlitePersistence
+from update_processor import ChatOrderedUpdateProcessor
+import webhook
+from webhook import shutdown_service_server, start_service_server
+
+SECRET = "smoke-secret"
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+PATH = "/telegram"
+
+
+class OfflineRequest(BaseRequest):
+    """
+    Bot API без сети: getMe и send* отвечают правдоподобным JSON, всё записывается в calls.
+    """
+
+    def __init__(self):
+        self.calls: List[Tuple[str, dict]] = []
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return 5.0
+
+    async def do_request(self, url, method, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None):
+        name = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls.append((name, params))
+        if name == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "smoke", "username": "smoke_bot"}
+        elif name.startswith("send"):
+            result = {
+                "message_id": len(self.calls),
+                "date": int(time.time()),
+                "chat": {"id": params.get("chat_id"), "type": "private"},
+                "text": str(params.get("text", "")),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def fake_update(update_id: int, text: str, user_id: int = 1001) -> dict:
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Smoke"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+async def _http(port: int, method: str, path: str, body: bytes = b"", headers: Optional[dict] = None) -> int:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    head = [f"{method} {path} HTTP/1.1", "Host: localhost", f"Content-Length: {len(body)}", "Connection: close"]
+    head += [f"{k}: {v}" for k, v in (headers or {}).items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+    await writer.drain()
+    status_line = await reader.readline()
+    await reader.read()
+    writer.close()
+    return int(status_line.split()[1])
+
+
+async def _raw(port: int, data: bytes) -> int:
+    """
+    Отправляет байты как есть и возвращает код ответа (0 — сервер закрыл соединение молча).
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(data)
+    await writer.drain()
+    status_line = await asyncio.wait_for(reader.readline(), 5)
+    writer.close()
+    return int(status_line.split()[1]) if status_line else 0
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_smoke() -> List[str]:
+    failures = []
+
+    def check(name: str, ok: bool) -> None:
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        if not ok:
+            failures.append(name)
+
+    with tempfile.TemporaryDirectory(prefix="dogovorshik-smoke-") as tmp:
+        request = OfflineRequest()
+        app = (
+            Application.builder().token("1:smoke")
+            .request(request).get_updates_request(OfflineRequest())
+            .persistence(SqlitePersistence(Path(tmp) / "state.sqlite3"))
+            .concurrent_updates(ChatOrderedUpdateProcessor(4))
+            .build()
+        )
+        app.add_handler(conv_handler)
+
+        # То же, что делает Application.run_webhook, но внутри уже запущенного event loop
+        port = _free_port()
+        await app.initialize()
+        await app.updater.start_webhook(
+            listen="127.0.0.1", port=port, url_path=PATH, webhook_url=f"https://example.invalid{PATH}",
+            secret_token=SECRET, allowed_updates=Update.ALL_TYPES,
+        )
+        await app.start()
+        # Порт 0 — любой свободный; реальный порт узнаём у сервера после старта
+        webhook.BODY_TIMEOUT = 0.3
+        service = await start_service_server(app, listen="127.0.0.1:0")
+        service_port = service.address[1]
+        try:
+            registered = [p for n, p in request.calls if n == "setWebhook"]
+            check("setWebhook with secret", bool(registered) and registered[0].get("secret_token") == SECRET)
+
+            secret = {SECRET_HEADER: SECRET, "Content-Type": "application/json"}
+            update = json.dumps(fake_update(1, "/start")).encode()
+            check("unknown path 404", await _http(port, "GET", "/nope") == 404)
+            check("no secret 403", await _http(port, "POST", PATH, update, {"Content-Type": "application/json"}) == 403)
+            wrong = {SECRET_HEADER: "x", "Content-Type": "application/json"}
+            check("wrong secret 403", await _http(port, "POST", PATH, update, wrong) == 403)
+            # PTB не ловит ошибку разбора JSON — tornado отвечает 500, обновление не принято
+            check("bad json rejected", await _http(port, "POST", PATH, b"{", secret) >= 400)
+            check("update 200", await _http(port, "POST", PATH, update, secret) == 200)
+
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline and not any(n == "sendMessage" for n, _ in request.calls):
+                await asyncio.sleep(0.05)
+            replies = [p.get("text") for n, p in request.calls if n == "sendMessage"]
+            check("bot replied to /start", replies == ["Выберите договор:"])
+
+            # Служебный сервер: маршруты и ошибки разбора запроса
+            check("health 200", await _http(service_port, "GET", "/healthz") == 200)
+            check("metrics 200", await _http(service_port, "GET", "/metrics") == 200)
+            check("wrong method 405", await _http(service_port, "POST", "/metrics") == 405)
+            huge = b"GET /metrics HTTP/1.1\r\nX-Big: " + b"a" * (webhook.MAX_HEADERS + 1) + b"\r\n\r\n"
+            check("oversized headers 413", await _raw(service_port, huge) == 413)
+            bad_length = b"POST /metrics HTTP/1.1\r\nContent-Length: ten\r\n\r\n"
+            check("bad Content-Length 400", await _raw(service_port, bad_length) == 400)
+            chunked = b"POST /metrics HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n3\r\nabc\r\n0\r\n\r\n"
+            check("chunked body 411", await _raw(service_port, chunked) == 411)
+            started = time.monotonic()
+            slow = b"POST /metrics HTTP/1.1\r\nContent-Length: 10\r\n\r\nabc"
+            check("slow body 408", await _raw(service_port, slow) == 408 and time.monotonic() - started < 2)
+            check("garbage request line 400", await _raw(service_port, b"hello\r\n\r\n") == 400)
+        finally:
+            await app.updater.stop()
+            await app.stop()
+            check("health 503 after stop", await _http(service_port, "GET", "/healthz") == 503)
+            await shutdown_service_server()
+            await app.shutdown()
+    return failures
+
+
+def main() -> None:
+    failures = asyncio.run(run_smoke())
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()